@@ -1,3 +1,9 @@
 from django.contrib import admin
+from billing.models import Payment, PaymentOutbox, StripeCustomer, StripeEvent, SavedPaymentMethod
 
 # Register your models here.
+admin.site.register(Payment)
+admin.site.register(PaymentOutbox)
+admin.site.register(StripeCustomer)
+admin.site.register(StripeEvent)
+admin.site.register(SavedPaymentMethod)
@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.services.export import FORMATTERS, export_rows, month_range
+
+
+class Command(BaseCommand):
+    help = 'Export rentals with their payments as CSV or NDJSON with constant memory use.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATTERS), default='csv')
+        parser.add_argument('--month', help='Only rentals started in this month, YYYY-MM.')
+        parser.add_argument('--output', help='File to write, stdout by default.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = end = None
+        if options['month']:
+            try:
+                start, end = month_range(options['month'])
+            except ValueError:
+                raise CommandError('--month must be YYYY-MM')
+
+        formatter, _ = FORMATTERS[options['format']]
+        lines = formatter(export_rows(start, end, chunk_size=options['chunk_size']))
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from billing.services.settlement import SettlementWorker
+
+
+class Command(BaseCommand):
+    help = 'Settle ended rides with Stripe in rate-limited batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SETTLEMENT_BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=settings.SETTLEMENT_CONCURRENCY)
+        parser.add_argument('--once', action='store_true', help='Settle one batch and exit.')
+
+    def handle(self, *args, **options):
+        worker = SettlementWorker(batch_size=options['batch_size'], concurrency=options['concurrency'])
+        try:
+            while True:
+                counts = worker.run_batch()
+                if counts['entries']:
+                    self.stdout.write(
+                        f"settled={counts['settled']} retried={counts['retried']} failed={counts['failed']} skipped={counts['skipped']}"
+                    )
+                if options['once']:
+                    return
+                if counts['entries'] < worker.batch_size:
+                    time.sleep(settings.SETTLEMENT_POLL_INTERVAL)
+        finally:
+            worker.close()
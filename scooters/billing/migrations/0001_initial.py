@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-17 16:07
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('rental', '0004_rental'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hold_amount', models.DecimalField(decimal_places=2, default=50, max_digits=10)),
+                ('final_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Proccessing'), ('authorized', 'Authorized'), ('captured', 'Captured'), ('failed', 'Failed')], default='pending', max_length=15)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('stripe_customer_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('stripe_payment_method_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('stripe_hold_intent_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('stripe_final_intent_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('hold_amount_minor', models.BigIntegerField(default=5000)),
+                ('final_amount_minor', models.BigIntegerField(default=0)),
+                ('rental', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment', to='rental.rental')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PaymentOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('create_hold', 'Create Hold'), ('cancel_hold', 'Cancel Hold'), ('charge_final', 'Charge Final')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=15)),
+                ('idempotency_key', models.CharField(max_length=255, unique=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='billing.payment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='billing_pay_status_f9d13a_idx')],
+            },
+        ),
+    ]
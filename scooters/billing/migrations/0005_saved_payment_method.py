@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0004_stripeevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='manual_capture',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='paymentoutbox',
+            name='action',
+            field=models.CharField(choices=[('create_hold', 'Create Hold'), ('cancel_hold', 'Cancel Hold'), ('charge_final', 'Charge Final'), ('capture_hold', 'Capture Hold')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='SavedPaymentMethod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_method_id', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='saved_payment_method', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
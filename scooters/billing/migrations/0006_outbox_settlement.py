@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_saved_payment_method'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentoutbox',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='paymentoutbox',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='outbox_pending_idx'),
+        ),
+    ]
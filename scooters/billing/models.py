@@ -1,9 +1,34 @@
 from decimal import Decimal
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
+
+from django.contrib.auth.models import User
 
 from rental.models import Rental
 
+
+class StripeCustomer(models.Model):
+    """Local user -> Stripe customer mapping so rides never need Customer.search."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stripe_customer')
+    customer_id = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.user_id} - {self.customer_id}'
+
+
+class SavedPaymentMethod(models.Model):
+    """Card saved off-session through a SetupIntent, used to pre-authorize rides."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='saved_payment_method')
+    payment_method_id = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.user_id} - {self.payment_method_id}'
+
+
 class Payment(models.Model):
     class Status(models.TextChoices):
         PENDING = 'pending'
@@ -22,10 +47,85 @@ class Payment(models.Model):
 
     stripe_customer_id = models.CharField(max_length=255, blank=True, null=True)
     stripe_payment_method_id = models.CharField(max_length=255, blank=True, null=True)
-    stripe_hold_intent_id = models.CharField(max_length=255, blank=True, null=True)
-    stripe_final_intent_id = models.CharField(max_length=255, blank=True, null=True)
+    # Unique (and so indexed): webhooks resolve payments by intent id
+    stripe_hold_intent_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    stripe_final_intent_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
 
     hold_amount_minor = models.BigIntegerField(default=5000)
     final_amount_minor = models.BigIntegerField(default=0)
+    # Hold is a manual-capture authorization on the saved payment method, settled by partial capture
+    manual_capture = models.BooleanField(default=False)
+
+
+class PaymentOutbox(models.Model):
+    """Stripe call recorded inside the rental transaction and performed after commit."""
+    class Action(models.TextChoices):
+        CREATE_HOLD = 'create_hold'
+        CANCEL_HOLD = 'cancel_hold'
+        CHARGE_FINAL = 'charge_final'
+        CAPTURE_HOLD = 'capture_hold'
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        PROCESSING = 'processing'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    payment = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='outbox')
+    action = models.CharField(max_length=20, choices=Action.choices)
+    status = models.CharField(max_length=15, choices=Status.choices, default=Status.PENDING)
+    idempotency_key = models.CharField(max_length=255, unique=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Retry not before this time, set with jittered backoff after a retryable error
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+            # Settlement worker: pending entries in id order
+            models.Index(fields=['id'],
+            condition=models.Q(status='pending'),
+            name='outbox_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.action} - payment {self.payment_id} - {self.status}'
+
+
+class StripeEvent(models.Model):
+    """Durable log of verified webhook events, keyed by Stripe event id."""
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        PROCESSED = 'processed'
+        FAILED = 'failed'
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    intent_id = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    # Stripe's event timestamp, orders events of the same intent
+    created = models.BigIntegerField(default=0)
+    payload = models.JSONField()
+    status = models.CharField(max_length=15, choices=Status.choices, default=Status.PENDING)
+    error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    # Set while the event waits for its payment to record the intent id
+    retry_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created', 'id'],
+            condition=models.Q(status='pending'),
+            name='stripe_event_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.event_id} - {self.type} - {self.status}'
 
 # Create your models here.
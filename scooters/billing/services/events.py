@@ -0,0 +1,155 @@
+"""
+Webhook event log.
+
+The webhook only verifies and records events; process_pending_events applies
+them to payments in batches, in Stripe order per payment intent. An event
+can arrive before the outbox worker has stored its intent id on the payment;
+it then stays pending and is retried for STRIPE_EVENT_UNMATCHED_TTL seconds.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Min
+from django.utils import timezone
+
+from billing.models import Payment, StripeEvent
+from billing.services.payment_methods import save_from_setup_intent
+
+DISPATCH_KEY = 'stripe:events:dispatch'
+
+
+class PaymentNotRecorded(Exception):
+    """No payment holds the event's intent id yet."""
+
+
+def payment_for_intent(intent_id):
+    """Resolve a hold or final intent id to its payment in one indexed query."""
+    return Payment.objects.filter(
+        Q(stripe_hold_intent_id=intent_id) | Q(stripe_final_intent_id=intent_id)
+    ).first()
+
+
+def record_event(event, payload) -> bool:
+    """Persist a verified event. Returns False for a redelivery of a known event."""
+    obj = event['data']['object']
+    _, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'type': event['type'],
+            'intent_id': obj.get('id', '') if obj.get('object') == 'payment_intent' else '',
+            'created': event.get('created') or 0,
+            'payload': payload,
+        },
+    )
+    if created:
+        transaction.on_commit(schedule_processing, robust=True)
+    return created
+
+
+def schedule_processing():
+    """Enqueue one processing run per batch window, so a burst is handled as one batch."""
+    from billing.tasks import process_stripe_events
+    delay = settings.STRIPE_EVENT_BATCH_DELAY
+    if cache.add(DISPATCH_KEY, 1, timeout=delay):
+        process_stripe_events.apply_async(countdown=delay)
+
+
+def apply_event(event):
+    """Apply one payment_intent or setup_intent event. Other event types are only logged."""
+    if event.type == 'setup_intent.succeeded':
+        save_from_setup_intent(event.payload['data']['object'])
+        return
+
+    if event.type not in ('payment_intent.succeeded', 'payment_intent.payment_failed'):
+        return
+
+    pi = event.payload['data']['object']
+    pi_id = pi['id']
+    payment = payment_for_intent(pi_id)
+    if payment is None:
+        raise PaymentNotRecorded(f'No payment for intent {pi_id}')
+
+    # Handle payment_intent.succeeded event
+    if event.type == 'payment_intent.succeeded':
+        pm_id = pi.get('payment_method')
+
+        # Hold is confirmed
+        if payment.stripe_hold_intent_id == pi_id:
+            if pm_id and not payment.stripe_payment_method_id:
+                payment.stripe_payment_method_id = pm_id
+                payment.status = Payment.Status.AUTHORIZED
+                payment.save(update_fields=['stripe_payment_method_id', 'status'])
+
+        # Final charge succeeded
+        else:
+            payment.status = Payment.Status.CAPTURED
+            payment.save(update_fields=['status'])
+
+    # Handle payment_intent.payment_failed event
+    else:
+        # Update payment status if hold or final payment failed
+        payment.status = Payment.Status.FAILED
+        payment.save(update_fields=['status'])
+
+
+@transaction.atomic
+def process_pending_events(batch_size: int) -> int:
+    """
+    Apply one batch of pending events. Returns the number of events handled.
+
+    An event is held back while an older pending event of the same intent is
+    locked by another worker or waiting for its payment, so every intent sees
+    its events in Stripe order.
+    """
+    now = timezone.now()
+    events = list(
+        StripeEvent.objects.select_for_update(skip_locked=True)
+        .filter(status=StripeEvent.Status.PENDING)
+        .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=now))
+        .order_by('created', 'id')[:batch_size]
+    )
+    if not events:
+        return 0
+
+    batch_ids = [event.id for event in events]
+    intent_ids = {event.intent_id for event in events if event.intent_id}
+    held_back_after = dict(
+        StripeEvent.objects
+        .filter(intent_id__in=intent_ids, status=StripeEvent.Status.PENDING)
+        .exclude(id__in=batch_ids)
+        .values('intent_id')
+        .annotate(first_created=Min('created'))
+        .values_list('intent_id', 'first_created')
+    )
+
+    unmatched_until = now - timedelta(seconds=settings.STRIPE_EVENT_UNMATCHED_TTL)
+    handled = []
+    deferred = []
+    for event in events:
+        first_elsewhere = held_back_after.get(event.intent_id)
+        if first_elsewhere is not None and first_elsewhere < event.created:
+            continue
+        try:
+            with transaction.atomic():
+                apply_event(event)
+            event.status = StripeEvent.Status.PROCESSED
+        except PaymentNotRecorded as e:
+            event.error = str(e)
+            if event.received_at > unmatched_until:
+                event.retry_at = now + timedelta(seconds=settings.STRIPE_EVENT_RETRY_DELAY)
+                deferred.append(event)
+                # Later events of the intent wait behind it
+                held_back_after[event.intent_id] = event.created
+                continue
+            # Not one of our intents
+            event.status = StripeEvent.Status.PROCESSED
+        except Exception as e:
+            event.status = StripeEvent.Status.FAILED
+            event.error = str(e)
+        event.processed_at = now
+        handled.append(event)
+
+    StripeEvent.objects.bulk_update(handled + deferred, ['status', 'error', 'processed_at', 'retry_at'])
+    return len(handled)
@@ -0,0 +1,83 @@
+"""
+Constant-memory export of rental and payment history.
+
+Rows are read with values_list().iterator() and the Rental <-> Payment join is
+done in SQL; the formatters yield one encoded line at a time so they can feed
+a StreamingHttpResponse or a file.
+"""
+import csv
+import json
+from datetime import datetime
+
+from django.utils import timezone
+
+from rental.models import Rental
+
+EXPORT_FIELDS = (
+    ('rental_id', 'id'),
+    ('user_id', 'user_id'),
+    ('scooter_num', 'scooter_id'),
+    ('tariff_id', 'tariff_id'),
+    ('start_time', 'start_time'),
+    ('end_time', 'end_time'),
+    ('status', 'status'),
+    ('total_minutes', 'total_minutes'),
+    ('total_cost', 'total_cost'),
+    ('payment_id', 'payment__id'),
+    ('payment_status', 'payment__status'),
+    ('hold_amount', 'payment__hold_amount'),
+    ('final_amount', 'payment__final_amount'),
+    ('stripe_customer_id', 'payment__stripe_customer_id'),
+    ('stripe_final_intent_id', 'payment__stripe_final_intent_id'),
+)
+COLUMNS = [column for column, _ in EXPORT_FIELDS]
+
+
+def month_range(month: str):
+    """'2026-09' -> (start, end) of that month in the current time zone."""
+    start = timezone.make_aware(datetime.strptime(month, '%Y-%m'))
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+def export_rows(start=None, end=None, chunk_size: int = 2000):
+    """Rental rows joined with their payment, ordered by rental id."""
+    queryset = Rental.objects.order_by('id')
+    if start is not None:
+        queryset = queryset.filter(start_time__gte=start)
+    if end is not None:
+        queryset = queryset.filter(start_time__lt=end)
+    return queryset.values_list(*[lookup for _, lookup in EXPORT_FIELDS]).iterator(chunk_size=chunk_size)
+
+
+class _LineBuffer:
+    """File-like object handing back what csv.writer writes."""
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row)), default=_json_default) + '\n'
+
+
+FORMATTERS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
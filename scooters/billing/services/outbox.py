@@ -0,0 +1,290 @@
+"""
+Transactional outbox for Stripe calls.
+
+Rental services only write PaymentOutbox rows inside their transaction; the
+Stripe round trips are made by billing.tasks after the transaction commits,
+so no row lock is ever held across a network call.
+"""
+import random
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from billing.models import Payment, PaymentOutbox
+from billing.services.stripe_service import (
+    ensure_customer, create_hold_intent, cancel_hold_intent, charge_final_amount, authorize_hold, capture_hold,
+)
+
+# Stripe errors that may succeed when the same request is sent again.
+TRANSIENT_STRIPE_ERRORS = (
+    stripe.APIConnectionError,
+    stripe.RateLimitError,
+    stripe.APIError,
+    stripe.IdempotencyError,
+)
+
+
+class OutboxRetry(Exception):
+    """The entry cannot be processed yet and should be retried later."""
+
+
+class OutboxWait(OutboxRetry):
+    """The entry waits for another action or a webhook, nothing has failed."""
+
+
+RETRYABLE_ERRORS = TRANSIENT_STRIPE_ERRORS + (OutboxRetry,)
+
+# End-of-ride actions, left to the batched settlement worker instead of one Celery task each
+SETTLEMENT_ACTIONS = (
+    PaymentOutbox.Action.CANCEL_HOLD,
+    PaymentOutbox.Action.CHARGE_FINAL,
+    PaymentOutbox.Action.CAPTURE_HOLD,
+)
+
+
+def enqueue_payment_action(payment, action) -> PaymentOutbox:
+    """Record a Stripe action for the payment and dispatch it after commit."""
+    entry = PaymentOutbox.objects.create(
+        payment=payment,
+        action=action,
+        idempotency_key=f'{action}-payment-{payment.id}',
+    )
+    if action not in SETTLEMENT_ACTIONS and settings.PAYMENT_OUTBOX_DISPATCH_ON_COMMIT:
+        transaction.on_commit(lambda: dispatch_entry(entry.id))
+    return entry
+
+
+def dispatch_entry(entry_id):
+    from billing.tasks import process_payment_outbox
+    process_payment_outbox.delay(entry_id)
+
+
+def _claimable(now):
+    stale_before = now - timedelta(seconds=settings.PAYMENT_OUTBOX_STALE_SECONDS)
+    return Q(status=PaymentOutbox.Status.PENDING) | Q(
+        status=PaymentOutbox.Status.PROCESSING, updated_at__lt=stale_before
+    )
+
+
+def claim_entry(entry_id):
+    """Move an entry to processing. Returns None if it is done or owned by another worker."""
+    now = timezone.now()
+    claimed = (
+        PaymentOutbox.objects
+        .filter(_claimable(now), pk=entry_id)
+        .update(status=PaymentOutbox.Status.PROCESSING, updated_at=now)
+    )
+    if not claimed:
+        return None
+    return PaymentOutbox.objects.select_related('payment__rental__user').get(pk=entry_id)
+
+
+def pending_entry_ids(limit: int, min_age_seconds: int = 60):
+    """Ids of dispatched entries whose dispatch was lost or whose worker died, once their backoff is over."""
+    now = timezone.now()
+    return list(
+        PaymentOutbox.objects
+        .filter(_claimable(now), updated_at__lt=now - timedelta(seconds=min_age_seconds))
+        .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        .exclude(action__in=SETTLEMENT_ACTIONS)
+        .order_by('id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+
+def pending_settlement_entries(limit: int):
+    """(id, payment_id, attempts) of settlement entries due now, in creation order."""
+    now = timezone.now()
+    return list(
+        PaymentOutbox.objects
+        .filter(_claimable(now), action__in=SETTLEMENT_ACTIONS)
+        .filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        .order_by('id')
+        .values_list('id', 'payment_id', 'attempts')[:limit]
+    )
+
+
+def _handle_create_hold(entry):
+    payment = entry.payment
+    customer_id = ensure_customer(payment.rental.user)
+    if payment.manual_capture:
+        # Confirmed off-session on the saved card, no webhook round trip needed
+        hold_intent = authorize_hold(
+            customer_id, payment.stripe_payment_method_id, payment.hold_amount_minor, entry.idempotency_key
+        )
+        Payment.objects.filter(pk=payment.pk).update(
+            stripe_customer_id=customer_id,
+            stripe_hold_intent_id=hold_intent['id'],
+            status=Payment.Status.AUTHORIZED,
+        )
+        return
+    hold_intent = create_hold_intent(customer_id, payment.hold_amount_minor, idempotency_key=entry.idempotency_key)
+    Payment.objects.filter(pk=payment.pk).update(
+        stripe_customer_id=customer_id,
+        stripe_hold_intent_id=hold_intent['id'],
+    )
+
+
+def _release_hold(intent_id, idempotency_key):
+    try:
+        cancel_hold_intent(intent_id, idempotency_key=idempotency_key)
+    except stripe.InvalidRequestError:
+        # Hold was already canceled or captured, nothing left to release
+        pass
+
+
+def _handle_cancel_hold(entry):
+    payment = Payment.objects.get(pk=entry.payment_id)
+    if not payment.stripe_hold_intent_id:
+        return
+    _release_hold(payment.stripe_hold_intent_id, entry.idempotency_key)
+
+
+def _handle_charge_final(entry):
+    payment = Payment.objects.get(pk=entry.payment_id)
+    pm_id = payment.stripe_payment_method_id
+    if not pm_id:
+        raise OutboxWait('No payment method found. Hold payment may not have been confirmed.')
+
+    final_intent = charge_final_amount(
+        payment.stripe_customer_id,
+        pm_id,
+        payment.final_amount_minor,
+        settings.RENTAL_CURRENCY,
+        entry.idempotency_key,
+    )
+    Payment.objects.filter(pk=payment.pk).update(
+        stripe_final_intent_id=final_intent['id'],
+        status=Payment.Status.PROCCESSING,  # Will be updated to CAPTURED by webhook
+    )
+
+
+def _handle_capture_hold(entry):
+    """Settle a manual-capture payment: one capture call when the fare fits in the hold."""
+    payment = Payment.objects.get(pk=entry.payment_id)
+    if payment.final_amount_minor > payment.hold_amount_minor:
+        # The fare outgrew the authorization, release it and charge the fare in full
+        _release_hold(payment.stripe_hold_intent_id, f'{entry.idempotency_key}-cancel')
+        final_intent = charge_final_amount(
+            payment.stripe_customer_id,
+            payment.stripe_payment_method_id,
+            payment.final_amount_minor,
+            settings.RENTAL_CURRENCY,
+            f'{entry.idempotency_key}-charge',
+        )
+        Payment.objects.filter(pk=payment.pk).update(
+            stripe_final_intent_id=final_intent['id'],
+            status=Payment.Status.PROCCESSING,
+        )
+        return
+
+    if payment.final_amount_minor == 0:
+        _release_hold(payment.stripe_hold_intent_id, entry.idempotency_key)
+        Payment.objects.filter(pk=payment.pk).update(status=Payment.Status.CAPTURED)
+        return
+
+    # The uncaptured rest of the hold is released by Stripe
+    intent = capture_hold(payment.stripe_hold_intent_id, payment.final_amount_minor, entry.idempotency_key)
+    Payment.objects.filter(pk=payment.pk).update(
+        stripe_final_intent_id=intent['id'],
+        status=Payment.Status.CAPTURED if intent['status'] == 'succeeded' else Payment.Status.PROCCESSING,
+    )
+
+
+HANDLERS = {
+    PaymentOutbox.Action.CREATE_HOLD: _handle_create_hold,
+    PaymentOutbox.Action.CANCEL_HOLD: _handle_cancel_hold,
+    PaymentOutbox.Action.CHARGE_FINAL: _handle_charge_final,
+    PaymentOutbox.Action.CAPTURE_HOLD: _handle_capture_hold,
+}
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, so a burst of failures is not retried in lockstep."""
+    delay = settings.PAYMENT_OUTBOX_RETRY_BACKOFF * (2 ** attempts)
+    return random.uniform(delay / 2, delay)
+
+
+def _release(entry, error):
+    now = timezone.now()
+    PaymentOutbox.objects.filter(pk=entry.pk).update(
+        status=PaymentOutbox.Status.PENDING,
+        attempts=entry.attempts + 1,
+        last_error=str(error),
+        updated_at=now,
+        next_attempt_at=now + timedelta(seconds=retry_delay(entry.attempts)),
+    )
+
+
+def _postpone(entry, error):
+    """Put a waiting entry back without counting an attempt."""
+    now = timezone.now()
+    PaymentOutbox.objects.filter(pk=entry.pk).update(
+        status=PaymentOutbox.Status.PENDING,
+        last_error=str(error),
+        updated_at=now,
+        next_attempt_at=now + timedelta(seconds=settings.PAYMENT_OUTBOX_WAIT_DELAY),
+    )
+
+
+def fail_entry(entry_id, error):
+    """Give up on an entry. Failed holds and charges also fail the payment."""
+    with transaction.atomic():
+        entry = PaymentOutbox.objects.select_for_update().get(pk=entry_id)
+        entry.status = PaymentOutbox.Status.FAILED
+        entry.last_error = str(error)
+        entry.processed_at = timezone.now()
+        entry.save(update_fields=['status', 'last_error', 'processed_at', 'updated_at'])
+        if entry.action != PaymentOutbox.Action.CANCEL_HOLD:
+            Payment.objects.filter(pk=entry.payment_id).update(status=Payment.Status.FAILED)
+
+
+def process_entry(entry_id) -> bool | None:
+    """
+    Perform the Stripe call for one outbox entry.
+
+    Returns True once it is done, False when it failed for good and None when
+    it was already done or claimed by another worker. Entries of the same
+    payment are processed in creation order. Retryable errors put the entry
+    back to pending and are re-raised to the caller; an OutboxWait only counts
+    as an attempt once the entry is older than PAYMENT_OUTBOX_MAX_WAIT.
+    """
+    entry = claim_entry(entry_id)
+    if entry is None:
+        return None
+
+    try:
+        earlier_open = (
+            PaymentOutbox.objects
+            .filter(payment_id=entry.payment_id, id__lt=entry.id)
+            .exclude(status__in=[PaymentOutbox.Status.DONE, PaymentOutbox.Status.FAILED])
+            .exists()
+        )
+        if earlier_open:
+            raise OutboxWait('Waiting for earlier actions of this payment')
+        HANDLERS[entry.action](entry)
+    except OutboxWait as e:
+        if timezone.now() - entry.created_at < timedelta(seconds=settings.PAYMENT_OUTBOX_MAX_WAIT):
+            _postpone(entry, e)
+            raise
+        _release(entry, e)
+        raise OutboxRetry(str(e)) from e
+    except RETRYABLE_ERRORS as e:
+        _release(entry, e)
+        raise
+    except stripe.StripeError as e:
+        fail_entry(entry.pk, e)
+        return False
+
+    PaymentOutbox.objects.filter(pk=entry.pk).update(
+        status=PaymentOutbox.Status.DONE,
+        attempts=entry.attempts + 1,
+        last_error='',
+        processed_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+    return True
@@ -0,0 +1,51 @@
+"""
+Saved payment methods.
+
+A user saves a card once through a SetupIntent; the setup_intent.succeeded
+webhook stores it and rides are then pre-authorized on it. Lookups read
+through the cache, an empty string standing for "no saved method".
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from billing.models import SavedPaymentMethod, StripeCustomer
+
+
+def payment_method_cache_key(user_id) -> str:
+    return f'stripe:payment_method:user:{user_id}'
+
+
+def get_saved_payment_method(user_id):
+    """Saved payment method id of the user, or None."""
+    key = payment_method_cache_key(user_id)
+    payment_method_id = cache.get(key)
+    if payment_method_id is None:
+        payment_method_id = (
+            SavedPaymentMethod.objects.filter(user_id=user_id)
+            .values_list('payment_method_id', flat=True)
+            .first()
+        ) or ''
+        cache.set(key, payment_method_id, timeout=settings.STRIPE_PAYMENT_METHOD_CACHE_TTL)
+    return payment_method_id or None
+
+
+def save_payment_method(user_id, payment_method_id):
+    SavedPaymentMethod.objects.update_or_create(user_id=user_id, defaults={'payment_method_id': payment_method_id})
+    transaction.on_commit(lambda: cache.delete(payment_method_cache_key(user_id)), robust=True)
+
+
+def save_from_setup_intent(setup_intent) -> bool:
+    """Store the payment method of a succeeded SetupIntent. Returns False if its user is unknown."""
+    payment_method_id = setup_intent.get('payment_method')
+    user_id = (setup_intent.get('metadata') or {}).get('app_user_id')
+    if not user_id and setup_intent.get('customer'):
+        user_id = (
+            StripeCustomer.objects.filter(customer_id=setup_intent['customer'])
+            .values_list('user_id', flat=True)
+            .first()
+        )
+    if not user_id or not payment_method_id:
+        return False
+    save_payment_method(int(user_id), payment_method_id)
+    return True
@@ -0,0 +1,104 @@
+"""
+Batched end-of-ride settlement.
+
+end_rental only records the fare and enqueues settlement outbox entries, so
+ride completion never waits on Stripe. The settlement worker claims due
+entries in batches and performs the Stripe calls on a thread pool: entries
+of one payment run in order on one thread, a shared limiter keeps the pool
+under SETTLEMENT_RATE_LIMIT requests per second, and retryable failures come
+back after a jittered exponential backoff.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from billing.services.outbox import RETRYABLE_ERRORS, OutboxWait, pending_settlement_entries, process_entry, fail_entry
+
+
+class RateLimiter:
+    """Spaces acquisitions 1/rate seconds apart across threads, 0 disables it."""
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._mutex = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._mutex:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def settle_payment(entries, limiter) -> dict:
+    """
+    Process the (entry_id, attempts) of one payment in order, stopping at the
+    first retry or at an entry another worker has claimed in the meantime.
+    """
+    counts = {'settled': 0, 'retried': 0, 'failed': 0, 'skipped': 0}
+    for entry_id, attempts in entries:
+        limiter.acquire()
+        try:
+            settled = process_entry(entry_id)
+        except OutboxWait:
+            # Postponed without an attempt, later entries wait with it
+            counts['retried'] += 1
+            break
+        except RETRYABLE_ERRORS as e:
+            if attempts + 1 >= settings.PAYMENT_OUTBOX_MAX_RETRIES:
+                fail_entry(entry_id, e)
+                counts['failed'] += 1
+                continue
+            # process_entry put it back with a backoff, later entries wait for it
+            counts['retried'] += 1
+            break
+        if settled is None:
+            # The other worker settles the rest of this payment
+            counts['skipped'] += 1
+            break
+        counts['settled' if settled else 'failed'] += 1
+    return counts
+
+
+class SettlementWorker:
+    def __init__(self, batch_size=None, concurrency=None, rate_limit=None):
+        self.batch_size = batch_size or settings.SETTLEMENT_BATCH_SIZE
+        self.concurrency = concurrency or settings.SETTLEMENT_CONCURRENCY
+        self.limiter = RateLimiter(settings.SETTLEMENT_RATE_LIMIT if rate_limit is None else rate_limit)
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency) if self.concurrency > 1 else None
+
+    def _settle_in_thread(self, entries):
+        # Pool threads keep their DB connection between batches, like request threads
+        close_old_connections()
+        try:
+            return settle_payment(entries, self.limiter)
+        finally:
+            close_old_connections()
+
+    def run_batch(self) -> dict:
+        """Settle one batch of due entries. Returns counts, 'entries' being the batch size."""
+        by_payment = {}
+        due = pending_settlement_entries(self.batch_size)
+        for entry_id, payment_id, attempts in due:
+            by_payment.setdefault(payment_id, []).append((entry_id, attempts))
+
+        if self._pool is None:
+            results = [settle_payment(entries, self.limiter) for entries in by_payment.values()]
+        else:
+            results = list(self._pool.map(self._settle_in_thread, by_payment.values()))
+
+        counts = {'entries': len(due), 'settled': 0, 'retried': 0, 'failed': 0, 'skipped': 0}
+        for result in results:
+            for key, value in result.items():
+                counts[key] += value
+        return counts
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
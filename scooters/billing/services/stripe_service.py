@@ -1,56 +1,116 @@
 import stripe
 from django.conf import settings
+from django.core.cache import cache
+
+from billing.models import StripeCustomer
+from scooters.metrics import timed_stripe
 
 stripe.api_key = settings.STRIPE_API_KEY
 
+def customer_cache_key(user_id) -> str:
+    return f'stripe:customer:user:{user_id}'
+
 def ensure_customer(user) -> str:
     """Ensure a Stripe customer exists for the user.
-    Returns existing customer ID if found, creates new one otherwise."""
-    # Search for existing customer by metadata
-    customers = stripe.Customer.search(
-        query=f"metadata['app_user_id']:'{user.id}'",
-        limit=1
-    )
+    Reads through the cache and the local StripeCustomer mapping, Stripe is
+    only contacted on a cold miss."""
+    key = customer_cache_key(user.id)
+    customer_id = cache.get(key)
+    if customer_id:
+        return customer_id
+
+    mapping = StripeCustomer.objects.filter(user=user).values_list('customer_id', flat=True).first()
+    if mapping:
+        cache.set(key, mapping, timeout=settings.STRIPE_CUSTOMER_CACHE_TTL)
+        return mapping
+
+    # Cold miss: adopt a customer created before the mapping existed
+    with timed_stripe():
+        customers = stripe.Customer.search(
+            query=f"metadata['app_user_id']:'{user.id}'",
+            limit=1
+        )
     
-    # Check if customer exists with our app_user_id
     if customers.data:
-        return customers.data[0].id
-    
-    # Create new customer if not found
-    customer = stripe.Customer.create(
-        email=user.email,
-        name=user.get_username() or f'User {user.id}',
-        metadata={
-            'app_user_id': str(user.id)
-        }
-    )
-    
-    return customer['id']
+        customer_id = customers.data[0].id
+    else:
+        # Idempotency key prevents duplicates when concurrent cold misses race
+        with timed_stripe():
+            customer = stripe.Customer.create(
+                email=user.email,
+                name=user.get_username() or f'User {user.id}',
+                metadata={
+                    'app_user_id': str(user.id)
+                },
+                idempotency_key=f'customer-user-{user.id}',
+            )
+        customer_id = customer['id']
 
-def create_hold_intent(customer_id: str, amount_minor: int) -> str:
+    mapping, _ = StripeCustomer.objects.get_or_create(user=user, defaults={'customer_id': customer_id})
+    cache.set(key, mapping.customer_id, timeout=settings.STRIPE_CUSTOMER_CACHE_TTL)
+    return mapping.customer_id
+
+def create_hold_intent(customer_id: str, amount_minor: int, idempotency_key: str = None) -> str:
     """Create a Stripe hold intent for the customer."""
-    intent = stripe.PaymentIntent.create(
-        amount = amount_minor,
-        currency = settings.RENTAL_CURRENCY,
-        customer = customer_id,
-        setup_future_usage = 'off_session',
-        automatic_payment_methods = {'enabled': True},
-    )
+    with timed_stripe():
+        intent = stripe.PaymentIntent.create(
+            amount = amount_minor,
+            currency = settings.RENTAL_CURRENCY,
+            customer = customer_id,
+            setup_future_usage = 'off_session',
+            automatic_payment_methods = {'enabled': True},
+            idempotency_key = idempotency_key,
+        )
     return intent
 
-def cancel_hold_intent(intent_id: str) -> bool:
-    return stripe.PaymentIntent.cancel(intent_id)
+def cancel_hold_intent(intent_id: str, idempotency_key: str = None) -> bool:
+    with timed_stripe():
+        return stripe.PaymentIntent.cancel(intent_id, idempotency_key=idempotency_key)
 
 def charge_final_amount(customer_id: str, payment_method_id: str, amount_minor: int, currency: str, idempotency_key: str):
     """Charge the final amount using stored payment method."""
-    intent = stripe.PaymentIntent.create(
-        amount=amount_minor,
-        currency=currency,
-        customer=customer_id,
-        payment_method=payment_method_id,
-        confirm=True,
-        off_session=True,
-        automatic_payment_methods={'enabled': True},
-        idempotency_key=idempotency_key,
-    )
-    return intent
\ No newline at end of file
+    with timed_stripe():
+        intent = stripe.PaymentIntent.create(
+            amount=amount_minor,
+            currency=currency,
+            customer=customer_id,
+            payment_method=payment_method_id,
+            confirm=True,
+            off_session=True,
+            automatic_payment_methods={'enabled': True},
+            idempotency_key=idempotency_key,
+        )
+    return intent
+
+def create_setup_intent(customer_id: str, user_id):
+    """SetupIntent saving a card for off-session rides, completed by the client."""
+    with timed_stripe():
+        return stripe.SetupIntent.create(
+            customer=customer_id,
+            usage='off_session',
+            automatic_payment_methods={'enabled': True},
+            metadata={'app_user_id': str(user_id)},
+        )
+
+def authorize_hold(customer_id: str, payment_method_id: str, amount_minor: int, idempotency_key: str):
+    """Authorize the hold on the saved payment method, captured when the ride ends."""
+    with timed_stripe():
+        return stripe.PaymentIntent.create(
+            amount=amount_minor,
+            currency=settings.RENTAL_CURRENCY,
+            customer=customer_id,
+            payment_method=payment_method_id,
+            capture_method='manual',
+            confirm=True,
+            off_session=True,
+            idempotency_key=idempotency_key,
+        )
+
+def capture_hold(intent_id: str, amount_minor: int, idempotency_key: str):
+    """Capture part of an authorized hold, the rest of it is released."""
+    with timed_stripe():
+        return stripe.PaymentIntent.capture(
+            intent_id,
+            amount_to_capture=amount_minor,
+            idempotency_key=idempotency_key,
+        )
@@ -0,0 +1,64 @@
+"""
+In-process stand-in for the Stripe API, used by the rental load benchmark.
+
+stub_stripe() installs StubHTTPClient as stripe.default_http_client, so the
+calls in billing.services.stripe_service still go through the Stripe library
+(request encoding, response parsing, error mapping) but are answered locally
+with canned objects instead of reaching the network. The application never
+installs it.
+"""
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import stripe
+
+
+class StubHTTPClient(stripe.HTTPClient):
+    """Answers the customer, payment intent and setup intent calls made by billing."""
+    name = 'stub'
+
+    def __init__(self, latency: float = 0):
+        super().__init__()
+        self.latency = latency
+
+    def _object(self, prefix, obj, **fields):
+        return {'id': f'{prefix}_bench_{uuid.uuid4().hex}', 'object': obj, 'livemode': False, **fields}
+
+    def _respond(self, method, path):
+        parts = path.strip('/').split('/')[1:]
+        if parts == ['customers', 'search'] and method == 'get':
+            return 200, {'object': 'search_result', 'data': [], 'has_more': False, 'url': path}
+        if parts == ['customers'] and method == 'post':
+            return 200, self._object('cus', 'customer')
+        if parts == ['payment_intents'] and method == 'post':
+            return 200, self._object('pi', 'payment_intent', status='requires_capture')
+        if len(parts) == 3 and parts[0] == 'payment_intents' and method == 'post':
+            status = {'cancel': 'canceled', 'capture': 'succeeded'}.get(parts[2])
+            if status is not None:
+                return 200, {'id': parts[1], 'object': 'payment_intent', 'livemode': False, 'status': status}
+        if parts == ['setup_intents'] and method == 'post':
+            return 200, self._object('seti', 'setup_intent', client_secret=f'seti_bench_secret_{uuid.uuid4().hex}')
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f'No stub for {method.upper()} {path}'}}
+
+    def request(self, method, url, headers, post_data=None, *, _usage=None):
+        if self.latency:
+            time.sleep(self.latency)
+        status, body = self._respond(method.lower(), urlsplit(url).path)
+        return json.dumps(body), status, {'request-id': f'req_bench_{uuid.uuid4().hex}'}
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def stub_stripe(latency: float = 0):
+    """Route every Stripe API call of this process to a StubHTTPClient while the block runs."""
+    previous = stripe.default_http_client
+    stripe.default_http_client = StubHTTPClient(latency)
+    try:
+        yield stripe.default_http_client
+    finally:
+        stripe.default_http_client = previous
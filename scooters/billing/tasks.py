@@ -0,0 +1,44 @@
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from billing.models import PaymentOutbox
+from billing.services.outbox import RETRYABLE_ERRORS, process_entry, fail_entry, pending_entry_ids
+from billing.services.events import process_pending_events
+
+
+# The limit is PAYMENT_OUTBOX_MAX_RETRIES attempts of the entry, not retries of one task chain
+@shared_task(bind=True, max_retries=None)
+def process_payment_outbox(self, entry_id):
+    try:
+        return process_entry(entry_id)
+    except RETRYABLE_ERRORS as e:
+        # Attempts are counted on the entry, so a chain restarted by dispatch_payment_outbox keeps the limit
+        attempts, next_attempt_at = PaymentOutbox.objects.values_list('attempts', 'next_attempt_at').get(pk=entry_id)
+        if attempts >= settings.PAYMENT_OUTBOX_MAX_RETRIES:
+            fail_entry(entry_id, e)
+            return False
+        # process_entry released the entry with a retry_delay() backoff
+        countdown = max((next_attempt_at - timezone.now()).total_seconds(), 0)
+        raise self.retry(exc=e, countdown=countdown)
+
+
+@shared_task
+def dispatch_payment_outbox(batch_size=500):
+    """Safety net for entries whose after-commit dispatch was lost."""
+    entry_ids = pending_entry_ids(batch_size)
+    for entry_id in entry_ids:
+        process_payment_outbox.delay(entry_id)
+    return len(entry_ids)
+
+
+@shared_task
+def process_stripe_events(batch_size=None):
+    """Apply pending webhook events in batches until none are left."""
+    batch_size = batch_size or settings.STRIPE_EVENT_BATCH_SIZE
+    handled = 0
+    while True:
+        count = process_pending_events(batch_size)
+        handled += count
+        if count < batch_size:
+            return handled
@@ -1,3 +1,464 @@
-from django.test import TestCase
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import stripe
+from celery.exceptions import Retry
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from rental.models import Scooter, Tariff, Rental
+from rental.services.start_rental import start_rental, end_rental
+from billing.models import Payment, PaymentOutbox, StripeCustomer, StripeEvent, SavedPaymentMethod
+from billing.tasks import process_stripe_events, process_payment_outbox
+from billing.services.outbox import OutboxRetry, OutboxWait, claim_entry, process_entry, pending_entry_ids
+from billing.services.stripe_service import ensure_customer, customer_cache_key
+from billing.services.settlement import SettlementWorker
+from billing.services.payment_methods import get_saved_payment_method, payment_method_cache_key
+
+class PaymentOutboxTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testOutboxUser1')
+        self.scooter = Scooter.objects.create(num=546, status=Scooter.Status.AVAILABLE)
+        self.tariff = Tariff.objects.create(name='test', per_minute=10.00)
+
+    def test_start_rental_enqueues_hold_without_stripe_call(self):
+        with mock.patch('billing.services.outbox.create_hold_intent') as create_hold, \
+                mock.patch('billing.services.outbox.dispatch_entry') as dispatch:
+            with self.captureOnCommitCallbacks(execute=True):
+                rental = start_rental(self.scooter.num, self.user)
+                dispatch.assert_not_called()
+        create_hold.assert_not_called()
+        entry = PaymentOutbox.objects.get(payment__rental=rental)
+        dispatch.assert_called_once_with(entry.id)
+        self.assertEqual(entry.action, PaymentOutbox.Action.CREATE_HOLD)
+        self.assertEqual(entry.status, PaymentOutbox.Status.PENDING)
+
+    @mock.patch('billing.services.outbox.create_hold_intent', return_value={'id': 'pi_hold'})
+    @mock.patch('billing.services.outbox.ensure_customer', return_value='cus_1')
+    def test_process_create_hold(self, ensure_customer, create_hold):
+        rental = start_rental(self.scooter.num, self.user)
+        entry = PaymentOutbox.objects.get(payment__rental=rental)
+        self.assertTrue(process_entry(entry.id))
+        create_hold.assert_called_once_with('cus_1', 5000, idempotency_key=entry.idempotency_key)
+
+        payment = Payment.objects.get(rental=rental)
+        self.assertEqual(payment.stripe_customer_id, 'cus_1')
+        self.assertEqual(payment.stripe_hold_intent_id, 'pi_hold')
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, PaymentOutbox.Status.DONE)
+        # A done entry is never processed twice
+        self.assertIsNone(process_entry(entry.id))
+        self.assertEqual(create_hold.call_count, 1)
+
+    @mock.patch('billing.services.outbox.charge_final_amount', return_value={'id': 'pi_final'})
+    @mock.patch('billing.services.outbox.cancel_hold_intent')
+    @mock.patch('billing.services.outbox.create_hold_intent', return_value={'id': 'pi_hold'})
+    @mock.patch('billing.services.outbox.ensure_customer', return_value='cus_1')
+    def test_end_rental_charges_in_order(self, ensure_customer, create_hold, cancel_hold, charge_final):
+        rental = start_rental(self.scooter.num, self.user)
+        end_rental(self.scooter.num, self.user)
+        hold, cancel, charge = PaymentOutbox.objects.filter(payment__rental=rental).order_by('id')
+
+        # Charge waits until the earlier actions of the payment are done
+        with self.assertRaises(OutboxRetry):
+            process_entry(charge.id)
+        charge_final.assert_not_called()
+
+        process_entry(hold.id)
+        process_entry(cancel.id)
+        cancel_hold.assert_called_once_with('pi_hold', idempotency_key=cancel.idempotency_key)
+
+        # Charge waits for the hold to be confirmed by the webhook
+        with self.assertRaises(OutboxRetry):
+            process_entry(charge.id)
+        Payment.objects.filter(rental=rental).update(stripe_payment_method_id='pm_1')
+
+        self.assertTrue(process_entry(charge.id))
+        payment = Payment.objects.get(rental=rental)
+        charge_final.assert_called_once_with('cus_1', 'pm_1', payment.final_amount_minor, 'uah', charge.idempotency_key)
+        self.assertEqual(payment.stripe_final_intent_id, 'pi_final')
+        self.assertEqual(payment.status, Payment.Status.PROCCESSING)
+        charge.refresh_from_db()
+        # Waiting for the hold and its webhook did not use up retries
+        self.assertEqual(charge.attempts, 1)
+
+    @mock.patch('billing.services.outbox.ensure_customer', side_effect=stripe.CardError('declined', None, 'card_declined'))
+    def test_permanent_error_fails_payment(self, ensure_customer):
+        rental = start_rental(self.scooter.num, self.user)
+        entry = PaymentOutbox.objects.get(payment__rental=rental)
+        self.assertIs(process_entry(entry.id), False)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, PaymentOutbox.Status.FAILED)
+        self.assertEqual(Payment.objects.get(rental=rental).status, Payment.Status.FAILED)
+        self.assertEqual(Rental.objects.get(pk=rental.pk).status, Rental.Status.ACTIVE)
+
+    @override_settings(PAYMENT_OUTBOX_MAX_RETRIES=3)
+    @mock.patch('billing.services.outbox.ensure_customer', side_effect=stripe.APIConnectionError('down'))
+    def test_retries_limited_by_entry_attempts(self, ensure_customer):
+        rental = start_rental(self.scooter.num, self.user)
+        entry = PaymentOutbox.objects.get(payment__rental=rental)
+        old = timezone.now() - timedelta(minutes=5)
+        # Backing off, the safety net leaves it alone
+        PaymentOutbox.objects.filter(pk=entry.pk).update(updated_at=old, next_attempt_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(pending_entry_ids(10), [])
+        PaymentOutbox.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(pending_entry_ids(10), [entry.id])
+
+        # A restarted chain still stops at the attempts recorded on the entry
+        PaymentOutbox.objects.filter(pk=entry.pk).update(attempts=2)
+        process_payment_outbox.apply(args=[entry.id])
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, PaymentOutbox.Status.FAILED)
+        self.assertEqual(entry.attempts, 3)
+        self.assertEqual(ensure_customer.call_count, 1)
+
+    @override_settings(PAYMENT_OUTBOX_MAX_RETRIES=2)
+    @mock.patch('billing.services.outbox.cancel_hold_intent')
+    @mock.patch('billing.services.outbox.create_hold_intent', return_value={'id': 'pi_hold'})
+    @mock.patch('billing.services.outbox.ensure_customer', return_value='cus_1')
+    def test_waiting_entry_is_not_failed(self, ensure_customer, create_hold, cancel_hold):
+        rental = start_rental(self.scooter.num, self.user)
+        end_rental(self.scooter.num, self.user)
+        hold, cancel, charge = PaymentOutbox.objects.filter(payment__rental=rental).order_by('id')
+        process_entry(hold.id)
+        process_entry(cancel.id)
+
+        # The hold webhook is late, the charge waits past the retry limit without failing
+        for _ in range(3):
+            with self.assertRaises(OutboxWait):
+                process_entry(charge.id)
+        with mock.patch.object(process_payment_outbox, 'retry', side_effect=Retry) as retry:
+            process_payment_outbox.apply(args=[charge.id])
+        retry.assert_called_once()
+        charge.refresh_from_db()
+        self.assertEqual((charge.status, charge.attempts), (PaymentOutbox.Status.PENDING, 0))
+        self.assertGreater(charge.next_attempt_at, timezone.now())
+        self.assertNotEqual(Payment.objects.get(rental=rental).status, Payment.Status.FAILED)
+
+        # Past PAYMENT_OUTBOX_MAX_WAIT the wait counts like any retry
+        PaymentOutbox.objects.filter(pk=charge.pk).update(created_at=timezone.now() - timedelta(days=2))
+        with self.assertRaises(OutboxRetry):
+            process_entry(charge.id)
+        charge.refresh_from_db()
+        self.assertEqual(charge.attempts, 1)
+
+
+@mock.patch('billing.services.outbox.ensure_customer', return_value='cus_1')
+class PreauthorizedPaymentTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testPreauthUser1')
+        self.scooter = Scooter.objects.create(num=546, status=Scooter.Status.AVAILABLE)
+        Tariff.objects.create(name='test', per_minute=10.00)
+        SavedPaymentMethod.objects.create(user=self.user, payment_method_id='pm_saved')
+        cache.delete(payment_method_cache_key(self.user.id))
+        self.addCleanup(cache.delete, payment_method_cache_key(self.user.id))
+
+    def _ride(self):
+        rental = start_rental(self.scooter.num, self.user)
+        end_rental(self.scooter.num, self.user)
+        return rental, list(PaymentOutbox.objects.filter(payment__rental=rental).order_by('id'))
+
+    @mock.patch('billing.services.outbox.capture_hold', return_value={'id': 'pi_auth', 'status': 'succeeded'})
+    @mock.patch('billing.services.outbox.authorize_hold', return_value={'id': 'pi_auth', 'status': 'requires_capture'})
+    @mock.patch('billing.services.outbox.create_hold_intent')
+    @mock.patch('billing.services.outbox.charge_final_amount')
+    def test_ride_authorizes_and_captures(self, charge_final, create_hold, authorize, capture, ensure_customer):
+        rental, (hold, settle) = self._ride()
+        self.assertEqual(settle.action, PaymentOutbox.Action.CAPTURE_HOLD)
+
+        self.assertTrue(process_entry(hold.id))
+        authorize.assert_called_once_with('cus_1', 'pm_saved', 5000, hold.idempotency_key)
+        self.assertEqual(Payment.objects.get(rental=rental).status, Payment.Status.AUTHORIZED)
+
+        self.assertTrue(process_entry(settle.id))
+        payment = Payment.objects.get(rental=rental)
+        capture.assert_called_once_with('pi_auth', payment.final_amount_minor, settle.idempotency_key)
+        self.assertEqual(payment.status, Payment.Status.CAPTURED)
+        self.assertEqual(payment.stripe_final_intent_id, 'pi_auth')
+        create_hold.assert_not_called()
+        charge_final.assert_not_called()
+
+    @mock.patch('billing.services.outbox.charge_final_amount', return_value={'id': 'pi_final'})
+    @mock.patch('billing.services.outbox.cancel_hold_intent')
+    @mock.patch('billing.services.outbox.capture_hold')
+    @mock.patch('billing.services.outbox.authorize_hold', return_value={'id': 'pi_auth', 'status': 'requires_capture'})
+    def test_fare_above_hold(self, authorize, capture, cancel_hold, charge_final, ensure_customer):
+        rental, (hold, settle) = self._ride()
+        process_entry(hold.id)
+        Payment.objects.filter(rental=rental).update(final_amount_minor=9000)
+
+        self.assertTrue(process_entry(settle.id))
+        capture.assert_not_called()
+        cancel_hold.assert_called_once_with('pi_auth', idempotency_key=f'{settle.idempotency_key}-cancel')
+        charge_final.assert_called_once_with('cus_1', 'pm_saved', 9000, 'uah', f'{settle.idempotency_key}-charge')
+        self.assertEqual(Payment.objects.get(rental=rental).stripe_final_intent_id, 'pi_final')
+
+    def test_without_saved_method(self, ensure_customer):
+        SavedPaymentMethod.objects.all().delete()
+        rental, entries = self._ride()
+        self.assertFalse(Payment.objects.get(rental=rental).manual_capture)
+        self.assertEqual(
+            [entry.action for entry in entries],
+            [PaymentOutbox.Action.CREATE_HOLD, PaymentOutbox.Action.CANCEL_HOLD, PaymentOutbox.Action.CHARGE_FINAL],
+        )
+
+
+@mock.patch('billing.services.outbox.ensure_customer', return_value='cus_1')
+@mock.patch('billing.services.outbox.create_hold_intent', return_value={'id': 'pi_hold'})
+@mock.patch('billing.services.outbox.cancel_hold_intent')
+class SettlementTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testSettlementUser1')
+        self.scooter = Scooter.objects.create(num=546, status=Scooter.Status.AVAILABLE)
+        Tariff.objects.create(name='test', per_minute=10.00)
+        self.worker = SettlementWorker(batch_size=10, concurrency=1, rate_limit=0)
+
+    def _ride(self):
+        with mock.patch('billing.services.outbox.dispatch_entry') as dispatch:
+            with self.captureOnCommitCallbacks(execute=True):
+                rental = start_rental(self.scooter.num, self.user)
+            with self.captureOnCommitCallbacks(execute=True):
+                end_rental(self.scooter.num, self.user)
+        hold = PaymentOutbox.objects.get(payment__rental=rental, action=PaymentOutbox.Action.CREATE_HOLD)
+        # Only the hold is dispatched, settlement waits for the worker
+        dispatch.assert_called_once_with(hold.id)
+        process_entry(hold.id)
+        Payment.objects.filter(rental=rental).update(stripe_payment_method_id='pm_1')
+        return rental
+
+    @mock.patch('billing.services.outbox.charge_final_amount', return_value={'id': 'pi_final'})
+    def test_batch_settles_in_order(self, charge_final, cancel_hold, create_hold, ensure_customer):
+        rental = self._ride()
+        counts = self.worker.run_batch()
+        self.assertEqual(counts, {'entries': 2, 'settled': 2, 'retried': 0, 'failed': 0, 'skipped': 0})
+        cancel_hold.assert_called_once()
+        charge_final.assert_called_once()
+        self.assertEqual(Payment.objects.get(rental=rental).stripe_final_intent_id, 'pi_final')
+        self.assertEqual(self.worker.run_batch()['entries'], 0)
+
+    @mock.patch('billing.services.outbox.charge_final_amount', side_effect=stripe.RateLimitError('slow down'))
+    def test_retry_with_backoff(self, charge_final, cancel_hold, create_hold, ensure_customer):
+        rental = self._ride()
+        self.assertEqual(self.worker.run_batch()['retried'], 1)
+        charge = PaymentOutbox.objects.get(payment__rental=rental, action=PaymentOutbox.Action.CHARGE_FINAL)
+        self.assertEqual(charge.status, PaymentOutbox.Status.PENDING)
+        self.assertGreater(charge.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertEqual(self.worker.run_batch()['entries'], 0)
+
+        with self.settings(PAYMENT_OUTBOX_MAX_RETRIES=2):
+            PaymentOutbox.objects.filter(pk=charge.pk).update(next_attempt_at=None)
+            self.assertEqual(self.worker.run_batch()['failed'], 1)
+        self.assertEqual(Payment.objects.get(rental=rental).status, Payment.Status.FAILED)
+
+    @mock.patch('billing.services.outbox.charge_final_amount')
+    def test_lost_claim_is_skipped(self, charge_final, cancel_hold, create_hold, ensure_customer):
+        rental = self._ride()
+        cancel, charge = PaymentOutbox.objects.filter(payment__rental=rental).order_by('id')[1:]
+        # Another worker claims the first entry between the batch query and processing
+        with mock.patch('billing.services.settlement.pending_settlement_entries', return_value=[
+            (cancel.id, cancel.payment_id, 0), (charge.id, charge.payment_id, 0),
+        ]):
+            claim_entry(cancel.id)
+            counts = self.worker.run_batch()
+        self.assertEqual(counts, {'entries': 2, 'settled': 0, 'retried': 0, 'failed': 0, 'skipped': 1})
+        charge_final.assert_not_called()
+        charge.refresh_from_db()
+        self.assertEqual((charge.status, charge.attempts), (PaymentOutbox.Status.PENDING, 0))
+
+
+class EnsureCustomerTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testCustomerUser1', email='user1@example.com')
+        cache.delete(customer_cache_key(self.user.id))
+
+    @mock.patch('billing.services.stripe_service.stripe.Customer.create', return_value={'id': 'cus_new'})
+    @mock.patch('billing.services.stripe_service.stripe.Customer.search', return_value=mock.Mock(data=[]))
+    def test_cold_miss_creates_and_persists(self, search, create):
+        self.assertEqual(ensure_customer(self.user), 'cus_new')
+        self.assertEqual(StripeCustomer.objects.get(user=self.user).customer_id, 'cus_new')
+        self.assertEqual(create.call_args.kwargs['idempotency_key'], f'customer-user-{self.user.id}')
+
+        # Warm cache: neither Stripe nor the database is queried
+        with self.assertNumQueries(0):
+            self.assertEqual(ensure_customer(self.user), 'cus_new')
+        self.assertEqual(search.call_count, 1)
+        self.assertEqual(create.call_count, 1)
+
+    @mock.patch('billing.services.stripe_service.stripe.Customer.search')
+    def test_mapping_used_when_cache_is_empty(self, search):
+        StripeCustomer.objects.create(user=self.user, customer_id='cus_stored')
+        self.assertEqual(ensure_customer(self.user), 'cus_stored')
+        search.assert_not_called()
+        self.assertEqual(cache.get(customer_cache_key(self.user.id)), 'cus_stored')
+
+
+class StripeWebhookTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testWebhookUser1')
+        scooter = Scooter.objects.create(num=546, status=Scooter.Status.RENTED)
+        tariff = Tariff.objects.create(name='test', per_minute=10.00)
+        rental = Rental.objects.create(scooter=scooter, user=user, tariff=tariff)
+        self.payment = Payment.objects.create(
+            rental=rental,
+            stripe_hold_intent_id='pi_hold',
+            stripe_final_intent_id='pi_final',
+        )
+
+    def _post(self, event_id, event_type, intent, created=1):
+        intent = {'object': 'payment_intent', **intent}
+        event = {'id': event_id, 'type': event_type, 'created': created, 'data': {'object': intent}}
+        with mock.patch('billing.webhook.stripe.Webhook.construct_event', return_value=event), \
+                mock.patch('billing.services.events.schedule_processing') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/stripe/webhook/', data=json.dumps(event), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return schedule
+
+    def test_webhook_only_records_event(self):
+        schedule = self._post('evt_1', 'payment_intent.succeeded', {'id': 'pi_hold', 'payment_method': 'pm_1'})
+        schedule.assert_called_once()
+        event = StripeEvent.objects.get(event_id='evt_1')
+        self.assertEqual(event.intent_id, 'pi_hold')
+        self.assertEqual(event.status, StripeEvent.Status.PENDING)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.Status.PENDING)
+
+    def test_redelivered_event_is_deduplicated(self):
+        self._post('evt_1', 'payment_intent.succeeded', {'id': 'pi_hold', 'payment_method': 'pm_1'})
+        self.assertEqual(process_stripe_events(), 1)
+        schedule = self._post('evt_1', 'payment_intent.succeeded', {'id': 'pi_hold', 'payment_method': 'pm_1'})
+        schedule.assert_not_called()
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(process_stripe_events(), 0)
+
+    def test_hold_confirmed(self):
+        self._post('evt_1', 'payment_intent.succeeded', {'id': 'pi_hold', 'payment_method': 'pm_1'})
+        with CaptureQueriesContext(connection) as queries:
+            process_stripe_events()
+        # The intent is resolved to its payment in one query
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('SELECT') and 'FROM "billing_payment"' in q['sql']]), 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.stripe_payment_method_id, 'pm_1')
+        self.assertEqual(self.payment.status, Payment.Status.AUTHORIZED)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.PROCESSED)
+
+    def test_events_applied_in_stripe_order(self):
+        # Delivered out of order: the failure happened before the capture
+        self._post('evt_2', 'payment_intent.succeeded', {'id': 'pi_final'}, created=20)
+        self._post('evt_1', 'payment_intent.payment_failed', {'id': 'pi_final'}, created=10)
+        self.assertEqual(process_stripe_events(batch_size=1), 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.Status.CAPTURED)
+
+    def test_setup_intent_saves_payment_method(self):
+        user = User.objects.create(username='testWebhookUser2')
+        cache.delete(payment_method_cache_key(user.id))
+        self.addCleanup(cache.delete, payment_method_cache_key(user.id))
+        self.assertIsNone(get_saved_payment_method(user.id))
+
+        StripeCustomer.objects.create(user=user, customer_id='cus_2')
+        self._post('evt_1', 'setup_intent.succeeded', {'object': 'setup_intent', 'id': 'seti_1', 'customer': 'cus_2', 'payment_method': 'pm_2'})
+        with self.captureOnCommitCallbacks(execute=True):
+            process_stripe_events()
+        self.assertEqual(SavedPaymentMethod.objects.get(user=user).payment_method_id, 'pm_2')
+        self.assertEqual(get_saved_payment_method(user.id), 'pm_2')
+
+    @mock.patch('billing.views.create_setup_intent', return_value={'id': 'seti_1', 'client_secret': 'secret'})
+    @mock.patch('billing.views.ensure_customer', return_value='cus_1')
+    def test_setup_intent_view(self, ensure_customer, create_setup_intent):
+        user = User.objects.get(username='testWebhookUser1')
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/api/stripe/setup-intent/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'setup_intent': 'seti_1', 'client_secret': 'secret'})
+        create_setup_intent.assert_called_once_with('cus_1', user.id)
+
+    def test_event_before_intent_is_stored(self):
+        # The outbox worker has not stored the final intent id yet
+        Payment.objects.filter(pk=self.payment.pk).update(stripe_final_intent_id=None)
+        self._post('evt_1', 'payment_intent.succeeded', {'id': 'pi_final'}, created=10)
+        self._post('evt_2', 'payment_intent.payment_failed', {'id': 'pi_final'}, created=20)
+        self.assertEqual(process_stripe_events(), 0)
+        self.assertEqual(StripeEvent.objects.filter(status=StripeEvent.Status.PENDING).count(), 2)
+
+        Payment.objects.filter(pk=self.payment.pk).update(stripe_final_intent_id='pi_final')
+        StripeEvent.objects.filter(event_id='evt_1').update(retry_at=timezone.now())
+        self.assertEqual(process_stripe_events(), 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.Status.FAILED)
+
+    def test_unknown_intent(self):
+        self._post('evt_1', 'payment_intent.succeeded', {'id': 'pi_other'})
+        self.assertEqual(process_stripe_events(), 0)
+        # Dropped once it stayed unmatched for STRIPE_EVENT_UNMATCHED_TTL
+        StripeEvent.objects.update(received_at=timezone.now() - timedelta(hours=1), retry_at=timezone.now())
+        self.assertEqual(process_stripe_events(), 1)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.Status.PROCESSED)
+
+    def test_invalid_signature(self):
+        response = self.client.post('/api/stripe/webhook/', data=b'{}', content_type='application/json',
+                                    HTTP_STRIPE_SIGNATURE='t=1,v1=bad')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+
+class RentalExportTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testExportUser1')
+        tariff = Tariff.objects.create(name='test', per_minute=10.00)
+        september = timezone.make_aware(datetime(2026, 9, 15))
+        for num in (1, 2):
+            scooter = Scooter.objects.create(num=num, status=Scooter.Status.AVAILABLE)
+            rental = Rental.objects.create(
+                scooter=scooter, user=user, tariff=tariff, start_time=september,
+                end_time=september + timedelta(minutes=5), status=Rental.Status.COMPLETED,
+                total_minutes=5, total_cost=50,
+            )
+        Payment.objects.create(rental=rental, final_amount=50, status=Payment.Status.CAPTURED)
+        Rental.objects.create(scooter_id=1, user=User.objects.create(username='testExportUser2'),
+                              tariff=tariff, start_time=september + timedelta(days=30))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='testFinance', is_staff=True))
+
+    def _content(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_month(self):
+        # Rentals and payments are joined in a single query
+        with self.assertNumQueries(1):
+            content = self._content(self.client.get('/api/export/rentals.csv', {'month': '2026-09'}))
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0][:2], ['rental_id', 'user_id'])
+        self.assertEqual(len(rows), 3)
+        # Rental without payment is exported with empty payment columns
+        self.assertEqual(rows[1][rows[0].index('payment_status')], '')
+        self.assertEqual(rows[2][rows[0].index('payment_status')], Payment.Status.CAPTURED)
+
+    def test_ndjson(self):
+        content = self._content(self.client.get('/api/export/rentals.ndjson'))
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1]['final_amount'], '50.00')
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get('/api/export/rentals.xml').status_code, 404)
+        self.assertEqual(self.client.get('/api/export/rentals.csv', {'month': 'sept'}).status_code, 400)
+
+    def test_command(self):
+        out = io.StringIO()
+        with mock.patch('sys.stdout', out):
+            call_command('export_rentals', '--format', 'ndjson', '--month', '2026-09')
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
@@ -1,8 +1,14 @@
 from django.urls import path
 
 from billing.webhook import stripe_webhook
+from billing.views import RentalExportView, SetupIntentView
 
 urlpatterns = [
     path('webhook/', stripe_webhook, name='stripe_webhook'),
+    path('setup-intent/', SetupIntentView.as_view(), name='stripe_setup_intent'),
+]
+
+export_urlpatterns = [
+    path('rentals.<str:fmt>', RentalExportView.as_view(), name='rental_export'),
 ]
 
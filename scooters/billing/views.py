@@ -1,3 +1,43 @@
-from django.shortcuts import render
+from django.http import StreamingHttpResponse
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework import status
 
-# Create your views here.
+from billing.services.export import FORMATTERS, export_rows, month_range
+from billing.services.stripe_service import ensure_customer, create_setup_intent
+
+
+class RentalExportView(APIView):
+    """Stream rentals with their payments as CSV or NDJSON, optionally for one ?month=YYYY-MM."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, fmt):
+        if fmt not in FORMATTERS:
+            return Response({'detail': f'Unsupported format {fmt}'}, status = status.HTTP_404_NOT_FOUND)
+        start = end = None
+        month = request.query_params.get('month')
+        if month:
+            try:
+                start, end = month_range(month)
+            except ValueError:
+                return Response({'detail': 'month must be YYYY-MM'}, status = status.HTTP_400_BAD_REQUEST)
+
+        formatter, content_type = FORMATTERS[fmt]
+        response = StreamingHttpResponse(formatter(export_rows(start, end)), content_type=content_type)
+        filename = f'rentals-{month}.{fmt}' if month else f'rentals.{fmt}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class SetupIntentView(APIView):
+    """Start saving a card for pre-authorized rides; the client confirms the returned SetupIntent."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        customer_id = ensure_customer(request.user)
+        setup_intent = create_setup_intent(customer_id, request.user.id)
+        return Response(
+            {'setup_intent': setup_intent['id'], 'client_secret': setup_intent['client_secret']},
+            status = status.HTTP_201_CREATED,
+        )
@@ -1,8 +1,10 @@
 from django.contrib import admin
-from rental.models import Scooter, Reservation, Rental, Tariff
+from rental.models import Scooter, Reservation, Rental, Tariff, TariffWindow, Zone
 
 # Register your models here.
 admin.site.register(Scooter)
 admin.site.register(Reservation)
 admin.site.register(Rental)
 admin.site.register(Tariff)
+admin.site.register(TariffWindow)
+admin.site.register(Zone)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RentalConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rental'
+
+    def ready(self):
+        from rental import signals  # noqa: F401
@@ -0,0 +1,147 @@
+"""
+Async read endpoints, served without a thread per request under ASGI.
+
+They mirror the read-heavy parts of the API (available scooters, the user's
+reservations and rentals) on plain Django async views: queries go through
+the async ORM and cached pages through redis.asyncio. Authentication and the
+per-user rate limit are the ones of the DRF views, applied by jwt_required.
+Under WSGI they still work, Django then runs each of them in its own event
+loop. status_stream
+holds its connection open and is meant for the ASGI server only.
+"""
+import asyncio
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+
+from rental.models import Reservation, Rental
+from rental.serializers import ScooterAvailabilityFilterSerializer, ScooterStreamFilterSerializer, ReservationSerializer, RentalSerializer
+from rental.services.availability import aavailable_scooters
+from rental.services.status_stream import get_broadcaster
+from scooters.authentication import CachedJWTAuthentication
+from scooters.throttling import UserTokenBucketThrottle
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+# Milliseconds an EventSource waits before reconnecting
+STREAM_RETRY_MS = 3000
+
+
+def _limit(request, default=DEFAULT_LIMIT):
+    try:
+        return min(max(int(request.GET.get('limit', default)), 1), MAX_LIMIT)
+    except ValueError:
+        return default
+
+
+def jwt_required(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authentication = CachedJWTAuthentication()
+        try:
+            result = await authentication.aauthenticate(request)
+        except AuthenticationFailed as e:
+            detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+            return JsonResponse(detail, status=401, headers={'WWW-Authenticate': authentication.authenticate_header(request)})
+        if result is None:
+            return JsonResponse(
+                {'detail': 'Authentication credentials were not provided.'},
+                status=401,
+                headers={'WWW-Authenticate': authentication.authenticate_header(request)},
+            )
+        request.user = result[0]
+        throttle = UserTokenBucketThrottle()
+        if not await throttle.aallow_request(request):
+            throttled = Throttled(throttle.wait())
+            return JsonResponse({'detail': throttled.detail}, status=429, headers={'Retry-After': str(throttled.wait)})
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@require_GET
+@jwt_required
+async def available_scooters(request):
+    filters = ScooterAvailabilityFilterSerializer(data=request.GET)
+    if not filters.is_valid():
+        return JsonResponse(filters.errors, status=400)
+    scooter_status = filters.validated_data['status']
+    min_battery = filters.validated_data['min_battery']
+    limit = _limit(request)
+    try:
+        after = int(request.GET['after']) if 'after' in request.GET else None
+    except ValueError:
+        return JsonResponse({'after': ['A valid integer is required.']}, status=400)
+
+    scooters = await aavailable_scooters(scooter_status, min_battery, after, limit)
+    page = scooters[:limit]
+    return JsonResponse({
+        'next': page[-1]['num'] if len(scooters) > limit else None,
+        'results': page,
+    })
+
+
+@require_GET
+@jwt_required
+async def my_reservations(request):
+    queryset = Reservation.objects.filter(user_id=request.user.id, is_active=True)
+    reservations = [reservation async for reservation in queryset]
+    return JsonResponse(ReservationSerializer(reservations, many=True).data, safe=False)
+
+
+@require_GET
+@jwt_required
+async def my_rentals(request):
+    queryset = Rental.objects.filter(user_id=request.user.id).order_by('-start_time')[:_limit(request)]
+    rentals = [rental async for rental in queryset]
+    return JsonResponse(RentalSerializer(rentals, many=True).data, safe=False)
+
+
+def _in_area(area, scooters):
+    if not area:
+        return scooters
+    return [
+        scooter for scooter in scooters
+        if scooter[1] is not None
+        and area['min_lat'] <= scooter[1] <= area['max_lat']
+        and area['min_lon'] <= scooter[2] <= area['max_lon']
+    ]
+
+
+@require_GET
+@jwt_required
+async def status_stream(request):
+    """Server-sent status events, optionally limited to scooters located in an area."""
+    filters = ScooterStreamFilterSerializer(data=request.GET)
+    if not filters.is_valid():
+        return JsonResponse(filters.errors, status=400)
+    area = filters.validated_data
+
+    async def events():
+        broadcaster = get_broadcaster()
+        queue = broadcaster.subscribe()
+        try:
+            yield f'retry: {STREAM_RETRY_MS}\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), settings.SCOOTER_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event is None:
+                    return
+                scooters = _in_area(area, event['scooters'])
+                if scooters:
+                    data = json.dumps({**event, 'scooters': scooters}, separators=(',', ':'))
+                    yield f'event: status\ndata: {data}\n\n'
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Keeps nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,427 @@
+"""
+Load benchmark of the reserve -> start -> end rental lifecycle.
+
+Virtual users run the lifecycle concurrently against a shared pool of
+scooters, through the services or through the HTTP API (in-process client,
+full middleware, JWT authentication, DRF stack and the configured rate
+limits, so raise USER_THROTTLE_RATE, RENTAL_USER_THROTTLE_RATE and
+RENTAL_IP_THROTTLE_RATE for the run or expect throttled requests). Stripe is
+answered in process by billing.services.stripe_stub. Outbox entries are not
+dispatched on commit but drained once the load phase is over, so request
+latencies never include the worker side and the worker side is still
+measured.
+
+ReadLoadBenchmark instead drives the async read endpoints of a running
+server over real HTTP, so the same load can be pointed at the WSGI web
+service and at the web-asgi service to compare them.
+
+Fixtures are created under BENCH_PREFIX and removed afterwards, deleting
+anything else that matches them, so the benchmark_rentals command refuses to
+run without --i-know. benchmark_baseline.json holds reference results its
+--baseline option compares against. Only query counts and errors are gated:
+they are the same on any machine for a given configuration. Its latencies and
+throughput were recorded on one developer machine and are advisory, drift
+from them is reported without failing the run.
+"""
+import random
+import threading
+import time
+
+import requests
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from billing.models import Payment, PaymentOutbox
+from billing.services.outbox import RETRYABLE_ERRORS, process_entry
+from billing.services.stripe_stub import stub_stripe
+from rental.models import Scooter, Tariff
+from rental.services.availability import invalidate_availability
+from rental.services.locks import lock_metrics
+from rental.services.reserve import reserve_scooter
+from rental.services.start_rental import start_rental, end_rental
+
+BENCH_PREFIX = 'bench-'
+SCOOTER_BASE = 900000
+OPERATIONS = ('reserve', 'start', 'end')
+READ_PATHS = {
+    'available': '/api/async/scooters/available/',
+    'reservations': '/api/async/reservations/',
+    'rentals': '/api/async/rentals/',
+}
+LOCK_TIMEOUT_MESSAGE = 'Too many requests'
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of an unsorted list, None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+class OperationStats:
+    """Outcomes of one operation. ok/conflict/rejected/throttled/error are mutually exclusive."""
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self.latencies = []
+        self.queries = []
+        self.ok = 0
+        self.conflicts = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def observe(self, outcome: str, seconds: float, queries: int):
+        with self._mutex:
+            self.latencies.append(seconds)
+            self.queries.append(queries)
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def summary(self, elapsed: float) -> dict:
+        count = len(self.latencies)
+
+        def ms(q):
+            value = percentile(self.latencies, q)
+            return None if value is None else round(value * 1000, 3)
+
+        return {
+            'count': count,
+            'ok': self.ok,
+            'conflicts': self.conflicts,
+            'rejected': self.rejected,
+            'throttled': self.throttled,
+            'errors': self.errors,
+            'conflict_rate': round(self.conflicts / count, 4) if count else 0.0,
+            'throughput': round(self.ok / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': ms(50),
+            'p95_ms': ms(95),
+            'p99_ms': ms(99),
+            'queries': round(sum(self.queries) / count, 2) if count else 0.0,
+        }
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ServiceDriver:
+    """Calls the rental services directly."""
+    def __init__(self, user):
+        self.user = user
+
+    def call(self, operation, num) -> str:
+        try:
+            if operation == 'reserve':
+                reserve_scooter(num, self.user)
+            elif operation == 'start':
+                start_rental(num, self.user)
+            else:
+                end_rental(num, self.user)
+        except ValueError as e:
+            return 'conflicts' if str(e) == LOCK_TIMEOUT_MESSAGE else 'rejected'
+        return 'ok'
+
+
+class HttpDriver:
+    """Goes through the API with a JWT like a mobile client."""
+    paths = {
+        'reserve': '/api/scooters/{num}/reserve/',
+        'start': '/api/scooters/{num}/start/',
+        'end': '/api/rentals/{num}/end/',
+    }
+
+    def __init__(self, user):
+        self.client = Client(
+            raise_request_exception=False,
+            HTTP_HOST='localhost',
+            HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}',
+        )
+
+    def call(self, operation, num) -> str:
+        response = self.client.post(self.paths[operation].format(num=num))
+        if response.status_code < 300:
+            return 'ok'
+        if response.status_code == 400:
+            detail = response.json().get('detail', '')
+            return 'conflicts' if detail == LOCK_TIMEOUT_MESSAGE else 'rejected'
+        if response.status_code == 429:
+            return 'throttled'
+        return 'errors'
+
+
+DRIVERS = {'services': ServiceDriver, 'http': HttpDriver}
+
+
+class LifecycleBenchmark:
+    def __init__(self, users=8, scooters=None, iterations=20, mode='services', stripe_latency=0.0, seed=0):
+        if mode not in DRIVERS:
+            raise ValueError(f'Unknown mode {mode}')
+        self.users = users
+        self.scooters = scooters or users * 2
+        self.iterations = iterations
+        self.mode = mode
+        self.stripe_latency = stripe_latency
+        self.seed = seed
+        self.stats = {operation: OperationStats() for operation in OPERATIONS + ('outbox',)}
+        self.created_tariff = None
+
+    def config(self) -> dict:
+        return {
+            'mode': self.mode,
+            'users': self.users,
+            'scooters': self.scooters,
+            'iterations': self.iterations,
+            'stripe_latency_ms': self.stripe_latency * 1000,
+        }
+
+    @property
+    def scooter_nums(self):
+        return range(SCOOTER_BASE, SCOOTER_BASE + self.scooters)
+
+    def setup(self):
+        self.teardown()
+        if not Tariff.objects.exists():
+            self.created_tariff = Tariff.objects.create(name=f'{BENCH_PREFIX}tariff')
+        Scooter.objects.bulk_create([
+            Scooter(num=num, status=Scooter.Status.AVAILABLE, battery_level=100) for num in self.scooter_nums
+        ])
+        User.objects.bulk_create([User(username=f'{BENCH_PREFIX}{i}') for i in range(self.users)])
+        return list(User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id'))
+
+    def teardown(self):
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        Scooter.objects.filter(num__gte=SCOOTER_BASE).delete()
+        if self.created_tariff is not None:
+            self.created_tariff.delete()
+            self.created_tariff = None
+
+    def _measure(self, operation, func, *args):
+        counter = _QueryCounter()
+        started = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(counter):
+                outcome = func(*args)
+        except Exception:
+            outcome = 'errors'
+        self.stats[operation].observe(outcome, time.perf_counter() - started, counter.count)
+        return outcome
+
+    def _virtual_user(self, index, user):
+        driver = DRIVERS[self.mode](user)
+        rng = random.Random(self.seed * 1000 + index)
+        nums = list(self.scooter_nums)
+        try:
+            for _ in range(self.iterations):
+                num = rng.choice(nums)
+                if self._measure('reserve', driver.call, 'reserve', num) != 'ok':
+                    continue
+                # Only a lock timeout can stop the holder of the reservation, try again
+                for _ in range(3):
+                    outcome = self._measure('start', driver.call, 'start', num)
+                    if outcome != 'conflicts':
+                        break
+                if outcome == 'ok':
+                    self._measure('end', driver.call, 'end', num)
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+
+    def _drain_outbox(self):
+        # The hold webhook would store the card, the final charge needs it
+        Payment.objects.filter(rental__user__username__startswith=BENCH_PREFIX).update(
+            stripe_payment_method_id='pm_bench_card'
+        )
+
+        def process(entry_id):
+            try:
+                process_entry(entry_id)
+            except RETRYABLE_ERRORS:
+                return 'rejected'
+            return 'ok'
+
+        # Holds were not dispatched and settlements are left to the settlement worker, the id order
+        # keeps every payment's actions in sequence
+        entries = (
+            PaymentOutbox.objects
+            .filter(payment__rental__user__username__startswith=BENCH_PREFIX, status=PaymentOutbox.Status.PENDING)
+            .order_by('id')
+            .values_list('id', flat=True)
+        )
+        for entry_id in list(entries):
+            self._measure('outbox', process, entry_id)
+
+    def run(self) -> dict:
+        users = self.setup()
+        lock_metrics.reset()
+        # The drain below stands in for the dispatch of holds on commit
+        with stub_stripe(self.stripe_latency), override_settings(PAYMENT_OUTBOX_DISPATCH_ON_COMMIT=False):
+            return self._run(users)
+
+    def _run(self, users) -> dict:
+        try:
+            started = time.perf_counter()
+            if self.users == 1:
+                self._virtual_user(0, users[0])
+            else:
+                threads = [
+                    threading.Thread(target=self._virtual_user, args=(index, user))
+                    for index, user in enumerate(users)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            elapsed = time.perf_counter() - started
+            locks = lock_metrics.snapshot()
+
+            drain_started = time.perf_counter()
+            self._drain_outbox()
+            drain_elapsed = time.perf_counter() - drain_started
+        finally:
+            self.teardown()
+
+        operations = {operation: self.stats[operation].summary(elapsed) for operation in OPERATIONS}
+        operations['outbox'] = self.stats['outbox'].summary(drain_elapsed)
+        attempts = locks['acquired'] + locks['timeouts']
+        locks['contention_rate'] = round(locks['contended'] / attempts, 4) if attempts else 0.0
+        locks['wait_seconds'] = round(locks['wait_seconds'], 4)
+        return {
+            'config': self.config(),
+            'elapsed_seconds': round(elapsed, 3),
+            'operations': operations,
+            'locks': locks,
+        }
+
+
+class ReadLoadBenchmark:
+    """
+    Virtual users GET the async read endpoints of the server at base_url.
+
+    The server must share this database and SECRET_KEY, the fixtures and the
+    JWTs are made here. Latencies include the network, queries run on the
+    server side and are not counted. Requests are held to the server's
+    USER_THROTTLE_RATE, 429s are counted as throttled.
+    """
+    def __init__(self, base_url, users=8, scooters=None, iterations=20, seed=0, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.users = users
+        self.scooters = scooters or users * 2
+        self.iterations = iterations
+        self.seed = seed
+        self.timeout = timeout
+        self.stats = {operation: OperationStats() for operation in READ_PATHS}
+
+    def config(self) -> dict:
+        return {
+            'mode': 'remote',
+            'users': self.users,
+            'scooters': self.scooters,
+            'iterations': self.iterations,
+        }
+
+    @property
+    def scooter_nums(self):
+        return range(SCOOTER_BASE, SCOOTER_BASE + self.scooters)
+
+    def setup(self):
+        self.teardown()
+        Scooter.objects.bulk_create([
+            Scooter(num=num, status=Scooter.Status.AVAILABLE, battery_level=100) for num in self.scooter_nums
+        ])
+        User.objects.bulk_create([User(username=f'{BENCH_PREFIX}{i}') for i in range(self.users)])
+        invalidate_availability()
+        return list(User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id'))
+
+    def teardown(self):
+        User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+        Scooter.objects.filter(num__gte=SCOOTER_BASE).delete()
+        invalidate_availability()
+
+    def _get(self, session, operation):
+        started = time.perf_counter()
+        try:
+            response = session.get(self.base_url + READ_PATHS[operation], timeout=self.timeout)
+            outcome = 'ok' if response.status_code == 200 else 'throttled' if response.status_code == 429 else 'errors'
+        except requests.RequestException:
+            outcome = 'errors'
+        self.stats[operation].observe(outcome, time.perf_counter() - started, 0)
+
+    def _virtual_user(self, index, user):
+        rng = random.Random(self.seed * 1000 + index)
+        operations = list(READ_PATHS)
+        with requests.Session() as session:
+            session.headers['Authorization'] = f'Bearer {AccessToken.for_user(user)}'
+            for _ in range(self.iterations):
+                rng.shuffle(operations)
+                for operation in operations:
+                    self._get(session, operation)
+
+    def run(self) -> dict:
+        users = self.setup()
+        try:
+            started = time.perf_counter()
+            threads = [
+                threading.Thread(target=self._virtual_user, args=(index, user))
+                for index, user in enumerate(users)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            self.teardown()
+
+        return {
+            'config': self.config(),
+            'base_url': self.base_url,
+            'elapsed_seconds': round(elapsed, 3),
+            'operations': {operation: self.stats[operation].summary(elapsed) for operation in READ_PATHS},
+        }
+
+
+def compare(results, baseline) -> list:
+    """
+    Regressions of results against a stored baseline, as readable messages.
+
+    Only the machine-independent numbers are compared: query counts are
+    deterministic for a given lifecycle and may only drift by half a query,
+    errors may not grow.
+    """
+    regressions = []
+    for operation, base in baseline['operations'].items():
+        current = results['operations'].get(operation)
+        if current is None:
+            continue
+        if current['queries'] > base['queries'] + 0.5:
+            regressions.append(f"{operation}: {current['queries']} queries > baseline {base['queries']}")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{operation}: {current['errors']} errors > baseline {base['errors']}")
+    return regressions
+
+
+def timing_drift(results, baseline, tolerance=0.25) -> list:
+    """
+    p95 latency and throughput further than tolerance from the baseline.
+
+    These depend on the machine the baseline was recorded on, so they are
+    reported as advisory and never fail a run.
+    """
+    drift = []
+    for operation, base in baseline['operations'].items():
+        current = results['operations'].get(operation)
+        if current is None:
+            continue
+        if base.get('p95_ms') and current['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            drift.append(f"{operation}: p95 {current['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if base.get('throughput') and current['throughput'] < base['throughput'] * (1 - tolerance):
+            drift.append(f"{operation}: throughput {current['throughput']}/s < baseline {base['throughput']}/s")
+    return drift
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from rental.models import Rental
+from rental.services.pricing import price_batch
+
+
+class Command(BaseCommand):
+    help = 'Recompute fares of completed rentals with the current tariffs and report the differences.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--fix', action='store_true', help='Store the recomputed fares.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        rows = (
+            Rental.objects
+            .filter(status=Rental.Status.COMPLETED, end_time__isnull=False)
+            .order_by('id')
+            .values_list('id', 'tariff_id', 'zone_id', 'start_time', 'end_time', 'total_minutes', 'total_cost')
+            .iterator(chunk_size=chunk_size)
+        )
+        checked = mismatched = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                mismatched += self._audit(chunk, options['fix'])
+                checked += len(chunk)
+                chunk = []
+        if chunk:
+            mismatched += self._audit(chunk, options['fix'])
+            checked += len(chunk)
+        self.stdout.write(f'checked={checked} mismatched={mismatched}')
+
+    def _audit(self, chunk, fix):
+        prices = price_batch((tariff_id, zone_id, start, end) for _, tariff_id, zone_id, start, end, _, _ in chunk)
+        changed = [
+            Rental(pk=row[0], total_minutes=minutes, total_cost=cost)
+            for row, (minutes, cost) in zip(chunk, prices)
+            if (row[5], row[6]) != (minutes, cost)
+        ]
+        for rental in changed:
+            self.stdout.write(f'rental={rental.pk} minutes={rental.total_minutes} cost={rental.total_cost}')
+        if fix and changed:
+            Rental.objects.bulk_update(changed, ['total_minutes', 'total_cost'])
+        return len(changed)
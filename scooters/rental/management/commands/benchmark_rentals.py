@@ -0,0 +1,105 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from rental.benchmark import LifecycleBenchmark, ReadLoadBenchmark, compare, timing_drift
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent users through the reserve/start/end lifecycle with Stripe stubbed and report '
+        'throughput, latency percentiles, lock conflicts and queries per operation. --mode http runs '
+        'under the configured rate limits. '
+        'It creates and deletes bench-* users and scooters from 900000 on, so it only runs '
+        'against a disposable database and with --i-know. --mode remote instead sends the async read '
+        'requests to the server at --base-url, the web-asgi service by default.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['services', 'http', 'remote'], default='services')
+        parser.add_argument(
+            '--base-url', default='http://localhost:8001',
+            help='Server driven by --mode remote; it must use the same database and SECRET_KEY.',
+        )
+        parser.add_argument('--users', type=int, default=8)
+        parser.add_argument('--scooters', type=int, default=None, help='Pool size, twice the users by default.')
+        parser.add_argument('--iterations', type=int, default=20, help='Lifecycles attempted per user.')
+        parser.add_argument('--stripe-latency', type=float, default=0, help='Simulated Stripe latency in ms.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', dest='json_path', help='Write the results to this file.')
+        parser.add_argument(
+            '--baseline', nargs='?', const=str(DEFAULT_BASELINE),
+            help=(
+                f'Fail when query counts or errors regress past this baseline file, {DEFAULT_BASELINE.name} when no '
+                'path is given. Latency and throughput drift is only reported, it depends on the machine.'
+            ),
+        )
+        parser.add_argument('--save-baseline', help='Store the results as the new baseline.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Latency and throughput drift reported.')
+        parser.add_argument(
+            '--i-know', action='store_true',
+            help='Confirm the configured database is disposable; the benchmark deletes its fixtures there.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['i_know']:
+            raise CommandError(
+                f"This deletes bench-* users and scooters >= 900000 in {connection.settings_dict['NAME']}. "
+                'Point it at a disposable database and pass --i-know.'
+            )
+        if options['mode'] == 'remote':
+            benchmark = ReadLoadBenchmark(
+                options['base_url'],
+                users=options['users'],
+                scooters=options['scooters'],
+                iterations=options['iterations'],
+                seed=options['seed'],
+            )
+        else:
+            benchmark = LifecycleBenchmark(
+                users=options['users'],
+                scooters=options['scooters'],
+                iterations=options['iterations'],
+                mode=options['mode'],
+                stripe_latency=options['stripe_latency'] / 1000,
+                seed=options['seed'],
+            )
+        results = benchmark.run()
+        self._report(results)
+
+        for path in (options['json_path'], options['save_baseline']):
+            if path:
+                with open(path, 'w') as f:
+                    json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if baseline.get('config') != results['config']:
+                raise CommandError(f"Baseline was recorded with {baseline.get('config')}")
+            for drift in timing_drift(results, baseline, options['tolerance']):
+                self.stdout.write(self.style.WARNING(f'Advisory, timing drift: {drift}'))
+            regressions = compare(results, baseline)
+            if regressions:
+                raise CommandError('Regressed past baseline:\n' + '\n'.join(regressions))
+            self.stdout.write('No regressions against the baseline')
+
+    def _report(self, results):
+        header = f"{'operation':<13}{'ok':>7}{'confl':>7}{'rej':>6}{'thr':>5}{'err':>5}{'ops/s':>10}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}"
+        self.stdout.write(header)
+        for operation, s in results['operations'].items():
+            self.stdout.write(
+                f"{operation:<13}{s['ok']:>7}{s['conflicts']:>7}{s['rejected']:>6}{s['throttled']:>5}{s['errors']:>5}"
+                f"{s['throughput']:>10}{s['p50_ms'] or '-':>9}{s['p95_ms'] or '-':>9}{s['p99_ms'] or '-':>9}{s['queries']:>9}"
+            )
+        locks = results.get('locks')
+        if locks is None:
+            return
+        self.stdout.write(
+            f"locks: acquired={locks['acquired']} contended={locks['contended']} timeouts={locks['timeouts']} "
+            f"contention_rate={locks['contention_rate']} wait={locks['wait_seconds']}s"
+        )
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rental.services.expiry import pop_due, seconds_until_next, expire_reservation_ids
+
+
+class Command(BaseCommand):
+    help = 'Expire reservations as soon as they are due, using the Redis expiry schedule.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.RESERVATION_EXPIRY_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Process due reservations once and exit.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        poll_interval = settings.RESERVATION_EXPIRY_POLL_INTERVAL
+        while True:
+            due = pop_due(limit=batch_size)
+            if due:
+                counts = expire_reservation_ids(due)
+                self.stdout.write(f"expired={counts['expired']} released={counts['released']}")
+            if options['once']:
+                return
+            if len(due) == batch_size:
+                continue
+            wait = seconds_until_next()
+            time.sleep(poll_interval if wait is None else min(wait, poll_interval))
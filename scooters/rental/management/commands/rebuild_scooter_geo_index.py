@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from rental.services.nearby import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Reload the Redis geo index used by the nearby scooter search from the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(chunk_size=options['chunk_size'])
+        self.stdout.write(f'indexed={indexed}')
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.7 on 2026-10-17 16:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0004_rental'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rental',
+            index=models.Index(fields=['user', '-start_time'], name='rental_user_start_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['expires_at'], name='reservation_active_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scooter',
+            index=models.Index(fields=['status', 'num'], name='scooter_status_num_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scooter',
+            index=models.Index(fields=['created_at'], name='scooter_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scooter',
+            index=models.Index(fields=['battery_level'], name='scooter_battery_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scooter',
+            index=models.Index(fields=['created_at', 'status'], name='scooter_created_status_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-17 16:15
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Zone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(max_length=50, unique=True)),
+                ('name', models.CharField(blank=True, default='', max_length=100)),
+                ('multiplier', models.DecimalField(decimal_places=2, default=1, max_digits=5)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='tariff',
+            name='max_minutes',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tariff',
+            name='unlock_fee',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='TariffWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MaxValueValidator(6)])),
+                ('starts_at', models.TimeField()),
+                ('ends_at', models.TimeField()),
+                ('multiplier', models.DecimalField(decimal_places=2, default=1, max_digits=5)),
+                ('tariff', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='windows', to='rental.tariff')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='rental',
+            name='zone',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='rentals', to='rental.zone'),
+        ),
+    ]
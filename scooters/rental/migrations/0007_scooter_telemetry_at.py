@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0006_tariff_windows_zones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scooter',
+            name='telemetry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental', '0008_scooter_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zone',
+            name='max_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='zone',
+            name='max_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='zone',
+            name='min_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='zone',
+            name='min_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
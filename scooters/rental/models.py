@@ -9,12 +9,39 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 
+class InvalidTransition(Exception):
+    """A scooter status change that is not in Scooter.TRANSITIONS."""
+
+
+class ScooterQuerySet(models.QuerySet):
+    def transition(self, to_status, from_statuses) -> int:
+        """
+        Move the scooters still in one of from_statuses to to_status.
+
+        A single conditional UPDATE, no row is read or locked beforehand; the
+        returned row count tells whether the transition happened.
+        """
+        for from_status in from_statuses:
+            if to_status not in Scooter.TRANSITIONS[from_status]:
+                raise InvalidTransition(f'Scooter cannot go from {from_status} to {to_status}')
+        return self.filter(status__in=from_statuses).update(status=to_status)
+
+
 class Scooter(models.Model):
     class Status(models.TextChoices):
         AVAILABLE = 'available'
         RENTED = 'rented'
         RESERVED = 'reserved'
         UNAVAILABLE = 'unavailable'
+
+    # Allowed status changes, checked by ScooterQuerySet.transition
+    TRANSITIONS = {
+        Status.AVAILABLE: {Status.RESERVED, Status.RENTED, Status.UNAVAILABLE},
+        Status.RESERVED: {Status.RENTED, Status.AVAILABLE},
+        Status.RENTED: {Status.AVAILABLE},
+        Status.UNAVAILABLE: {Status.AVAILABLE},
+    }
+
     num = models.IntegerField(primary_key=True, unique=True)
     status = models.CharField(max_length= 15, choices=Status.choices)
     battery_level = models.IntegerField(
@@ -24,23 +51,72 @@ class Scooter(models.Model):
 
 
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last reported position, fed by telemetry
+    latitude = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+        )
+    longitude = models.FloatField(
+        null=True, blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+        )
+    # Timestamp of the last applied telemetry reading, older readings are dropped
+    telemetry_at = models.DateTimeField(null=True, blank=True)
 
-    indexes = [
-        models.Index(fields=['status']),
-        models.Index(fields=['created_at']),
-        models.Index(fields=['battery_level']),
-        models.Index(fields=['created_at', 'status']),
-    ]
+    objects = ScooterQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Availability listing: filter by status, cursor-ordered by num
+            models.Index(fields=['status', 'num'], name='scooter_status_num_idx'),
+            models.Index(fields=['created_at'], name='scooter_created_at_idx'),
+            models.Index(fields=['battery_level'], name='scooter_battery_level_idx'),
+            models.Index(fields=['created_at', 'status'], name='scooter_created_status_idx'),
+        ]
 
 
 class Tariff(models.Model):
     name = models.CharField(max_length=100, default = 'default')
     per_minute = models.DecimalField(max_digits=10, decimal_places=2, default=3)
+    unlock_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Minutes beyond this cap are not charged, null means no cap
+    max_minutes = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return f'{self.name} - {self.per_minute}$'
 
 
+class TariffWindow(models.Model):
+    """Peak/off-peak window multiplying the tariff's per_minute price."""
+    tariff = models.ForeignKey(Tariff, on_delete=models.CASCADE, related_name='windows')
+    # 0 is Monday, null applies the window every day
+    weekday = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        validators=[MaxValueValidator(6)]
+        )
+    # Local time in PRICING_TIME_ZONE; ends_at <= starts_at wraps past midnight
+    starts_at = models.TimeField()
+    ends_at = models.TimeField()
+    multiplier = models.DecimalField(max_digits=5, decimal_places=2, default=1)
+
+    def __str__(self):
+        return f'{self.tariff.name} - {self.weekday} - {self.starts_at}-{self.ends_at} x{self.multiplier}'
+
+
+class Zone(models.Model):
+    code = models.CharField(max_length=50, unique=True)
+    name = models.CharField(max_length=100, blank=True, default='')
+    multiplier = models.DecimalField(max_digits=5, decimal_places=2, default=1)
+    # Area a ride has to start in to be priced in this zone, unset bounds never match
+    min_latitude = models.FloatField(null=True, blank=True)
+    max_latitude = models.FloatField(null=True, blank=True)
+    min_longitude = models.FloatField(null=True, blank=True)
+    max_longitude = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.code} x{self.multiplier}'
+
+
 def reservation_default_expiry():
     return timezone.now() + timedelta(minutes=5)
 
@@ -62,9 +138,17 @@ class Reservation(models.Model):
             name = 'uniq_active_reservation_per_user'
             ),
         ]
+        indexes = [
+            # Expiry sweep: is_active=True, expires_at < now, ordered by expires_at.
+            # is_active lives in the partial condition so the range scan starts on expires_at
+            models.Index(fields=['expires_at'],
+            condition = Q(is_active=True),
+            name = 'reservation_active_expiry_idx'
+            ),
+        ]
         
     def __str__(self):
-        return f'{self.scooter.num} - {self.user.username} - {self.start_time} - {self.expires_at}'
+        return f'{self.scooter_id} - {self.user_id} - {self.start_time} - {self.expires_at}'
 
 
 class Rental(models.Model):
@@ -74,6 +158,7 @@ class Rental(models.Model):
     scooter = models.ForeignKey(Scooter, on_delete=models.CASCADE, related_name='rentals')
     user = models.ForeignKey(User, on_delete= models.CASCADE, related_name='rentals')
     tariff = models.ForeignKey(Tariff, on_delete=models.CASCADE, related_name='rentals')
+    zone = models.ForeignKey(Zone, on_delete=models.SET_NULL, null=True, blank=True, related_name='rentals')
     start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=15, choices=Status.choices, default=Status.ACTIVE)
@@ -93,20 +178,24 @@ class Rental(models.Model):
                 name='uniq_active_rental_per_scooter'
             ),
         ]
+        indexes = [
+            # RentalViewSet: user's rentals, newest first
+            models.Index(fields=['user', '-start_time'], name='rental_user_start_time_idx'),
+        ]
 
     def calculate_total_cost(self):
         if not self.end_time:
             return None
 
-        minutes = max(1, int((self.end_time - self.start_time).total_seconds() // 60))
-
-        self.total_minutes = minutes
-        self.total_cost = minutes * self.tariff.per_minute
+        from rental.services.pricing import price_rental
+        self.total_minutes, self.total_cost = price_rental(
+            self.tariff_id, self.zone_id, self.start_time, self.end_time
+        )
 
         return self.total_cost
 
     def __str__(self):
-        return f'{self.scooter.num} - {self.user.username} - {self.start_time} - {self.end_time} - {self.status}'
+        return f'{self.scooter_id} - {self.user_id} - {self.start_time} - {self.end_time} - {self.status}'
 
 
 
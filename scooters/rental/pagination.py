@@ -0,0 +1,38 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ScooterCursorPagination(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = 'num'
+
+    def paginate_rows(self, fetch, request):
+        """
+        Paginate serialized rows instead of a queryset. fetch(position, limit,
+        reverse) returns up to limit + 1 rows past position in walking order;
+        numbers are unique, so cursor offsets are never needed.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = (self.ordering,) if isinstance(self.ordering, str) else self.ordering
+        self.cursor = self.decode_cursor(request)
+        reverse, current_position = (self.cursor.reverse, self.cursor.position) if self.cursor else (False, None)
+
+        rows = fetch(None if current_position is None else int(current_position), self.page_size, reverse)
+        self.page = rows[:self.page_size]
+        has_following_position = len(rows) > self.page_size
+        following_position = str(rows[-1]['num']) if has_following_position else None
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None
+            self.has_previous = has_following_position
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = current_position is not None
+            self.next_position = following_position
+            self.previous_position = current_position
+        return self.page
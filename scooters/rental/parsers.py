@@ -0,0 +1,15 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """Newline-delimited JSON, one object per line."""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return [json.loads(line) for line in stream.read().splitlines() if line.strip()]
+        except ValueError as e:
+            raise ParseError(f'NDJSON parse error - {e}')
@@ -4,12 +4,39 @@ from rental.models import Scooter, Tariff, Reservation, Rental
 class ScooterSerializer(serializers.ModelSerializer):
     class Meta:
         model = Scooter
-        fields = ['num', 'status', 'battery_level', 'created_at']
+        fields = ['num', 'status', 'battery_level', 'latitude', 'longitude', 'created_at']
+        # Status only changes through the rental services and the status action
+        read_only_fields = ['status']
+
+class ScooterServiceStatusSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=[Scooter.Status.AVAILABLE, Scooter.Status.UNAVAILABLE])
+
+class ScooterAvailabilityFilterSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Scooter.Status.choices, default=Scooter.Status.AVAILABLE)
+    min_battery = serializers.IntegerField(min_value=0, max_value=100, default=0)
+
+class ScooterNearbyFilterSerializer(serializers.Serializer):
+    lat = serializers.FloatField(min_value=-90, max_value=90)
+    lon = serializers.FloatField(min_value=-180, max_value=180)
+    k = serializers.IntegerField(min_value=1, max_value=50, default=10)
+    min_battery = serializers.IntegerField(min_value=0, max_value=100, default=0)
+    radius_km = serializers.FloatField(min_value=0.1, max_value=20, default=5)
+
+class ScooterStreamFilterSerializer(serializers.Serializer):
+    min_lat = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    max_lat = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    min_lon = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    max_lon = serializers.FloatField(min_value=-180, max_value=180, required=False)
+
+    def validate(self, attrs):
+        if attrs and len(attrs) != 4:
+            raise serializers.ValidationError('The area needs min_lat, max_lat, min_lon and max_lon.')
+        return attrs
 
 class TariffSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tariff
-        fields = ['name', 'per_minute']
+        fields = ['name', 'per_minute', 'unlock_fee', 'max_minutes']
 
 class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,4 +46,4 @@ class ReservationSerializer(serializers.ModelSerializer):
 class RentalSerializer(serializers.ModelSerializer):
     class Meta:
         model = Rental
-        fields = ['scooter', 'user', 'tariff', 'start_time', 'end_time', 'status', 'total_minutes', 'total_cost']
\ No newline at end of file
+        fields = ['scooter', 'user', 'tariff', 'zone', 'start_time', 'end_time', 'status', 'total_minutes', 'total_cost']
\ No newline at end of file
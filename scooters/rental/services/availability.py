@@ -0,0 +1,178 @@
+"""
+Cached snapshot of the scooter availability listing.
+
+The listing is ordered by scooter number. Numbers are grouped in shards of
+SCOOTER_AVAILABILITY_SHARD_SIZE and the serialized scooters of each shard
+and status are cached under the shard's version; pages are assembled from
+these entries and filtered by battery level in memory. A status or battery
+change bumps only the version of its scooter's shard, so under fleet churn
+the rest of the listing stays cached and a page costs a few shard entries
+however large the fleet. Adding or removing scooters bumps VERSION_KEY,
+which every entry is stored under.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+
+from rental.models import Scooter
+from rental.serializers import ScooterSerializer
+from rental.services.versioning import get_version, aget_version, bump_version
+from scooters.redis_async import get_async_redis
+
+VERSION_KEY = 'scooters:availability:version'
+# Shard entries read from the cache in the first round trip, doubled on every further one
+SHARDS_PER_FETCH = 8
+
+
+def shard_key(shard: int) -> str:
+    return f'scooters:availability:shard:{shard}'
+
+
+def _shard(num) -> int:
+    return int(num) // settings.SCOOTER_AVAILABILITY_SHARD_SIZE
+
+
+def availability_version() -> int:
+    return get_version(VERSION_KEY)
+
+
+def invalidate_availability():
+    """Drop every cached entry, for scooters added to or removed from the fleet."""
+    bump_version(VERSION_KEY)
+
+
+def invalidate_scooters(nums):
+    """Drop the cached entries of the shards holding nums."""
+    for shard in sorted({_shard(num) for num in nums}):
+        bump_version(shard_key(shard))
+
+
+def _shard_order(position, reverse, last_num):
+    last_shard = _shard(last_num)
+    if reverse:
+        start = last_shard if position is None else min(_shard(position), last_shard)
+        return list(range(start, -1, -1))
+    return list(range(0 if position is None else _shard(position), last_shard + 1))
+
+
+def _shard_queryset(status, shards):
+    size = settings.SCOOTER_AVAILABILITY_SHARD_SIZE
+    return (
+        Scooter.objects
+        .filter(status=status, num__gte=min(shards) * size, num__lt=(max(shards) + 1) * size)
+        .order_by('num')
+    )
+
+
+def _entries(shards, scooters):
+    entries = {shard: [] for shard in shards}
+    for row in ScooterSerializer(scooters, many=True).data:
+        if _shard(row['num']) in entries:
+            entries[_shard(row['num'])].append(row)
+    return entries
+
+
+def _batches(shards):
+    start, size = 0, SHARDS_PER_FETCH
+    while start < len(shards):
+        yield shards[start:start + size]
+        start, size = start + size, size * 2
+
+
+def _collect(rows, entries, shards, position, reverse, min_battery, limit) -> bool:
+    """Append the matching rows of shards in walking order, True once limit + 1 were found."""
+    for shard in shards:
+        for row in reversed(entries[shard]) if reverse else entries[shard]:
+            if position is not None and (row['num'] >= position if reverse else row['num'] <= position):
+                continue
+            if row['battery_level'] < min_battery:
+                continue
+            rows.append(row)
+            if len(rows) > limit:
+                return True
+    return False
+
+
+def _last_num(version):
+    key = f'scooters:availability:v{version}:last_num'
+    return cache.get_or_set(
+        key,
+        lambda: Scooter.objects.aggregate(last=Max('num'))['last'] or 0,
+        timeout=settings.SCOOTER_AVAILABILITY_CACHE_TTL,
+    )
+
+
+def _cached_shards(version, status, shards):
+    version_keys = [shard_key(shard) for shard in shards]
+    versions = cache.get_many(version_keys)
+    prefix = f'scooters:availability:v{version}:{status}'
+    keys = {
+        shard: f'{prefix}:{shard}:{versions.get(key) or get_version(key)}'
+        for shard, key in zip(shards, version_keys)
+    }
+    cached = cache.get_many(list(keys.values()))
+    entries = {shard: cached[key] for shard, key in keys.items() if key in cached}
+    missing = [shard for shard in shards if shard not in entries]
+    if missing:
+        # Versions were read first, an entry built during a change is stored under the old one
+        loaded = _entries(missing, _shard_queryset(status, missing))
+        cache.set_many({keys[shard]: loaded[shard] for shard in missing}, timeout=settings.SCOOTER_AVAILABILITY_CACHE_TTL)
+        entries.update(loaded)
+    return entries
+
+
+def available_scooters(status, min_battery, position, limit, reverse=False) -> list:
+    """
+    Up to limit + 1 serialized scooters past position (before it when
+    reverse), in walking order. The extra one tells there is a next page.
+    """
+    version = availability_version()
+    rows = []
+    shards = _shard_order(position, reverse, _last_num(version))
+    for batch in _batches(shards):
+        if _collect(rows, _cached_shards(version, status, batch), batch, position, reverse, min_battery, limit):
+            break
+    return rows
+
+
+async def _alast_num(client, version):
+    key = cache.make_key(f'scooters:availability:async:v{version}:last_num')
+    raw = await client.get(key)
+    if raw is not None:
+        return int(raw)
+    last_num = (await Scooter.objects.aaggregate(last=Max('num')))['last'] or 0
+    await client.set(key, last_num, ex=settings.SCOOTER_AVAILABILITY_CACHE_TTL)
+    return last_num
+
+
+async def _acached_shards(client, version, status, shards):
+    raw_versions = await client.mget([cache.make_key(shard_key(shard)) for shard in shards])
+    keys = {}
+    for shard, raw in zip(shards, raw_versions):
+        shard_version = int(raw) if raw is not None else await aget_version(shard_key(shard), client)
+        keys[shard] = cache.make_key(f'scooters:availability:async:v{version}:{status}:{shard}:{shard_version}')
+    cached = await client.mget(list(keys.values()))
+    entries = {shard: json.loads(raw) for shard, raw in zip(keys, cached) if raw is not None}
+    missing = [shard for shard in shards if shard not in entries]
+    if missing:
+        loaded = _entries(missing, [scooter async for scooter in _shard_queryset(status, missing)])
+        pipe = client.pipeline(transaction=False)
+        for shard in missing:
+            pipe.set(keys[shard], json.dumps(loaded[shard]), ex=settings.SCOOTER_AVAILABILITY_CACHE_TTL)
+        await pipe.execute()
+        entries.update(loaded)
+    return entries
+
+
+async def aavailable_scooters(status, min_battery, after, limit) -> list:
+    """Async variant of available_scooters() for rental.async_views, entries are stored as JSON."""
+    client = get_async_redis()
+    version = await aget_version(VERSION_KEY, client)
+    rows = []
+    shards = _shard_order(after, False, await _alast_num(client, version))
+    for batch in _batches(shards):
+        if _collect(rows, await _acached_shards(client, version, status, batch), batch, after, False, min_battery, limit):
+            break
+    return rows
@@ -0,0 +1,95 @@
+"""
+Reservation expiry scheduling on a Redis sorted set.
+
+reserve_scooter registers every reservation under its expiry timestamp and the
+expire_reservations_worker command pops due members as soon as they expire.
+rental.tasks.expire_reservations remains as a periodic safety net.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from rental.models import Reservation, Scooter
+from rental.services.status_events import status_changed_on_commit
+
+EXPIRY_KEY = 'scooters:reservations:expiry'
+
+# Pops up to ARGV[2] members with score <= ARGV[1] atomically, so two workers never get the same id
+POP_DUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+"""
+
+
+def schedule_expiry(reservation_id, expires_at):
+    get_redis_connection('default').zadd(EXPIRY_KEY, {str(reservation_id): expires_at.timestamp()})
+
+
+def pop_due(now=None, limit: int = 1000) -> list:
+    now = now or timezone.now()
+    ids = get_redis_connection('default').eval(POP_DUE_SCRIPT, 1, EXPIRY_KEY, now.timestamp(), limit)
+    return [int(i) for i in ids]
+
+
+def seconds_until_next(now=None):
+    """Seconds until the earliest scheduled expiry, None when nothing is scheduled."""
+    now = now or timezone.now()
+    head = get_redis_connection('default').zrange(EXPIRY_KEY, 0, 0, withscores=True)
+    if not head:
+        return None
+    return max(0.0, head[0][1] - now.timestamp())
+
+
+def release_reservations(batch) -> dict:
+    """
+    Deactivate (reservation_id, scooter_num) pairs and free the scooters still RESERVED.
+
+    Scooters are locked with skip_locked before touching them: one held by a
+    concurrent start_rental or reserve_scooter is left alone, together with its
+    reservation, for a later pass instead of risking a lock-order deadlock.
+    """
+    if not batch:
+        return {'expired': 0, 'released': 0, 'skipped': []}
+    locked = dict(
+        Scooter.objects.select_for_update(skip_locked=True)
+        .filter(num__in={num for _, num in batch})
+        .order_by('num')
+        .values_list('num', 'status')
+    )
+    reservation_ids = [reservation_id for reservation_id, num in batch if num in locked]
+    skipped = [reservation_id for reservation_id, num in batch if num not in locked]
+    released_nums = [num for num, scooter_status in locked.items() if scooter_status == Scooter.Status.RESERVED]
+
+    expired = Reservation.objects.filter(id__in=reservation_ids).update(is_active=False) if reservation_ids else 0
+    if released_nums:
+        Scooter.objects.filter(num__in=released_nums).transition(Scooter.Status.AVAILABLE, [Scooter.Status.RESERVED])
+        status_changed_on_commit(released_nums, Scooter.Status.AVAILABLE)
+    return {'expired': expired, 'released': len(released_nums), 'skipped': skipped}
+
+
+@transaction.atomic
+def expire_reservation_ids(reservation_ids, now=None) -> dict:
+    """Expire the given reservations if they are still active and past their expiry."""
+    now = now or timezone.now()
+    batch = list(
+        Reservation.objects.select_for_update(skip_locked=True)
+        .filter(id__in=reservation_ids, is_active=True, expires_at__lte=now)
+        .values_list('id', 'scooter_id')
+    )
+    counts = release_reservations(batch)
+    skipped = counts.pop('skipped')
+    if skipped:
+        # Their scooters are busy right now, look again shortly
+        retry_at = now + timedelta(seconds=1)
+
+        def reschedule():
+            for reservation_id in skipped:
+                schedule_expiry(reservation_id, retry_at)
+
+        transaction.on_commit(reschedule, robust=True)
+    return counts
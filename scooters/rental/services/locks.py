@@ -1,26 +1,112 @@
 """
-This module provides a simple lock mechanism using Django's cache backend.
+This module provides a token-owned Redis lock.
+
+A lock is only released by the holder of its token (compare-and-delete), and
+acquisition can wait for a bounded time with jittered exponential backoff.
+Contention and wait time are recorded in lock_metrics.
 """
+import random
+import threading
 import time
+import uuid
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+BACKOFF_MIN = 0.005
+BACKOFF_MAX = 0.1
+
+# Deletes the key only if it still holds the caller's token
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LockMetrics:
+    """In-process counters for lock acquisition."""
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
 
-from django.core.cache import cache
+    def observe(self, acquired: bool, contended: bool, waited: float):
+        with self._mutex:
+            self.acquired += acquired
+            self.contended += contended
+            self.timeouts += not acquired
+            self.wait_seconds += waited
 
-def acquire_lock(key:str, ttl_seconds: int = 5) -> bool:
-    return cache.add(key, '1', timeout=ttl_seconds)
+    def snapshot(self) -> dict:
+        with self._mutex:
+            return {
+                'acquired': self.acquired,
+                'contended': self.contended,
+                'timeouts': self.timeouts,
+                'wait_seconds': self.wait_seconds,
+            }
 
-def release_lock(key:str) -> bool:
-    cache.delete(key)
+
+lock_metrics = LockMetrics()
+
+
+def acquire_lock(key: str, ttl_seconds: float = 5, wait_seconds: float = 0):
+    """Try to take the lock, waiting up to wait_seconds. Returns the owner token or None."""
+    client = get_redis_connection('default')
+    token = uuid.uuid4().hex
+    started = time.monotonic()
+    deadline = started + wait_seconds
+    delay = BACKOFF_MIN
+    contended = False
+    while True:
+        if client.set(key, token, nx=True, px=int(ttl_seconds * 1000)):
+            lock_metrics.observe(True, contended, time.monotonic() - started)
+            return token
+        contended = True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            lock_metrics.observe(False, contended, time.monotonic() - started)
+            return None
+        time.sleep(min(remaining, random.uniform(delay / 2, delay)))
+        delay = min(delay * 2, BACKOFF_MAX)
+
+
+def release_lock(key: str, token: str) -> bool:
+    return bool(get_redis_connection('default').eval(RELEASE_SCRIPT, 1, key, token))
 
 
 class lock_scope:
-    def __init__(self, key:str, ttl_seconds: int = 5):
+    def __init__(self, key: str, ttl_seconds: float = 5, wait_seconds: float = 0):
         self.key = key
-        self.ttl= ttl_seconds
-        self.acquired = False
+        self.ttl = ttl_seconds
+        self.wait = wait_seconds
+        self.token = None
+
+    @property
+    def acquired(self) -> bool:
+        return self.token is not None
 
     def __enter__(self):
-        self.acquired = acquire_lock(self.key, self.ttl)
+        self.token = acquire_lock(self.key, self.ttl, self.wait)
         return self.acquired
 
     def __exit__(self, exc_type, exc, tb):
-        release_lock(self.key)
\ No newline at end of file
+        if self.token is not None:
+            release_lock(self.key, self.token)
+            self.token = None
+
+
+def scooter_lock(scooter_num) -> lock_scope:
+    """Lock serializing every status change of one scooter."""
+    return lock_scope(
+        f'lock:scooter:{scooter_num}',
+        ttl_seconds=settings.SCOOTER_LOCK_TTL,
+        wait_seconds=settings.SCOOTER_LOCK_WAIT,
+    )
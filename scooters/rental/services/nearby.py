@@ -0,0 +1,90 @@
+"""
+Nearest-available-scooter search on Redis geo sets.
+
+POSITIONS_KEY holds the last position of every located scooter, AVAILABLE_KEY
+only the AVAILABLE ones and BATTERY_KEY their battery levels. Telemetry and
+status changes keep them up to date incrementally (see
+rental.services.status_events); rebuild_index reloads them from the database.
+"""
+from django_redis import get_redis_connection
+
+from rental.models import Scooter
+
+POSITIONS_KEY = 'scooters:geo:positions'
+AVAILABLE_KEY = 'scooters:geo:available'
+BATTERY_KEY = 'scooters:geo:battery'
+
+
+def index_scooters(rows, pipe=None):
+    """Index (num, status, battery_level, latitude, longitude) rows; position and battery may be None."""
+    own_pipe = pipe is None
+    if own_pipe:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+    for num, scooter_status, battery_level, latitude, longitude in rows:
+        if battery_level is not None:
+            pipe.hset(BATTERY_KEY, num, battery_level)
+        if latitude is not None and longitude is not None:
+            pipe.geoadd(POSITIONS_KEY, [longitude, latitude, num])
+            if scooter_status == Scooter.Status.AVAILABLE:
+                pipe.geoadd(AVAILABLE_KEY, [longitude, latitude, num])
+        if scooter_status != Scooter.Status.AVAILABLE:
+            pipe.zrem(AVAILABLE_KEY, num)
+    if own_pipe:
+        pipe.execute()
+
+
+def index_status_changes(nums, scooter_status):
+    """Move scooters in or out of the available set using their last indexed position."""
+    if not nums:
+        return
+    client = get_redis_connection('default')
+    if scooter_status != Scooter.Status.AVAILABLE:
+        client.zrem(AVAILABLE_KEY, *nums)
+        return
+    positions = client.geopos(POSITIONS_KEY, *nums)
+    located = [(num, position) for num, position in zip(nums, positions) if position is not None]
+    if located:
+        client.geoadd(AVAILABLE_KEY, [value for num, (lon, lat) in located for value in (lon, lat, num)])
+
+
+def scooter_position(num):
+    """(latitude, longitude) last indexed for the scooter, or None."""
+    position = get_redis_connection('default').geopos(POSITIONS_KEY, num)[0]
+    return (position[1], position[0]) if position else None
+
+
+def nearest_available(latitude, longitude, k=10, min_battery=0, radius_km=5.0):
+    """Up to k (num, distance_km, battery_level) of the nearest AVAILABLE scooters, nearest first."""
+    client = get_redis_connection('default')
+    count = k * 2
+    while True:
+        candidates = client.geosearch(
+            AVAILABLE_KEY, longitude=longitude, latitude=latitude,
+            radius=radius_km, unit='km', sort='ASC', count=count, withdist=True,
+        )
+        nums = [member for member, _ in candidates]
+        batteries = client.hmget(BATTERY_KEY, nums) if nums else []
+        found = [
+            (int(member), round(distance, 4), int(battery))
+            for (member, distance), battery in zip(candidates, batteries)
+            if battery is not None and int(battery) >= min_battery
+        ]
+        # Fewer candidates than asked for means the radius is exhausted
+        if len(found) >= k or len(candidates) < count:
+            return found[:k]
+        count *= 4
+
+
+def rebuild_index(chunk_size=2000) -> int:
+    client = get_redis_connection('default')
+    client.delete(POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY)
+    rows = Scooter.objects.values_list('num', 'status', 'battery_level', 'latitude', 'longitude')
+    pipe = client.pipeline(transaction=False)
+    indexed = 0
+    for row in rows.iterator(chunk_size=chunk_size):
+        index_scooters([row], pipe)
+        indexed += 1
+        if indexed % chunk_size == 0:
+            pipe.execute()
+    pipe.execute()
+    return indexed
@@ -0,0 +1,190 @@
+"""
+Tariff pricing engine.
+
+Each tariff is compiled into per-minute-of-week rates in minor units and their
+prefix sums, so the price of any ride is a constant number of lookups however
+long it is. Compiled tables are cached in process memory and in Redis under
+the tariff version (see rental.services.tariffs), which every tariff, tariff
+window and zone change bumps. A ride is priced in the zone whose area its
+start position falls in (zone_at).
+"""
+from array import array
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.cache import cache
+
+from rental.models import Tariff, Zone
+from rental.services.tariffs import tariff_version
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+_compiled = {'version': None, 'tariffs': {}, 'zones': None, 'areas': None}
+
+
+def _to_minor(amount) -> int:
+    return int((Decimal(amount) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def _from_minor(amount_minor: int) -> Decimal:
+    return (Decimal(amount_minor) / 100).quantize(Decimal('0.01'))
+
+
+class CompiledTariff:
+    __slots__ = ('tariff_id', 'unlock_fee_minor', 'max_minutes', 'prefix')
+
+    def __init__(self, tariff_id, unlock_fee_minor, max_minutes, prefix):
+        self.tariff_id = tariff_id
+        self.unlock_fee_minor = unlock_fee_minor
+        self.max_minutes = max_minutes
+        # prefix[m] is the price of minutes 0..m-1 of the week, len == MINUTES_PER_WEEK + 1
+        self.prefix = prefix
+
+    def __getstate__(self):
+        return (self.tariff_id, self.unlock_fee_minor, self.max_minutes, self.prefix)
+
+    def __setstate__(self, state):
+        self.tariff_id, self.unlock_fee_minor, self.max_minutes, self.prefix = state
+
+    def minutes_cost_minor(self, start_minute: int, minutes: int) -> int:
+        """Price of `minutes` consecutive minutes starting at minute-of-week `start_minute`."""
+        prefix = self.prefix
+        weeks, minutes = divmod(minutes, MINUTES_PER_WEEK)
+        cost = weeks * prefix[MINUTES_PER_WEEK]
+        end = start_minute + minutes
+        if end <= MINUTES_PER_WEEK:
+            return cost + prefix[end] - prefix[start_minute]
+        return cost + prefix[MINUTES_PER_WEEK] - prefix[start_minute] + prefix[end - MINUTES_PER_WEEK]
+
+    def price_minor(self, start_minute: int, minutes: int, zone_multiplier: Decimal = Decimal(1)) -> int:
+        if self.max_minutes is not None:
+            minutes = min(minutes, self.max_minutes)
+        ride = self.minutes_cost_minor(start_minute, minutes)
+        if zone_multiplier != 1:
+            ride = int((ride * zone_multiplier).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+        return self.unlock_fee_minor + ride
+
+
+def compile_tariff(tariff, windows) -> CompiledTariff:
+    """Expand the tariff and its windows into per-minute rates of the week."""
+    base = Decimal(tariff.per_minute)
+    rates = [_to_minor(base)] * MINUTES_PER_WEEK
+    for window in windows:
+        rate = _to_minor(base * window.multiplier)
+        start = window.starts_at.hour * 60 + window.starts_at.minute
+        end = window.ends_at.hour * 60 + window.ends_at.minute
+        length = (end - start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+        days = range(7) if window.weekday is None else [window.weekday]
+        for day in days:
+            first = day * MINUTES_PER_DAY + start
+            for minute in range(first, first + length):
+                rates[minute % MINUTES_PER_WEEK] = rate
+
+    prefix = array('q', [0]) * (MINUTES_PER_WEEK + 1)
+    total = 0
+    for minute, rate in enumerate(rates):
+        total += rate
+        prefix[minute + 1] = total
+    return CompiledTariff(tariff.id, _to_minor(tariff.unlock_fee), tariff.max_minutes, prefix)
+
+
+def _current_tables():
+    version = tariff_version()
+    if _compiled['version'] != version:
+        _compiled.update(version=version, tariffs={}, zones=None, areas=None)
+    return version
+
+
+def get_compiled_tariff(tariff_id) -> CompiledTariff:
+    version = _current_tables()
+    compiled = _compiled['tariffs'].get(tariff_id)
+    if compiled is None:
+        key = f'tariff:compiled:v{version}:{tariff_id}'
+        compiled = cache.get(key)
+        if compiled is None:
+            tariff = Tariff.objects.get(pk=tariff_id)
+            compiled = compile_tariff(tariff, tariff.windows.all())
+            cache.set(key, compiled, timeout=None)
+        _compiled['tariffs'][tariff_id] = compiled
+    return compiled
+
+
+def get_zone_multipliers() -> dict:
+    version = _current_tables()
+    if _compiled['zones'] is None:
+        key = f'tariff:zones:v{version}'
+        zones = cache.get(key)
+        if zones is None:
+            zones = dict(Zone.objects.values_list('id', 'multiplier'))
+            cache.set(key, zones, timeout=None)
+        _compiled['zones'] = zones
+    return _compiled['zones']
+
+
+def get_zone_areas() -> list:
+    """(id, min_latitude, max_latitude, min_longitude, max_longitude) of the zones with an area, by id."""
+    version = _current_tables()
+    if _compiled['areas'] is None:
+        key = f'tariff:zone-areas:v{version}'
+        areas = cache.get(key)
+        if areas is None:
+            areas = list(
+                Zone.objects
+                .filter(min_latitude__isnull=False, max_latitude__isnull=False,
+                        min_longitude__isnull=False, max_longitude__isnull=False)
+                .order_by('id')
+                .values_list('id', 'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude')
+            )
+            cache.set(key, areas, timeout=None)
+        _compiled['areas'] = areas
+    return _compiled['areas']
+
+
+def zone_at(latitude, longitude):
+    """Id of the first zone whose area contains the position, or None."""
+    for zone_id, min_latitude, max_latitude, min_longitude, max_longitude in get_zone_areas():
+        if min_latitude <= latitude <= max_latitude and min_longitude <= longitude <= max_longitude:
+            return zone_id
+    return None
+
+
+def billable_minutes(start_time: datetime, end_time: datetime) -> int:
+    return max(1, int((end_time - start_time).total_seconds() // 60))
+
+
+def minute_of_week(moment: datetime) -> int:
+    local = moment.astimezone(ZoneInfo(settings.PRICING_TIME_ZONE))
+    return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute
+
+
+def price_rental(tariff_id, zone_id, start_time, end_time):
+    """Returns (total_minutes, total_cost) of one ride."""
+    minutes = billable_minutes(start_time, end_time)
+    zone_multiplier = get_zone_multipliers().get(zone_id, Decimal(1)) if zone_id else Decimal(1)
+    cost_minor = get_compiled_tariff(tariff_id).price_minor(minute_of_week(start_time), minutes, zone_multiplier)
+    return minutes, _from_minor(cost_minor)
+
+
+def price_batch(rides) -> list:
+    """
+    Price many rides in one pass.
+
+    rides is an iterable of (tariff_id, zone_id, start_time, end_time) tuples;
+    returns a list of (total_minutes, total_cost). Each distinct tariff is
+    resolved once for the whole batch.
+    """
+    zones = get_zone_multipliers()
+    compiled = {}
+    one = Decimal(1)
+    results = []
+    for tariff_id, zone_id, start_time, end_time in rides:
+        table = compiled.get(tariff_id)
+        if table is None:
+            table = compiled[tariff_id] = get_compiled_tariff(tariff_id)
+        minutes = billable_minutes(start_time, end_time)
+        cost_minor = table.price_minor(minute_of_week(start_time), minutes, zones.get(zone_id, one) if zone_id else one)
+        results.append((minutes, _from_minor(cost_minor)))
+    return results
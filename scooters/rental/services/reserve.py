@@ -1,21 +1,29 @@
 from datetime import timedelta
 from django.db import transaction
 from django.utils import timezone
-from django.core.exceptions import ValidationError
 
-from rental.models import Scooter, Reservation, Tariff
-from .locks import lock_scope
+from rental.models import Scooter, Reservation
+from .locks import scooter_lock
+from .expiry import schedule_expiry
+from .status_events import status_changed_on_commit
 
 RESERVATION_LIFETIME = timedelta(minutes=5)
 
-@transaction.atomic
 def reserve_scooter(scooter_num, user):
-    lock_key = f'lock:reserve:user:{user.id}:scooter:{scooter_num}'
-    with lock_scope(lock_key, ttl_seconds=5) as ok:
+    # The lock is held until the transaction has committed
+    with scooter_lock(scooter_num) as ok:
         if not ok:
             raise ValueError('Too many requests')
-    scooter = Scooter.objects.select_for_update().get(num=scooter_num)
-    if scooter.status != Scooter.Status.AVAILABLE:
+        return _reserve_scooter(scooter_num, user)
+
+@transaction.atomic
+def _reserve_scooter(scooter_num, user):
+    scooter_num = int(scooter_num)
+    reserved = (
+        Scooter.objects.filter(num=scooter_num)
+        .transition(Scooter.Status.RESERVED, [Scooter.Status.AVAILABLE])
+    )
+    if not reserved:
         raise ValueError(f'Scooter {scooter_num} is not available')
         
     Reservation.objects.filter(user=user, is_active=True).update(is_active=False)
@@ -24,11 +32,12 @@ def reserve_scooter(scooter_num, user):
 
     reservation = Reservation.objects.create(
         user=user,
-        scooter=scooter,
+        scooter_id=scooter_num,
         expires_at=now + RESERVATION_LIFETIME,
         start_time=now,
         is_active=True,
         )
-    scooter.status = Scooter.Status.RESERVED
-    scooter.save(update_fields=['status'])
+    status_changed_on_commit([scooter_num], Scooter.Status.RESERVED)
+    # A Redis outage must not fail the reservation, the periodic sweep still expires it
+    transaction.on_commit(lambda: schedule_expiry(reservation.id, reservation.expires_at), robust=True)
     return reservation
@@ -0,0 +1,22 @@
+from django.db import transaction
+
+from rental.models import Scooter
+from .status_events import status_changed_on_commit
+
+# Statuses staff may set by hand, and the ones each can be set from. Ride
+# states belong to the reservation and rental services.
+SERVICE_TRANSITIONS = {
+    Scooter.Status.AVAILABLE: [Scooter.Status.UNAVAILABLE],
+    Scooter.Status.UNAVAILABLE: [Scooter.Status.AVAILABLE],
+}
+
+@transaction.atomic
+def set_service_status(scooter_num, to_status):
+    scooter_num = int(scooter_num)
+    changed = (
+        Scooter.objects.filter(num=scooter_num)
+        .transition(to_status, SERVICE_TRANSITIONS[to_status])
+    )
+    if not changed:
+        raise ValueError(f'Scooter {scooter_num} cannot be made {to_status}')
+    status_changed_on_commit([scooter_num], to_status)
@@ -1,91 +1,102 @@
 from decimal import Decimal
-import uuid
-    
+
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from django.core.exceptions import ValidationError
 from django.conf import settings
 
-from rental.models import Scooter, Reservation, Rental, Tariff
-from .locks import lock_scope
-from billing.models import Payment
-from billing.services.stripe_service import ensure_customer, create_hold_intent, charge_final_amount, cancel_hold_intent
+from rental.models import Scooter, Reservation, Rental
+from .locks import scooter_lock
+from .nearby import scooter_position
+from .pricing import zone_at
+from .status_events import status_changed_on_commit
+from .tariffs import get_active_tariff
+from billing.models import Payment, PaymentOutbox
+from billing.services.outbox import enqueue_payment_action
+from billing.services.payment_methods import get_saved_payment_method
 
-@transaction.atomic
 def start_rental(scooter_num, user):
-
-    lock_key = f'lock:start_rental:user:{user.id}:scooter:{scooter_num}'
-    with lock_scope(lock_key, ttl_seconds=5) as ok:
+    # The lock is held until the transaction has committed
+    with scooter_lock(scooter_num) as ok:
         if not ok:
             raise ValueError('Too many requests')
+        return _start_rental(scooter_num, user)
 
+@transaction.atomic
+def _start_rental(scooter_num, user):
+    scooter_num = int(scooter_num)
     now = timezone.now()
 
-    scooter = Scooter.objects.select_for_update().get(num=scooter_num)
-    if scooter.status in (Scooter.Status.RESERVED, Scooter.Status.AVAILABLE):
-        reservation = None
-        if scooter.status == Scooter.Status.RESERVED:
-            reservation = (
-                Reservation.objects.select_for_update()
-                .filter(scooter=scooter, is_active=True)
-                .first()
-            )
-            if reservation is None:
-                raise ValidationError(f'Scooter {scooter_num} is reserved but no active reservation found')
-            if reservation.user != user:
-                raise ValidationError(f'Scooter {scooter_num} is reserved by another user')
-
-        tariff = Tariff.objects.first()
-        if tariff is None:
-            raise ValidationError('No tariff configured')
-
-        scooter.status = Scooter.Status.RENTED
-        scooter.save(update_fields=['status'])
-        if reservation is not None:
-            reservation.is_active = False
-            reservation.save(update_fields=['is_active'])
-
-        rental = Rental.objects.create(
-            scooter=scooter,
-            user=user,
-            tariff=tariff,
-            start_time=now,
-            status=Rental.Status.ACTIVE,
-            total_minutes=0,
-            total_cost=0,
-        )
-        # Create payment with hold amount
-        hold_amount = Decimal(str(settings.RENTAL_HOLD_AMOUNT))
-        hold_amount_minor = int(hold_amount * 100)
-        
-        payment = Payment.objects.create(
-            rental=rental,
-            hold_amount=hold_amount,
-            hold_amount_minor=hold_amount_minor,
+    tariff = get_active_tariff()
+    if tariff is None:
+        raise ValueError('No tariff configured')
+
+    # One conditional UPDATE: free scooters, or scooters reserved by this user
+    rented = (
+        Scooter.objects.filter(num=scooter_num)
+        .filter(
+            Q(status=Scooter.Status.AVAILABLE)
+            | Q(status=Scooter.Status.RESERVED, reservations__user=user, reservations__is_active=True)
         )
+        .transition(Scooter.Status.RENTED, [Scooter.Status.AVAILABLE, Scooter.Status.RESERVED])
+    )
+    if not rented:
+        if Reservation.objects.filter(scooter_id=scooter_num, is_active=True).exists():
+            raise ValueError(f'Scooter {scooter_num} is reserved by another user')
+        raise ValueError(f'Scooter {scooter_num} is not available')
+    status_changed_on_commit([scooter_num], Scooter.Status.RENTED)
+    Reservation.objects.filter(scooter_id=scooter_num, user=user, is_active=True).update(is_active=False)
 
-        customer_id = ensure_customer(user)
-        payment.stripe_customer_id = customer_id
-        
-        hold_intent = create_hold_intent(customer_id, hold_amount_minor)
-        payment.stripe_hold_intent_id = hold_intent['id']
-        payment.status = Payment.Status.PENDING
-        payment.save(update_fields=['stripe_customer_id', 'stripe_hold_intent_id', 'status'])
-        
-        
-        
-        return rental
+    # The pricing zone is where the ride starts, taken from the geo index rather than the scooter row
+    position = scooter_position(scooter_num)
+    rental = Rental.objects.create(
+        scooter_id=scooter_num,
+        user=user,
+        tariff=tariff,
+        zone_id=zone_at(*position) if position else None,
+        start_time=now,
+        status=Rental.Status.ACTIVE,
+        total_minutes=0,
+        total_cost=0,
+    )
+    # Create payment with hold amount
+    hold_amount = Decimal(str(settings.RENTAL_HOLD_AMOUNT))
+    hold_amount_minor = int(hold_amount * 100)
+    # With a saved card the hold is authorized off-session and settled by a partial capture
+    payment_method_id = get_saved_payment_method(user.id)
 
-    raise ValidationError(f'Scooter {scooter_num} is not available')
+    payment = Payment.objects.create(
+        rental=rental,
+        hold_amount=hold_amount,
+        hold_amount_minor=hold_amount_minor,
+        status=Payment.Status.PENDING,
+        stripe_payment_method_id=payment_method_id,
+        manual_capture=payment_method_id is not None,
+    )
+    # Customer lookup and hold intent are created by the outbox worker after commit
+    enqueue_payment_action(payment, PaymentOutbox.Action.CREATE_HOLD)
+
+    return rental
 
-@transaction.atomic
 def end_rental(scooter_num, user):
-    """End rental and charge final amount."""
-    rental = Rental.objects.select_for_update().get(
-        scooter__num=scooter_num, 
-        user=user, 
-        status=Rental.Status.ACTIVE
+    """End rental and enqueue the final charge."""
+    with scooter_lock(scooter_num) as ok:
+        if not ok:
+            raise ValueError('Too many requests')
+        return _end_rental(scooter_num, user)
+
+@transaction.atomic
+def _end_rental(scooter_num, user):
+    # Tariff and scooter are loaded with the rental, only the rental row is locked
+    rental = (
+        Rental.objects
+        .select_related('tariff', 'scooter')
+        .select_for_update(of=('self',))
+        .filter(scooter__num=scooter_num, user=user, status=Rental.Status.ACTIVE)
+        .first()
     )
+    if rental is None:
+        raise ValueError(f'No active rental on scooter {scooter_num}')
     
     rental.end_time = timezone.now()
     rental.status = Rental.Status.COMPLETED
@@ -93,50 +104,27 @@ def end_rental(scooter_num, user):
     rental.save(update_fields=['end_time', 'status', 'total_minutes', 'total_cost'])
     
     payment = Payment.objects.select_for_update().get(rental=rental)
-    
+
     # Calculate final amount in minor currency units (cents)
-    final_amount = rental.total_cost
-    final_amount_minor = int(final_amount * 100)
-    
-    # Cancel hold intent if exists
-    if payment.stripe_hold_intent_id:
-        try:
-            cancel_hold_intent(payment.stripe_hold_intent_id)
-        except Exception as e:
-            # Log error but continue with final charge
-            pass
-
-    # Check if payment method is available
-    pm_id = payment.stripe_payment_method_id
-    if not pm_id:
-        raise ValidationError('No payment method found. Hold payment may not have been confirmed.')
-    
-    # Charge final amount
-    idempotency_key = f"final-charge-rental-{rental.id}-{uuid.uuid4()}"
-    final_intent = charge_final_amount(
-        payment.stripe_customer_id, 
-        pm_id, 
-        final_amount_minor, 
-        settings.RENTAL_CURRENCY, 
-        idempotency_key
+    payment.final_amount = rental.total_cost
+    payment.final_amount_minor = int(rental.total_cost * 100)
+    payment.save(update_fields=['final_amount', 'final_amount_minor'])
+
+    # Settlement is performed by the outbox worker after commit
+    if payment.manual_capture:
+        enqueue_payment_action(payment, PaymentOutbox.Action.CAPTURE_HOLD)
+    else:
+        enqueue_payment_action(payment, PaymentOutbox.Action.CANCEL_HOLD)
+        enqueue_payment_action(payment, PaymentOutbox.Action.CHARGE_FINAL)
+
+    # Update scooter status, unless it was taken out of service meanwhile
+    released = (
+        Scooter.objects.filter(num=rental.scooter_id)
+        .transition(Scooter.Status.AVAILABLE, [Scooter.Status.RENTED])
     )
-    
-    # Update payment with final charge details
-    payment.final_amount = final_amount
-    payment.final_amount_minor = final_amount_minor
-    payment.stripe_final_intent_id = final_intent["id"]
-    payment.status = Payment.Status.PROCCESSING  # Will be updated to CAPTURED by webhook
-    payment.save(update_fields=[
-        "final_amount", 
-        "final_amount_minor", 
-        "stripe_final_intent_id", 
-        "status"
-    ])
-
-    # Update scooter status
-    scooter = Scooter.objects.select_for_update().get(num=scooter_num)
-    scooter.status = Scooter.Status.AVAILABLE
-    scooter.save(update_fields=['status'])
+    if released:
+        rental.scooter.status = Scooter.Status.AVAILABLE
+        status_changed_on_commit([rental.scooter_id], Scooter.Status.AVAILABLE)
 
     return rental
 
@@ -0,0 +1,53 @@
+"""
+Side effects of scooter status changes.
+
+Services call these inside the transaction that changed the scooters; the
+availability cache and the geo index are updated and the change is published
+to stream clients once it has committed. A Redis outage never fails the
+change itself: cached pages expire by TTL and the geo index can be rebuilt
+with the rebuild_scooter_geo_index command.
+"""
+from django.db import transaction
+
+from rental.services.availability import invalidate_scooters
+from rental.services.nearby import index_status_changes, index_scooters
+from rental.services.status_stream import publish_status_changes
+
+
+def status_changed_on_commit(nums, scooter_status):
+    """The given scooters moved to scooter_status."""
+    nums = list(nums)
+    if not nums:
+        return
+
+    def after_commit():
+        invalidate_scooters(nums)
+        index_status_changes(nums, scooter_status)
+        publish_status_changes(nums, scooter_status)
+
+    transaction.on_commit(after_commit, robust=True)
+
+
+def telemetry_applied_on_commit(rows, changed_nums, status_changes):
+    """
+    Telemetry updated (num, status, battery_level, latitude, longitude) rows,
+    the status or battery level of changed_nums is different from before and
+    status_changes are the (num, status) moves among them.
+    """
+    rows = list(rows)
+    if not rows:
+        return
+    changed_nums = list(changed_nums)
+    by_status = {}
+    for num, scooter_status in status_changes:
+        by_status.setdefault(scooter_status, []).append(num)
+
+    def after_commit():
+        if changed_nums:
+            invalidate_scooters(changed_nums)
+        index_scooters(rows)
+        # Published once indexed, so the events carry the reported positions
+        for scooter_status, nums in by_status.items():
+            publish_status_changes(nums, scooter_status)
+
+    transaction.on_commit(after_commit, robust=True)
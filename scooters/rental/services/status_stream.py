@@ -0,0 +1,92 @@
+"""
+Scooter status changes pushed over Redis pub/sub.
+
+Every committed status change publishes a compact event on CHANNEL:
+{"status": ..., "ts": <ms>, "scooters": [[num, latitude, longitude], ...]}
+with the last indexed position of each scooter, or nulls when it has none.
+Each ASGI process keeps one subscription and fans events out to the
+connected stream clients (see rental.async_views.status_stream). Delivery is
+best effort: a client that falls behind or loses the subscription is
+disconnected and is expected to reload the listing when it reconnects.
+"""
+import asyncio
+import json
+import time
+import weakref
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from rental.services.nearby import POSITIONS_KEY
+from scooters.redis_async import get_async_redis
+
+CHANNEL = 'scooters:status'
+MAX_SCOOTERS_PER_EVENT = 500
+
+
+def publish_status_changes(nums, scooter_status):
+    client = get_redis_connection('default')
+    positions = client.geopos(POSITIONS_KEY, *nums)
+    ts = int(time.time() * 1000)
+    pipe = client.pipeline(transaction=False)
+    for start in range(0, len(nums), MAX_SCOOTERS_PER_EVENT):
+        scooters = [
+            [int(num), position[1], position[0]] if position else [int(num), None, None]
+            for num, position in zip(nums[start:start + MAX_SCOOTERS_PER_EVENT], positions[start:start + MAX_SCOOTERS_PER_EVENT])
+        ]
+        pipe.publish(CHANNEL, json.dumps({'status': scooter_status, 'ts': ts, 'scooters': scooters}, separators=(',', ':')))
+    pipe.execute()
+
+
+class StatusBroadcaster:
+    """Shares one CHANNEL subscription among the stream clients of an event loop."""
+    def __init__(self):
+        self._queues = set()
+        self._task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=settings.SCOOTER_STREAM_QUEUE_SIZE)
+        self._queues.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._listen())
+        return queue
+
+    def unsubscribe(self, queue):
+        self._queues.discard(queue)
+        if not self._queues and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _drop(self, queue):
+        # None tells the client to end its stream
+        self._queues.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def _listen(self):
+        pubsub = get_async_redis().pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(CHANNEL)
+            async for message in pubsub.listen():
+                event = json.loads(message['data'])
+                for queue in list(self._queues):
+                    try:
+                        queue.put_nowait(event)
+                    except asyncio.QueueFull:
+                        self._drop(queue)
+        finally:
+            for queue in list(self._queues):
+                self._drop(queue)
+            await pubsub.aclose()
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster() -> StatusBroadcaster:
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        broadcaster = _broadcasters[loop] = StatusBroadcaster()
+    return broadcaster
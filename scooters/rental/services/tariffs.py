@@ -0,0 +1,62 @@
+"""
+Active tariff cache.
+
+The tariff is kept in process memory and in Redis under a version number.
+Saves and deletes of tariffs, tariff windows and zones bump the version (see
+rental.signals); processes re-check the version at most every TARIFF_LOCAL_TTL
+seconds. rental.services.pricing caches its compiled tables under the same version.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from rental.models import Tariff
+from rental.services.versioning import get_version, bump_version
+
+VERSION_KEY = 'tariff:version'
+
+_MISSING = object()
+
+_local = {'version': None, 'tariff': _MISSING, 'checked_at': 0.0}
+
+
+def tariff_version() -> int:
+    """Current tariff version, re-read from Redis at most every TARIFF_LOCAL_TTL seconds."""
+    now = time.monotonic()
+    if _local['version'] is not None and now - _local['checked_at'] < settings.TARIFF_LOCAL_TTL:
+        return _local['version']
+
+    version = get_version(VERSION_KEY)
+    if version != _local['version']:
+        _local.update(version=version, tariff=_MISSING)
+    _local['checked_at'] = now
+    return version
+
+
+def get_active_tariff():
+    """The tariff applied to new rentals, or None if no tariff is configured."""
+    version = tariff_version()
+    if _local['tariff'] is _MISSING:
+        key = f'tariff:active:v{version}'
+        tariff = cache.get(key)
+        if tariff is None:
+            tariff = Tariff.objects.first()
+            if tariff is not None:
+                cache.set(key, tariff, timeout=None)
+        _local['tariff'] = tariff
+    return _local['tariff']
+
+
+def clear_local_tariff():
+    _local.update(version=None, tariff=_MISSING, checked_at=0.0)
+
+
+def invalidate_tariff():
+    bump_version(VERSION_KEY)
+    clear_local_tariff()
+
+
+def invalidate_tariff_on_commit():
+    transaction.on_commit(invalidate_tariff)
@@ -0,0 +1,156 @@
+"""
+Bulk fleet telemetry ingestion.
+
+Frames are (num, battery_level, status, timestamp, latitude, longitude)
+readings, the position being optional. They are applied in chunks with one
+conditional UPDATE per chunk that only matches scooters whose last applied
+reading is older, so no rows are locked before the write and readings older
+than the last applied one are dropped. Readings dated further in the future
+than TELEMETRY_MAX_CLOCK_SKEW are rejected, they would hide every later one.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from rental.models import Scooter
+from rental.services.status_events import telemetry_applied_on_commit
+
+# Telemetry may only move a scooter between these; reservations and rentals own the other states
+TELEMETRY_STATUSES = (Scooter.Status.AVAILABLE, Scooter.Status.UNAVAILABLE)
+
+
+def _parse_timestamp(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    if isinstance(value, str):
+        moment = parse_datetime(value)
+        if moment is not None and moment.tzinfo is not None:
+            return moment
+    return None
+
+
+def _parse_coordinate(value, bound):
+    if isinstance(value, (int, float)) and not isinstance(value, bool) and -bound <= value <= bound:
+        return float(value)
+    return None
+
+
+def _latest_allowed():
+    return timezone.now() + timedelta(seconds=settings.TELEMETRY_MAX_CLOCK_SKEW)
+
+
+def parse_frame(frame, latest_allowed=None):
+    """Validate one raw frame. Returns (num, battery_level, status, timestamp, latitude, longitude) or None."""
+    if not isinstance(frame, dict):
+        return None
+    num = frame.get('num')
+    battery_level = frame.get('battery_level')
+    status = frame.get('status')
+    timestamp = _parse_timestamp(frame.get('timestamp'))
+    if not isinstance(num, int) or isinstance(num, bool) or timestamp is None:
+        return None
+    if timestamp > (latest_allowed or _latest_allowed()):
+        return None
+    if not isinstance(battery_level, int) or isinstance(battery_level, bool) or not 0 <= battery_level <= 100:
+        return None
+    if status is not None and status not in TELEMETRY_STATUSES:
+        return None
+    latitude, longitude = frame.get('latitude'), frame.get('longitude')
+    if latitude is None and longitude is None:
+        return num, battery_level, status, timestamp, None, None
+    latitude, longitude = _parse_coordinate(latitude, 90), _parse_coordinate(longitude, 180)
+    if latitude is None or longitude is None:
+        return None
+    return num, battery_level, status, timestamp, latitude, longitude
+
+
+def parse_frames(frames):
+    """Returns (valid frames, number of rejected frames)."""
+    latest_allowed = _latest_allowed()
+    parsed = [parse_frame(frame, latest_allowed) for frame in frames]
+    valid = [frame for frame in parsed if frame is not None]
+    return valid, len(parsed) - len(valid)
+
+
+def _case(field, whens):
+    return Case(*whens, default=F(field), output_field=Scooter._meta.get_field(field))
+
+
+@transaction.atomic
+def _apply_chunk(chunk) -> dict:
+    latest = {}
+    for frame in chunk:
+        current = latest.get(frame[0])
+        if current is None or frame[3] > current[3]:
+            latest[frame[0]] = frame
+
+    fields = ('num', 'status', 'battery_level', 'telemetry_at')
+    # Plain read, only used to skip known stale readings and to tell what changed
+    before = {row[0]: row for row in Scooter.objects.filter(num__in=latest.keys()).values_list(*fields)}
+    frames = [
+        frame for num, frame in sorted(latest.items())
+        if num in before and (before[num][3] is None or frame[3] > before[num][3])
+    ]
+    if not frames:
+        return {'applied': 0, 'stale': len(chunk)}
+
+    positioned = [frame for frame in frames if frame[4] is not None]
+    Scooter.objects.filter(reduce(or_, (
+        Q(num=num) & (Q(telemetry_at__isnull=True) | Q(telemetry_at__lt=timestamp))
+        for num, _, _, timestamp, _, _ in frames
+    ))).update(
+        battery_level=_case('battery_level', [When(num=frame[0], then=Value(frame[1])) for frame in frames]),
+        telemetry_at=_case('telemetry_at', [When(num=frame[0], then=Value(frame[3])) for frame in frames]),
+        # Reservations and rentals own the other states, the guard runs in the UPDATE itself
+        status=_case('status', [
+            When(num=frame[0], status__in=TELEMETRY_STATUSES, then=Value(frame[2]))
+            for frame in frames if frame[2] is not None
+        ]),
+        latitude=_case('latitude', [When(num=frame[0], then=Value(frame[4])) for frame in positioned]),
+        longitude=_case('longitude', [When(num=frame[0], then=Value(frame[5])) for frame in positioned]),
+    )
+
+    # A reading newer than ours may have won the race since the plain read
+    rows, changed, status_changes = [], [], []
+    after = Scooter.objects.filter(num__in=[frame[0] for frame in frames]).order_by('num').values_list(
+        *fields, 'latitude', 'longitude',
+    )
+    for num, status, battery_level, telemetry_at, latitude, longitude in after:
+        if telemetry_at != latest[num][3]:
+            continue
+        rows.append((num, status, battery_level, latitude, longitude))
+        if (status, battery_level) != before[num][1:3]:
+            changed.append(num)
+        if status != before[num][1]:
+            status_changes.append((num, status))
+
+    telemetry_applied_on_commit(rows, changed, status_changes)
+    return {'applied': len(rows), 'stale': len(chunk) - len(rows)}
+
+
+def apply_frames(frames, chunk_size=None) -> dict:
+    """Apply parsed frames chunk by chunk. Unknown scooters and stale readings count as stale."""
+    chunk_size = chunk_size or settings.TELEMETRY_CHUNK_SIZE
+    totals = {'applied': 0, 'stale': 0}
+    for i in range(0, len(frames), chunk_size):
+        counts = _apply_chunk(frames[i:i + chunk_size])
+        totals['applied'] += counts['applied']
+        totals['stale'] += counts['stale']
+    return totals
+
+
+def serialize_frames(frames) -> list:
+    """Parsed frames in a JSON-safe form for the Celery queue."""
+    return [
+        {
+            'num': num, 'battery_level': battery_level, 'status': status, 'timestamp': timestamp.isoformat(),
+            'latitude': latitude, 'longitude': longitude,
+        }
+        for num, battery_level, status, timestamp, latitude, longitude in frames
+    ]
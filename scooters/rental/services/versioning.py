@@ -0,0 +1,34 @@
+"""
+Version counters for cache invalidation.
+
+Cached values are stored under keys that embed the current version; bumping
+the version makes every older key unreachable at once.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+
+def _initial_version() -> int:
+    # Time-based, so a counter lost to eviction never restarts at a version whose keys still exist
+    return int(time.time() * 1000)
+
+
+def get_version(key: str) -> int:
+    return cache.get_or_set(key, _initial_version, timeout=None)
+
+
+def bump_version(key: str):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), timeout=None)
+
+
+async def aget_version(key: str, client) -> int:
+    """get_version() over an async Redis client; counters are stored as plain integers."""
+    raw = await client.get(cache.make_key(key))
+    if raw is None:
+        return await sync_to_async(get_version)(key)
+    return int(raw)
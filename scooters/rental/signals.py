@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.contrib.auth.models import User
+
+from rental.models import Tariff, TariffWindow, Zone
+from rental.services.tariffs import invalidate_tariff, invalidate_tariff_on_commit
+from scooters.authentication import invalidate_cached_user, invalidate_cached_user_on_commit
+
+
+@receiver([post_save, post_delete], sender=Tariff)
+@receiver([post_save, post_delete], sender=TariffWindow)
+@receiver([post_save, post_delete], sender=Zone)
+def tariff_changed(sender, **kwargs):
+    # Covers TariffViewSet create as well as admin edits. Invalidated again after
+    # commit in case another process re-cached the old rows in the meantime
+    invalidate_tariff()
+    invalidate_tariff_on_commit()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Deactivation, permission and password changes reach JWT requests without waiting for the TTL
+    invalidate_cached_user(instance.pk)
+    invalidate_cached_user_on_commit(instance.pk)
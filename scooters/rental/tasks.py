@@ -1,20 +1,42 @@
+from django.conf import settings
 from django.utils import timezone
 from celery import shared_task
 from django.db import transaction
 
-from .models import Reservation, Scooter
+from .models import Reservation
+from .services.expiry import release_reservations
+from .services.telemetry import parse_frames, apply_frames
 
 @shared_task
-def expire_reservations():
+def expire_reservations(batch_size=None):
+    """
+    Safety-net sweep for reservations the Redis expiry worker missed.
+    Deactivates expired reservations and releases their scooters in set-based batches.
+    """
+    batch_size = batch_size or settings.RESERVATION_EXPIRY_BATCH_SIZE
     now = timezone.now()
-    qs = Reservation.objects.select_related('scooter').filte(is_active=True, expires_at__lt=now)
-    for res in qs:
+    expired = released = 0
+    while True:
         with transaction.atomic():
-            sc = Scooter.objects.select_for_update().get(num = res.scooter.num)
-            res.is_active = False
-            res.save(update_fields=['is_active'])
-            if sc.status == Scooter.Status.RESERVED:
-                sc.status = Scooter.Status.AVAILABLE
-                sc.save(update_fields=['status'])
-    return len(qs)
-            
\ No newline at end of file
+            batch = list(
+                Reservation.objects.select_for_update(skip_locked=True)
+                .filter(is_active=True, expires_at__lt=now)
+                .order_by('expires_at')
+                .values_list('id', 'scooter_id')[:batch_size]
+            )
+            counts = release_reservations(batch)
+        expired += counts['expired']
+        released += counts['released']
+        # A batch whose scooters are all busy is left to the next sweep
+        if len(batch) < batch_size or not counts['expired']:
+            break
+    return {'expired': expired, 'released': released}
+
+
+@shared_task
+def ingest_telemetry(frames):
+    """Apply a chunk of telemetry frames queued by the telemetry endpoint or a fleet gateway."""
+    valid, rejected = parse_frames(frames)
+    counts = apply_frames(valid)
+    counts['rejected'] = rejected
+    return counts
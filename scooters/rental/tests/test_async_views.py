@@ -0,0 +1,153 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.tokens import AccessToken
+
+from rental.models import Scooter, Reservation
+from rental.services.availability import invalidate_availability
+from rental.services.nearby import POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY, index_scooters
+from rental.services.reserve import reserve_scooter
+from rental.services.status_stream import CHANNEL, publish_status_changes
+from rental.services.telemetry import apply_frames, parse_frames
+from scooters.authentication import invalidate_cached_user
+from scooters.redis_async import get_async_redis
+from scooters.throttling import UserTokenBucketThrottle
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testAsyncUser1')
+        self.addCleanup(invalidate_cached_user, self.user.id)
+        bucket = f'throttle:bucket:user:{self.user.id}'
+        get_redis_connection('default').delete(bucket)
+        self.addCleanup(get_redis_connection('default').delete, bucket)
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        for num in range(1, 6):
+            Scooter.objects.create(num=num, status=Scooter.Status.AVAILABLE, battery_level=num * 20)
+        invalidate_availability()
+
+    async def test_requires_token(self):
+        response = await self.async_client.get('/api/async/reservations/')
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/api/async/reservations/', headers={'Authorization': 'Bearer nope'})
+        self.assertEqual(response.status_code, 401)
+
+    @mock.patch.dict(UserTokenBucketThrottle.THROTTLE_RATES, {'user': '2/min'})
+    async def test_throttled(self):
+        for _ in range(2):
+            response = await self.async_client.get('/api/async/reservations/', headers=self.auth)
+            self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get('/api/async/rentals/', headers=self.auth)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertIn('throttled', response.json()['detail'])
+
+    async def test_available_pages(self):
+        response = await self.async_client.get('/api/async/scooters/available/?min_battery=40&limit=2', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual([s['num'] for s in page['results']], [2, 3])
+        response = await self.async_client.get(f'/api/async/scooters/available/?min_battery=40&limit=2&after={page["next"]}', headers=self.auth)
+        page = response.json()
+        self.assertEqual([s['num'] for s in page['results']], [4, 5])
+        self.assertIsNone(page['next'])
+
+    async def test_available_cached_until_invalidated(self):
+        url = '/api/async/scooters/available/'
+        self.assertEqual(len((await self.async_client.get(url, headers=self.auth)).json()['results']), 5)
+        await Scooter.objects.filter(num=1).aupdate(status=Scooter.Status.UNAVAILABLE)
+        self.assertEqual(len((await self.async_client.get(url, headers=self.auth)).json()['results']), 5)
+        invalidate_availability()
+        self.assertEqual(len((await self.async_client.get(url, headers=self.auth)).json()['results']), 4)
+
+    async def test_invalid_filter(self):
+        response = await self.async_client.get('/api/async/scooters/available/?min_battery=200', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_my_reservations(self):
+        await Reservation.objects.acreate(scooter_id=1, user=self.user)
+        response = await self.async_client.get('/api/async/reservations/', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['scooter'] for r in response.json()], [1])
+        response = await self.async_client.post('/api/async/reservations/', headers=self.auth)
+        self.assertEqual(response.status_code, 405)
+
+    async def test_my_rentals(self):
+        response = await self.async_client.get('/api/async/rentals/', headers=self.auth)
+        self.assertEqual(response.json(), [])
+
+
+class StatusStreamTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testStreamUser1')
+        self.addCleanup(invalidate_cached_user, self.user.id)
+        bucket = f'throttle:bucket:user:{self.user.id}'
+        get_redis_connection('default').delete(bucket)
+        self.addCleanup(get_redis_connection('default').delete, bucket)
+        self.auth = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE)
+        Scooter.objects.create(num=2, status=Scooter.Status.AVAILABLE)
+        redis = get_redis_connection('default')
+        redis.delete(POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY)
+        self.addCleanup(redis.delete, POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY)
+        index_scooters([(1, Scooter.Status.AVAILABLE, 100, 50.45, 30.52), (2, Scooter.Status.AVAILABLE, 100, 40.0, 20.0)])
+
+    def test_services_publish(self):
+        pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANNEL)
+        self.addCleanup(pubsub.close)
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_scooter(1, self.user)
+        # The first read consumes the subscribe confirmation
+        message = pubsub.get_message(timeout=1) or pubsub.get_message(timeout=1)
+        event = json.loads(message['data'])
+        self.assertEqual(event['status'], Scooter.Status.RESERVED)
+        self.assertEqual(event['scooters'][0][0], 1)
+        self.assertAlmostEqual(event['scooters'][0][1], 50.45, places=4)
+
+    def test_telemetry_publishes(self):
+        pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(CHANNEL)
+        self.addCleanup(pubsub.close)
+        frames, _ = parse_frames([
+            {'num': 1, 'battery_level': 5, 'status': Scooter.Status.UNAVAILABLE, 'timestamp': time.time(),
+             'latitude': 50.46, 'longitude': 30.53},
+            # Battery only, no event
+            {'num': 2, 'battery_level': 50, 'status': Scooter.Status.AVAILABLE, 'timestamp': time.time()},
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_frames(frames)
+        message = pubsub.get_message(timeout=1) or pubsub.get_message(timeout=1)
+        event = json.loads(message['data'])
+        self.assertEqual(event['status'], Scooter.Status.UNAVAILABLE)
+        self.assertEqual([scooter[0] for scooter in event['scooters']], [1])
+        self.assertAlmostEqual(event['scooters'][0][1], 50.46, places=4)
+        self.assertIsNone(pubsub.get_message(timeout=0.2))
+
+    async def test_stream_filters_by_area(self):
+        response = await self.async_client.get(
+            '/api/async/scooters/stream/?min_lat=50&max_lat=51&min_lon=30&max_lon=31', headers=self.auth,
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        # The process subscription is opened in the background
+        client = get_async_redis()
+        while (await client.pubsub_numsub(CHANNEL))[0][1] == 0:
+            await asyncio.sleep(0.01)
+        publish_status_changes([1, 2], Scooter.Status.RENTED)
+        chunk = await asyncio.wait_for(anext(stream), 2)
+        self.assertTrue(chunk.startswith(b'event: status\ndata: '))
+        event = json.loads(chunk.split(b'data: ', 1)[1])
+        self.assertEqual([scooter[0] for scooter in event['scooters']], [1])
+        await stream.aclose()
+        await asyncio.sleep(0)
+
+    async def test_stream_area_needs_all_bounds(self):
+        response = await self.async_client.get('/api/async/scooters/stream/?min_lat=50', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
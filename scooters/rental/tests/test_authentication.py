@@ -0,0 +1,58 @@
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from rental.services.versioning import bump_version, get_version
+from scooters.authentication import clear_local_users, invalidate_cached_user, user_cache_key, user_version_key
+
+
+class CachedJWTAuthenticationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testAuthUser1')
+        invalidate_cached_user(self.user.id)
+        self.addCleanup(invalidate_cached_user, self.user.id)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def _user_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/reservations/')
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries if 'FROM "auth_user"' in q['sql']]
+
+    def test_user_is_cached(self):
+        self.assertEqual(len(self._user_queries()), 1)
+        self.assertEqual(self._user_queries(), [])
+        # Another process only shares the Redis copy
+        clear_local_users()
+        self.assertEqual(self._user_queries(), [])
+
+    def test_cached_user_has_no_password(self):
+        self._user_queries()
+        clear_local_users()
+        key = user_cache_key(self.user.id, get_version(user_version_key(self.user.id)))
+        self.assertIn('password', cache.get(key).get_deferred_fields())
+
+    def test_deactivation_invalidates(self):
+        self._user_queries()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
+
+    def test_deactivation_in_another_process(self):
+        self._user_queries()
+        # Another process saves the user: the row changes and the version is bumped, this
+        # process keeps its local copy
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        bump_version(user_version_key(self.user.id))
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
+
+    def test_deleted_user(self):
+        self._user_queries()
+        self.user.delete()
+        self.assertEqual(self.client.get('/api/reservations/').status_code, 401)
@@ -0,0 +1,82 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import LiveServerTestCase, SimpleTestCase, TransactionTestCase, override_settings
+
+from rental.benchmark import (
+    LifecycleBenchmark, ReadLoadBenchmark, BENCH_PREFIX, OPERATIONS, READ_PATHS, compare, percentile, timing_drift,
+)
+from rental.management.commands.benchmark_rentals import DEFAULT_BASELINE
+from rental.models import Scooter
+
+
+class BenchmarkReportTestCase(SimpleTestCase):
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 99), 5)
+        self.assertIsNone(percentile([], 95))
+
+    def test_compare(self):
+        base = {'p95_ms': 10.0, 'throughput': 100.0, 'queries': 6.0, 'errors': 0}
+        baseline = {'operations': {'start': base}}
+        self.assertEqual(compare({'operations': {'start': dict(base, p95_ms=12.0)}}, baseline), [])
+
+        # A slower machine is only advisory, more queries or errors fail
+        slower = {'operations': {'start': dict(base, p95_ms=20.0, throughput=50.0)}}
+        self.assertEqual(compare(slower, baseline), [])
+        self.assertEqual(len(timing_drift(slower, baseline)), 2)
+        regressions = compare({'operations': {'start': dict(base, queries=7.0, errors=1)}}, baseline)
+        self.assertEqual(len(regressions), 2)
+
+    def test_stored_baseline(self):
+        with open(DEFAULT_BASELINE) as f:
+            baseline = json.load(f)
+        self.assertEqual(set(baseline['operations']), set(OPERATIONS) | {'outbox'})
+        self.assertEqual(compare(baseline, baseline), [])
+
+    def test_refuses_without_confirmation(self):
+        with self.assertRaisesMessage(CommandError, '--i-know'):
+            call_command('benchmark_rentals')
+
+
+class LifecycleBenchmarkTestCase(TransactionTestCase):
+    def test_single_user_lifecycle(self):
+        benchmark = LifecycleBenchmark(users=1, scooters=2, iterations=3)
+        results = benchmark.run()
+
+        for operation in OPERATIONS:
+            stats = results['operations'][operation]
+            self.assertEqual(stats['ok'], 3)
+            self.assertEqual(stats['errors'], 0)
+            self.assertGreater(stats['queries'], 0)
+        # Hold, hold release and final charge of every ride
+        self.assertEqual(results['operations']['outbox']['ok'], 9)
+        self.assertEqual(results['locks']['timeouts'], 0)
+
+        self.assertFalse(User.objects.filter(username__startswith=BENCH_PREFIX).exists())
+        self.assertFalse(Scooter.objects.exists())
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_http_lifecycle_under_rate_limits(self):
+        cache.clear()
+        results = LifecycleBenchmark(users=1, scooters=2, iterations=2, mode='http').run()
+
+        for operation in OPERATIONS:
+            stats = results['operations'][operation]
+            self.assertEqual((stats['ok'], stats['throttled'], stats['errors']), (2, 0, 0))
+        self.assertEqual(results['operations']['outbox']['ok'], 6)
+
+
+class ReadLoadBenchmarkTestCase(LiveServerTestCase):
+    def test_reads_through_server(self):
+        results = ReadLoadBenchmark(self.live_server_url, users=2, scooters=3, iterations=2).run()
+
+        self.assertEqual(set(results['operations']), set(READ_PATHS))
+        for stats in results['operations'].values():
+            self.assertEqual((stats['ok'], stats['errors']), (4, 0))
+        self.assertFalse(User.objects.filter(username__startswith=BENCH_PREFIX).exists())
+        self.assertFalse(Scooter.objects.exists())
@@ -0,0 +1,71 @@
+"""
+Concurrency tests for the rental services.
+
+They need real row-level locking and only run against PostgreSQL, e.g.:
+    docker compose run --rm web python manage.py test rental.tests.test_concurrency
+"""
+import threading
+import unittest
+
+from django.test import TransactionTestCase
+from django.db import connection, IntegrityError, OperationalError
+from django.contrib.auth.models import User
+
+from rental.models import Scooter, Tariff, Reservation, Rental
+from rental.services.reserve import reserve_scooter
+from rental.services.start_rental import start_rental
+
+THREADS = 8
+
+
+def run_concurrently(func, args_list):
+    """Run func once per args tuple in parallel threads, starting together. Returns (results, errors)."""
+    barrier = threading.Barrier(len(args_list))
+    results, errors = [], []
+
+    def worker(args):
+        try:
+            barrier.wait()
+            results.append(func(*args))
+        except (ValueError, IntegrityError, OperationalError) as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(args,)) for args in args_list]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'requires PostgreSQL row locks')
+class ConcurrentRentalTestCase(TransactionTestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f'testConcurrentUser{i}') for i in range(THREADS)]
+        self.scooter = Scooter.objects.create(num=546, status=Scooter.Status.AVAILABLE)
+        Tariff.objects.create(name='test', per_minute=10.00)
+
+    def test_single_reservation_per_scooter(self):
+        results, errors = run_concurrently(reserve_scooter, [(self.scooter.num, user) for user in self.users])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(len(errors), THREADS - 1)
+        self.assertEqual(Reservation.objects.filter(scooter=self.scooter, is_active=True).count(), 1)
+        self.scooter.refresh_from_db()
+        self.assertEqual(self.scooter.status, Scooter.Status.RESERVED)
+
+    def test_single_rental_per_scooter(self):
+        results, errors = run_concurrently(start_rental, [(self.scooter.num, user) for user in self.users])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(Rental.objects.filter(scooter=self.scooter, status=Rental.Status.ACTIVE).count(), 1)
+        self.scooter.refresh_from_db()
+        self.assertEqual(self.scooter.status, Scooter.Status.RENTED)
+
+    def test_reservations_on_distinct_scooters_do_not_block(self):
+        for num in range(1, THREADS):
+            Scooter.objects.create(num=num, status=Scooter.Status.AVAILABLE)
+        args = [(num, user) for num, user in zip(range(1, THREADS), self.users)]
+        results, errors = run_concurrently(reserve_scooter, args)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), THREADS - 1)
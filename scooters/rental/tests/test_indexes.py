@@ -0,0 +1,66 @@
+from django.utils import timezone
+
+from django.test import TestCase
+from django.db import connection, transaction
+from django.contrib.auth.models import User
+
+from rental.models import Scooter, Tariff, Reservation, Rental
+
+class QueryPlanTestCase(TestCase):
+    """Every hot query in rental.services, rental.tasks and rental.views is served by an index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='testIndexUser1')
+        tariff = Tariff.objects.create(name='test', per_minute=10.00)
+        for num in range(1, 51):
+            Scooter.objects.create(num=num, status=Scooter.Status.AVAILABLE)
+        Reservation.objects.create(scooter_id=1, user=cls.user)
+        Rental.objects.create(scooter_id=2, user=cls.user, tariff=tariff)
+
+    def assertUsesIndex(self, queryset, index_name):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Test tables are tiny, keep the planner from preferring a sequential scan
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_availability_listing(self):
+        self.assertUsesIndex(
+            Scooter.objects.filter(status=Scooter.Status.AVAILABLE, battery_level__gte=20).order_by('num'),
+            'scooter_status_num_idx',
+        )
+
+    def test_active_reservation_lookups(self):
+        self.assertUsesIndex(
+            Reservation.objects.filter(scooter_id=1, is_active=True),
+            'uniq_active_reservation_per_scooter',
+        )
+        self.assertUsesIndex(
+            Reservation.objects.filter(user=self.user, is_active=True),
+            'uniq_active_reservation_per_user',
+        )
+
+    def test_expiry_sweep(self):
+        self.assertUsesIndex(
+            Reservation.objects.filter(is_active=True, expires_at__lt=timezone.now()).order_by('expires_at'),
+            'reservation_active_expiry_idx',
+        )
+
+    def test_active_rental_lookups(self):
+        self.assertUsesIndex(
+            Rental.objects.filter(user=self.user, status=Rental.Status.ACTIVE),
+            'uniq_active_rental_per_user',
+        )
+        self.assertUsesIndex(
+            Rental.objects.filter(scooter__num=2, user=self.user, status=Rental.Status.ACTIVE),
+            'uniq_active_rental_per_scooter',
+        )
+
+    def test_rental_history(self):
+        self.assertUsesIndex(
+            Rental.objects.filter(user=self.user).order_by('-start_time'),
+            'rental_user_start_time_idx',
+        )
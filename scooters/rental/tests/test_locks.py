@@ -0,0 +1,46 @@
+from django.test import TestCase
+from django_redis import get_redis_connection
+
+from rental.services.locks import acquire_lock, release_lock, lock_scope, lock_metrics
+
+class LockTestCase(TestCase):
+    key = 'lock:test'
+
+    def setUp(self):
+        get_redis_connection('default').delete(self.key)
+        lock_metrics.reset()
+
+    def test_release_requires_owner_token(self):
+        token = acquire_lock(self.key)
+        self.assertIsNotNone(token)
+        self.assertIsNone(acquire_lock(self.key))
+        self.assertFalse(release_lock(self.key, 'not-the-owner'))
+        self.assertIsNone(acquire_lock(self.key))
+        self.assertTrue(release_lock(self.key, token))
+        self.assertIsNotNone(acquire_lock(self.key))
+
+    def test_failed_scope_does_not_release_foreign_lock(self):
+        token = acquire_lock(self.key)
+        with lock_scope(self.key) as ok:
+            self.assertFalse(ok)
+        self.assertIsNone(acquire_lock(self.key))
+        self.assertTrue(release_lock(self.key, token))
+
+    def test_scope_holds_lock_until_exit(self):
+        with lock_scope(self.key) as ok:
+            self.assertTrue(ok)
+            self.assertIsNone(acquire_lock(self.key))
+        self.assertIsNotNone(acquire_lock(self.key))
+
+    def test_bounded_wait(self):
+        acquire_lock(self.key, ttl_seconds=0.1)
+        # Held lock expires while waiting
+        self.assertIsNotNone(acquire_lock(self.key, wait_seconds=1))
+        # Held lock outlives the wait
+        self.assertIsNone(acquire_lock(self.key, wait_seconds=0.05))
+
+        metrics = lock_metrics.snapshot()
+        self.assertEqual(metrics['acquired'], 2)
+        self.assertEqual(metrics['contended'], 2)
+        self.assertEqual(metrics['timeouts'], 1)
+        self.assertGreater(metrics['wait_seconds'], 0.1)
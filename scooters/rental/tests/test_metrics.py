@@ -0,0 +1,77 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from rental.models import Scooter
+from rental.tasks import expire_reservations
+from billing.services.stripe_service import cancel_hold_intent
+from scooters.metrics import MetricsRegistry, registry, task_started, task_finished
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.user = User.objects.create(username='testMetricsUser1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE)
+
+    def test_view_queries_and_redis_time(self):
+        self.client.get('/api/scooters/')
+        self.client.get('/api/scooters/')
+        series = registry.get('view', 'scooter-list')
+        self.assertEqual(series.count, 2)
+        self.assertGreater(series.db_queries, 0)
+        self.assertGreater(series.db_seconds, 0)
+
+        self.client.get('/api/scooters/available/')
+        self.assertGreater(registry.get('view', 'scooter-available').redis_seconds, 0)
+
+    def test_task(self):
+        expire_reservations.apply()
+        series = registry.get('task', 'rental.tasks.expire_reservations')
+        self.assertEqual(series.count, 1)
+        self.assertGreater(series.db_queries, 0)
+
+    @mock.patch('billing.services.stripe_service.stripe.PaymentIntent.cancel', side_effect=lambda *args, **kwargs: time.sleep(0.01))
+    def test_stripe_time(self, cancel):
+        task_started(task_id='stripe-task')
+        cancel_hold_intent('pi_test')
+        task_finished(task_id='stripe-task', task=SimpleNamespace(name='stripe-task'))
+        self.assertGreaterEqual(registry.get('task', 'stripe-task').stripe_seconds, 0.01)
+
+    def test_series_shared_between_processes(self):
+        # A Celery worker records into the series the web process renders
+        task_started(task_id='worker-task')
+        task_finished(task_id='worker-task', task=SimpleNamespace(name='worker-task'))
+        self.assertEqual(MetricsRegistry().get('task', 'worker-task').count, 1)
+        self.assertIn('scooters_task_duration_seconds_count{task="worker-task"} 1', MetricsRegistry().render())
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_unsampled(self):
+        self.client.get('/api/scooters/')
+        self.assertIsNone(registry.get('view', 'scooter-list'))
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint(self):
+        self.client.get('/api/scooters/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('scooters_view_duration_seconds_count{view="scooter-list"} 1', body)
+        self.assertIn('scooters_view_db_queries_total{view="scooter-list"}', body)
+        self.assertNotIn('view="metrics"', body)
+
+    @override_settings(METRICS_TOKEN='', DEBUG=False)
+    def test_endpoint_closed_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    @override_settings(METRICS_TOKEN='', DEBUG=True)
+    def test_endpoint_open_without_token_in_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
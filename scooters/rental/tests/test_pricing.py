@@ -0,0 +1,77 @@
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from zoneinfo import ZoneInfo
+
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django_redis import get_redis_connection
+
+from rental.models import Scooter, Tariff, TariffWindow, Zone
+from rental.services.nearby import POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY, index_scooters
+from rental.services.pricing import price_rental, price_batch, get_compiled_tariff, MINUTES_PER_WEEK
+from rental.services.start_rental import start_rental, end_rental
+
+KYIV = ZoneInfo('Europe/Kyiv')
+
+@override_settings(PRICING_TIME_ZONE='Europe/Kyiv')
+class PricingTestCase(TestCase):
+    def setUp(self):
+        self.tariff = Tariff.objects.create(name='test', per_minute=Decimal('2.00'), unlock_fee=Decimal('10.00'))
+        # Every evening 22:00-06:00 is off-peak at half price, Monday 08:00-09:00 is peak
+        TariffWindow.objects.create(tariff=self.tariff, starts_at=time(22), ends_at=time(6), multiplier=Decimal('0.5'))
+        TariffWindow.objects.create(tariff=self.tariff, weekday=0, starts_at=time(8), ends_at=time(9), multiplier=Decimal('1.5'))
+        self.zone = Zone.objects.create(code='center', multiplier=Decimal('1.2'))
+        # Monday
+        self.monday = datetime(2026, 10, 12, tzinfo=KYIV)
+
+    def price(self, start, minutes, zone=None):
+        return price_rental(self.tariff.id, zone and zone.id, start, start + timedelta(minutes=minutes, seconds=30))
+
+    def test_base_rate_with_unlock_fee(self):
+        self.assertEqual(self.price(self.monday.replace(hour=12), 10), (10, Decimal('30.00')))
+
+    def test_windows(self):
+        # 07:55-08:05 crosses into the Monday peak: 5 * 2.00 + 5 * 3.00
+        self.assertEqual(self.price(self.monday.replace(hour=7, minute=55), 10), (10, Decimal('35.00')))
+        # 21:50-22:10 crosses into off-peak: 10 * 2.00 + 10 * 1.00
+        self.assertEqual(self.price(self.monday.replace(hour=21, minute=50), 20), (20, Decimal('40.00')))
+        # Tuesday 08:00 is not peak
+        self.assertEqual(self.price(self.monday.replace(hour=8) + timedelta(days=1), 10), (10, Decimal('30.00')))
+
+    def test_week_wrap_and_long_rides(self):
+        sunday_late = self.monday + timedelta(days=6, hours=23, minutes=50)
+        # Sunday 23:50 - Monday 00:10, all off-peak
+        self.assertEqual(self.price(sunday_late, 20), (20, Decimal('30.00')))
+        week = get_compiled_tariff(self.tariff.id).prefix[MINUTES_PER_WEEK]
+        minutes, cost = self.price(self.monday, MINUTES_PER_WEEK * 2)
+        self.assertEqual(cost, Decimal(week * 2 + 1000) / 100)
+
+    def test_zone_and_minute_cap(self):
+        self.assertEqual(self.price(self.monday.replace(hour=12), 10, self.zone), (10, Decimal('34.00')))
+        self.tariff.max_minutes = 5
+        self.tariff.save()
+        self.assertEqual(self.price(self.monday.replace(hour=12), 10), (10, Decimal('20.00')))
+
+    def test_batch_matches_single(self):
+        starts = [self.monday + timedelta(minutes=37 * i) for i in range(200)]
+        rides = [(self.tariff.id, self.zone.id if i % 2 else None, start, start + timedelta(minutes=i + 1))
+                 for i, start in enumerate(starts)]
+        # Zones, tariff and windows are loaded once for the whole batch
+        with self.assertNumQueries(3):
+            batch = price_batch(rides)
+        self.assertEqual(batch, [price_rental(*ride) for ride in rides])
+
+    def test_ride_priced_in_zone_it_starts_in(self):
+        self.zone.min_latitude, self.zone.max_latitude = 50.4, 50.5
+        self.zone.min_longitude, self.zone.max_longitude = 30.4, 30.6
+        with self.captureOnCommitCallbacks(execute=True):
+            self.zone.save()
+        redis = get_redis_connection('default')
+        self.addCleanup(redis.delete, POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY)
+        user = User.objects.create(username='testZoneUser1')
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE)
+        Scooter.objects.create(num=2, status=Scooter.Status.AVAILABLE)
+        index_scooters([(1, Scooter.Status.AVAILABLE, 100, 50.45, 30.52), (2, Scooter.Status.AVAILABLE, 100, 40.0, 20.0)])
+        self.assertEqual(start_rental(1, user).zone_id, self.zone.id)
+        end_rental(1, user)
+        self.assertIsNone(start_rental(2, user).zone_id)
@@ -2,12 +2,17 @@ from datetime import timedelta
 from django.utils import timezone
 
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 from django.contrib.auth.models import User
 
-from rental.models import Scooter, Tariff, Reservation, Rental
+from rental.models import Scooter, Tariff, Reservation, Rental, InvalidTransition
 from rental.services.reserve import reserve_scooter
+from rental.services.start_rental import start_rental, end_rental
+from rental.services.tariffs import VERSION_KEY as TARIFF_VERSION_KEY, get_active_tariff, clear_local_tariff
+from rental.services.pricing import get_compiled_tariff
 
 class ScooterTestCase(TestCase):
     def setUp(self):
@@ -116,3 +121,77 @@ class ReserveTestCase(TestCase):
         reservation.expires_at = timezone.now() - timedelta(minutes=1)
         reservation.save()
         self.assertEqual(self.scooter.status, Scooter.Status.AVAILABLE)
+
+class ScooterTransitionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testTransitionUser1')
+        self.other = User.objects.create(username='testTransitionUser2')
+        self.scooter = Scooter.objects.create(num=546, status=Scooter.Status.AVAILABLE)
+        Tariff.objects.create(name='test', per_minute=10.00)
+
+    def test_conditional_update(self):
+        scooters = Scooter.objects.filter(num=546)
+        self.assertEqual(scooters.transition(Scooter.Status.RESERVED, [Scooter.Status.AVAILABLE]), 1)
+        self.assertEqual(scooters.transition(Scooter.Status.RESERVED, [Scooter.Status.AVAILABLE]), 0)
+        with self.assertRaises(InvalidTransition):
+            scooters.transition(Scooter.Status.UNAVAILABLE, [Scooter.Status.RENTED])
+
+    def test_services_do_not_lock_scooter(self):
+        with CaptureQueriesContext(connection) as queries:
+            reserve_scooter(546, self.user)
+            start_rental(546, self.user)
+            end_rental(546, self.user)
+        sqls = [q['sql'] for q in queries]
+        self.assertEqual(len([sql for sql in sqls if sql.startswith('UPDATE "rental_scooter"')]), 3)
+        # Status is never read before being changed
+        self.assertFalse([sql for sql in sqls if 'FROM "rental_scooter"' in sql and not sql.startswith('UPDATE')])
+        self.scooter.refresh_from_db()
+        self.assertEqual(self.scooter.status, Scooter.Status.AVAILABLE)
+
+    def test_start_reserved_by_another_user(self):
+        reserve_scooter(546, self.other)
+        with self.assertRaisesMessage(ValueError, 'reserved by another user'):
+            start_rental(546, self.user)
+        rental = start_rental(546, self.other)
+        self.assertEqual(rental.scooter_id, 546)
+        self.assertFalse(Reservation.objects.filter(is_active=True).exists())
+
+    def test_start_unavailable(self):
+        Scooter.objects.filter(num=546).update(status=Scooter.Status.UNAVAILABLE)
+        with self.assertRaisesMessage(ValueError, 'not available'):
+            start_rental(546, self.user)
+
+
+class TariffCacheTestCase(TestCase):
+    def setUp(self):
+        cache.delete(TARIFF_VERSION_KEY)
+        clear_local_tariff()
+        self.tariff = Tariff.objects.create(name='test', per_minute=10.00)
+
+    def test_active_tariff_is_cached(self):
+        self.assertEqual(get_active_tariff(), self.tariff)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_active_tariff(), self.tariff)
+        # Other processes only share the Redis copy
+        clear_local_tariff()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_active_tariff().per_minute, self.tariff.per_minute)
+
+    def test_save_invalidates(self):
+        get_active_tariff()
+        self.tariff.per_minute = 12
+        self.tariff.save()
+        self.assertEqual(get_active_tariff().per_minute, 12)
+
+    def test_end_rental_loads_tariff_with_rental(self):
+        user = User.objects.create(username='testTariffUser1')
+        Scooter.objects.create(num=546, status=Scooter.Status.AVAILABLE)
+        start_rental(546, user)
+        # Compiled pricing tables are shared across rides
+        get_compiled_tariff(self.tariff.id)
+        with CaptureQueriesContext(connection) as queries:
+            rental = end_rental(546, user)
+        self.assertEqual(rental.total_cost, 10)
+        self.assertEqual(rental.scooter.status, Scooter.Status.AVAILABLE)
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT') and 'FROM "rental_tariff"' in q['sql']])
+        self.assertFalse([q for q in queries if q['sql'].startswith('SELECT') and 'FROM "rental_scooter"' in q['sql']])
@@ -0,0 +1,67 @@
+from datetime import timedelta
+from django.utils import timezone
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django_redis import get_redis_connection
+
+from rental.models import Scooter, Reservation
+from rental.tasks import expire_reservations
+from rental.services.reserve import reserve_scooter
+from rental.services.expiry import EXPIRY_KEY, pop_due, seconds_until_next, expire_reservation_ids
+
+class ExpireReservationsTestCase(TestCase):
+    def setUp(self):
+        self.past = timezone.now() - timedelta(minutes=1)
+        self.future = timezone.now() + timedelta(minutes=5)
+
+    def _reserve(self, num, expires_at):
+        user = User.objects.create(username=f'testExpiryUser{num}')
+        scooter = Scooter.objects.create(num=num, status=Scooter.Status.RESERVED)
+        return Reservation.objects.create(scooter=scooter, user=user, expires_at=expires_at)
+
+    def test_expire_reservations_in_batches(self):
+        expired = [self._reserve(num, self.past) for num in range(1, 6)]
+        active = self._reserve(100, self.future)
+
+        self.assertEqual(expire_reservations(batch_size=2), {'expired': 5, 'released': 5})
+
+        self.assertFalse(Reservation.objects.filter(id__in=[r.id for r in expired], is_active=True).exists())
+        self.assertEqual(Scooter.objects.filter(status=Scooter.Status.AVAILABLE).count(), 5)
+        active.refresh_from_db()
+        self.assertTrue(active.is_active)
+        self.assertEqual(Scooter.objects.get(num=100).status, Scooter.Status.RESERVED)
+
+    def test_rented_scooter_is_not_released(self):
+        reservation = self._reserve(1, self.past)
+        Scooter.objects.filter(num=1).update(status=Scooter.Status.RENTED)
+        self.assertEqual(expire_reservations(), {'expired': 1, 'released': 0})
+        self.assertEqual(Scooter.objects.get(num=1).status, Scooter.Status.RENTED)
+        reservation.refresh_from_db()
+        self.assertFalse(reservation.is_active)
+
+
+class ExpiryScheduleTestCase(TestCase):
+    def setUp(self):
+        get_redis_connection('default').delete(EXPIRY_KEY)
+        self.user = User.objects.create(username='testExpiryScheduleUser1')
+        self.scooter = Scooter.objects.create(num=546, status=Scooter.Status.AVAILABLE)
+
+    def test_reserve_schedules_expiry(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = reserve_scooter(self.scooter.num, self.user)
+        self.assertEqual(pop_due(now=reservation.expires_at - timedelta(seconds=1)), [])
+        self.assertAlmostEqual(seconds_until_next(now=reservation.expires_at - timedelta(seconds=1)), 1, places=3)
+        self.assertEqual(pop_due(now=reservation.expires_at), [reservation.id])
+        # Popped members are removed, a second worker gets nothing
+        self.assertEqual(pop_due(now=reservation.expires_at), [])
+
+    def test_expire_reservation_ids(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation = reserve_scooter(self.scooter.num, self.user)
+        self.assertEqual(expire_reservation_ids([reservation.id]), {'expired': 0, 'released': 0})
+
+        Reservation.objects.filter(pk=reservation.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(expire_reservation_ids([reservation.id]), {'expired': 1, 'released': 1})
+        self.scooter.refresh_from_db()
+        self.assertEqual(self.scooter.status, Scooter.Status.AVAILABLE)
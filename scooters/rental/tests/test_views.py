@@ -0,0 +1,407 @@
+import json
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from rental.models import Scooter, Tariff, Rental
+from billing.models import PaymentOutbox
+from rental.services.reserve import reserve_scooter
+from rental.services.availability import VERSION_KEY, invalidate_availability
+from rental.services.nearby import POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY, rebuild_index
+from rental.services.tariffs import clear_local_tariff, invalidate_tariff
+from rental.services.telemetry import apply_frames, parse_frames
+from django_redis import get_redis_connection
+from rental.tasks import ingest_telemetry
+from scooters.idempotency import idempotency_cache_key
+from scooters.throttling import RentalUserThrottle, take_token
+
+class ScooterAvailabilityTestCase(TestCase):
+    def setUp(self):
+        cache.delete(VERSION_KEY)
+        self.user = User.objects.create(username='testAvailabilityUser1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE, battery_level=90)
+        Scooter.objects.create(num=2, status=Scooter.Status.AVAILABLE, battery_level=10)
+        Scooter.objects.create(num=3, status=Scooter.Status.AVAILABLE, battery_level=60)
+        Scooter.objects.create(num=4, status=Scooter.Status.RENTED, battery_level=100)
+
+    def _nums(self, response):
+        return [scooter['num'] for scooter in response.data['results']]
+
+    def test_filters_and_cursor_pagination(self):
+        response = self.client.get('/api/scooters/available/', {'min_battery': 50, 'page_size': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._nums(response), [1])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self._nums(response), [3])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get('/api/scooters/available/', {'status': Scooter.Status.RENTED})
+        self.assertEqual(self._nums(response), [4])
+
+    def test_invalid_filters(self):
+        response = self.client.get('/api/scooters/available/', {'min_battery': 101})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/scooters/available/', {'status': 'broken'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached_until_status_change(self):
+        self.assertEqual(self._nums(self.client.get('/api/scooters/available/')), [1, 2, 3])
+        with self.assertNumQueries(0):
+            self.assertEqual(self._nums(self.client.get('/api/scooters/available/')), [1, 2, 3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_scooter(1, self.user)
+        self.assertEqual(self._nums(self.client.get('/api/scooters/available/')), [2, 3])
+
+    @override_settings(SCOOTER_AVAILABILITY_SHARD_SIZE=10)
+    @mock.patch('rest_framework.throttling.UserRateThrottle.allow_request', return_value=True)
+    def test_status_changes_keep_other_shards_cached(self, allow_request):
+        Scooter.objects.bulk_create([Scooter(num=num, status=Scooter.Status.AVAILABLE) for num in range(5, 101)])
+        invalidate_availability()
+
+        def walk():
+            # Scooter numbers listed and shard queries made over all pages
+            url, nums, loads = '/api/scooters/available/?page_size=10', [], 0
+            while url:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                loads += sum('"num" >=' in query['sql'] for query in queries)
+                nums += self._nums(response)
+                url = response.data['next']
+            return nums, loads
+
+        nums, loads = walk()
+        self.assertEqual(len(nums), 99)
+        self.assertGreater(loads, 0)
+        self.assertEqual(walk()[1], 0)
+        # Churn across the fleet reloads only the shards of the scooters that changed
+        for num in (15, 55):
+            with self.captureOnCommitCallbacks(execute=True):
+                reserve_scooter(num, self.user)
+        nums, loads = walk()
+        self.assertEqual(len(nums), 97)
+        self.assertNotIn(15, nums)
+        self.assertLessEqual(loads, 2)
+        self.assertEqual(walk()[1], 0)
+
+        response = self.client.get('/api/scooters/available/?page_size=10&min_battery=100')
+        self.assertEqual(response.status_code, 200)
+        previous = self.client.get(self.client.get(response.data['next']).data['previous'])
+        self.assertEqual(self._nums(previous), self._nums(response))
+
+
+class ScooterStatusTestCase(TestCase):
+    def setUp(self):
+        cache.delete(VERSION_KEY)
+        self.user = User.objects.create(username='testStatusUser1')
+        self.admin = User.objects.create(username='testStatusAdmin1', is_staff=True)
+        cache.delete_many([f'throttle_user_{self.user.id}', f'throttle_user_{self.admin.id}'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE)
+
+    def test_status_is_read_only(self):
+        response = self.client.patch('/api/scooters/1/', {'status': Scooter.Status.RESERVED, 'battery_level': 50}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], Scooter.Status.AVAILABLE)
+        scooter = Scooter.objects.get(num=1)
+        self.assertEqual((scooter.status, scooter.battery_level), (Scooter.Status.AVAILABLE, 50))
+
+    def test_created_available(self):
+        self.assertEqual(self.client.get('/api/scooters/available/').data['results'][0]['num'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/scooters/', {'num': 2, 'status': Scooter.Status.RENTED}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], Scooter.Status.AVAILABLE)
+        self.assertEqual(len(self.client.get('/api/scooters/available/').data['results']), 2)
+
+    def test_service_status(self):
+        url = '/api/scooters/1/status/'
+        self.assertEqual(self.client.post(url, {'status': Scooter.Status.UNAVAILABLE}).status_code, 403)
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.post(url, {'status': Scooter.Status.RENTED}).status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'status': Scooter.Status.UNAVAILABLE})
+        self.assertEqual(response.data['status'], Scooter.Status.UNAVAILABLE)
+        self.assertEqual(self.client.get('/api/scooters/available/').data['results'], [])
+        self.assertEqual(self.client.post(url, {'status': Scooter.Status.UNAVAILABLE}).status_code, 400)
+
+
+@override_settings(TELEMETRY_INGEST_ASYNC=False, TELEMETRY_CHUNK_SIZE=2)
+class TelemetryTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='testFleetGateway', is_staff=True))
+        self.now = timezone.now()
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE, battery_level=90)
+        Scooter.objects.create(num=2, status=Scooter.Status.RENTED, battery_level=90)
+        Scooter.objects.create(num=3, status=Scooter.Status.AVAILABLE, battery_level=90, telemetry_at=self.now)
+
+    def frame(self, num, battery_level, seconds_ago=0, status=None):
+        return {
+            'num': num,
+            'battery_level': battery_level,
+            'status': status,
+            'timestamp': (self.now - timedelta(seconds=seconds_ago)).isoformat(),
+        }
+
+    def test_json_array(self):
+        frames = [
+            self.frame(1, 80, seconds_ago=5),
+            self.frame(1, 70, seconds_ago=1, status=Scooter.Status.UNAVAILABLE),
+            # Rented scooters keep their status
+            self.frame(2, 60, status=Scooter.Status.AVAILABLE),
+            # Older than the last applied reading
+            self.frame(3, 10, seconds_ago=10),
+            # Unknown scooter
+            self.frame(99, 50),
+            {'num': 1, 'battery_level': 101, 'timestamp': self.now.isoformat()},
+        ]
+        response = self.client.post('/api/telemetry/', frames, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'applied': 2, 'stale': 3, 'rejected': 1})
+
+        scooters = {s.num: s for s in Scooter.objects.all()}
+        self.assertEqual((scooters[1].battery_level, scooters[1].status), (70, Scooter.Status.UNAVAILABLE))
+        self.assertEqual((scooters[2].battery_level, scooters[2].status), (60, Scooter.Status.RENTED))
+        self.assertEqual(scooters[3].battery_level, 90)
+
+    def test_ndjson(self):
+        body = '\n'.join(json.dumps(frame) for frame in [self.frame(1, 50), self.frame(3, 40)]) + '\n'
+        response = self.client.post('/api/telemetry/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['applied'], 1)
+        self.assertEqual(Scooter.objects.get(num=1).battery_level, 50)
+
+    @override_settings(TELEMETRY_INGEST_ASYNC=True)
+    def test_async_queues_chunks(self):
+        frames = [self.frame(num, 50) for num in (1, 2, 3)]
+        with mock.patch('rental.views.ingest_telemetry.delay') as delay:
+            response = self.client.post('/api/telemetry/', frames, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(delay.call_count, 2)
+        self.assertEqual(ingest_telemetry(delay.call_args_list[0].args[0]), {'applied': 2, 'stale': 0, 'rejected': 0})
+
+    def test_future_reading_rejected(self):
+        frames = [self.frame(1, 50, seconds_ago=-3600), self.frame(3, 40, seconds_ago=-60)]
+        response = self.client.post('/api/telemetry/', frames, format='json')
+        self.assertEqual(response.data, {'applied': 1, 'stale': 0, 'rejected': 1})
+        scooter = Scooter.objects.get(num=1)
+        self.assertEqual((scooter.battery_level, scooter.telemetry_at), (90, None))
+
+    def test_one_conditional_update_per_chunk(self):
+        frames, _ = parse_frames([self.frame(1, 50), self.frame(2, 40), self.frame(3, 30, seconds_ago=10)])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(apply_frames(frames), {'applied': 2, 'stale': 1})
+        statements = [query['sql'] for query in queries]
+        self.assertEqual(sum(sql.startswith('UPDATE') for sql in statements), 1)
+        self.assertFalse(any('FOR UPDATE' in sql for sql in statements))
+
+    def test_battery_change_refreshes_listing(self):
+        cache.delete(VERSION_KEY)
+        response = self.client.get('/api/scooters/available/', {'min_battery': 50})
+        self.assertEqual([scooter['num'] for scooter in response.data['results']], [1, 3])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/telemetry/', [self.frame(1, 30)], format='json')
+        response = self.client.get('/api/scooters/available/', {'min_battery': 50})
+        self.assertEqual([scooter['num'] for scooter in response.data['results']], [3])
+
+    def test_requires_staff(self):
+        self.client.force_authenticate(User.objects.create(username='testRider'))
+        response = self.client.post('/api/telemetry/', [self.frame(1, 50)], format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class ScooterNearbyTestCase(TestCase):
+    def setUp(self):
+        get_redis_connection('default').delete(POSITIONS_KEY, AVAILABLE_KEY, BATTERY_KEY)
+        self.user = User.objects.create(username='testNearbyUser1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Around Kyiv city centre, roughly 0.7 km apart going north
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE, battery_level=90, latitude=50.4500, longitude=30.5234)
+        Scooter.objects.create(num=2, status=Scooter.Status.AVAILABLE, battery_level=20, latitude=50.4560, longitude=30.5234)
+        Scooter.objects.create(num=3, status=Scooter.Status.AVAILABLE, battery_level=80, latitude=50.4620, longitude=30.5234)
+        Scooter.objects.create(num=4, status=Scooter.Status.RENTED, battery_level=100, latitude=50.4501, longitude=30.5234)
+        Scooter.objects.create(num=5, status=Scooter.Status.AVAILABLE, battery_level=100)
+        rebuild_index()
+
+    def _nums(self, **params):
+        response = self.client.get('/api/scooters/nearby/', {'lat': 50.4499, 'lon': 30.5234, **params})
+        self.assertEqual(response.status_code, 200)
+        return [scooter['num'] for scooter in response.data]
+
+    def test_nearest_first(self):
+        self.assertEqual(self._nums(), [1, 2, 3])
+        self.assertEqual(self._nums(k=2), [1, 2])
+        self.assertEqual(self._nums(min_battery=50), [1, 3])
+        self.assertEqual(self._nums(radius_km=1), [1, 2])
+
+    def test_follows_status_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_scooter(1, self.user)
+        self.assertEqual(self._nums(), [2, 3])
+
+    def test_telemetry_updates_position(self):
+        frames, _ = parse_frames([{
+            'num': 3, 'battery_level': 70, 'timestamp': timezone.now().isoformat(),
+            'latitude': 50.4499, 'longitude': 30.5235,
+        }])
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_frames(frames)
+        self.assertEqual(self._nums(), [3, 1, 2])
+        self.assertEqual(Scooter.objects.get(num=3).latitude, 50.4499)
+
+    def test_invalid_position(self):
+        response = self.client.get('/api/scooters/nearby/', {'lat': 91, 'lon': 30.5})
+        self.assertEqual(response.status_code, 400)
+        _, rejected = parse_frames([{'num': 1, 'battery_level': 50, 'timestamp': timezone.now().isoformat(), 'latitude': 50.45}])
+        self.assertEqual(rejected, 1)
+
+
+class RentalThrottleTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testThrottleUser1')
+        self.other = User.objects.create(username='testThrottleUser2')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.redis = get_redis_connection('default')
+        self.keys = [
+            f'throttle:bucket:rental_user:{self.user.id}',
+            f'throttle:bucket:rental_user:{self.other.id}',
+            'throttle:bucket:rental_ip:127.0.0.1',
+            'throttle:bucket:test',
+        ]
+        self.redis.delete(*self.keys)
+        self.addCleanup(self.redis.delete, *self.keys)
+
+    @mock.patch.dict(RentalUserThrottle.THROTTLE_RATES, {'rental_user': '2/min'})
+    def test_user_bucket(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post('/api/scooters/1/reserve/').status_code, 400)
+        # Turned away before the service runs
+        with self.assertNumQueries(0):
+            response = self.client.post('/api/scooters/1/start/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.post('/api/scooters/1/reserve/').status_code, 400)
+
+    @mock.patch.dict(RentalUserThrottle.THROTTLE_RATES, {'rental_ip': '2/min'})
+    def test_ip_bucket(self):
+        self.assertEqual(self.client.post('/api/scooters/1/reserve/').status_code, 400)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.post('/api/scooters/1/reserve/').status_code, 400)
+        self.assertEqual(self.client.post('/api/scooters/1/reserve/').status_code, 429)
+
+    def test_refill(self):
+        self.assertEqual(take_token('throttle:bucket:test', 1, 1), (True, 0))
+        allowed, wait = take_token('throttle:bucket:test', 1, 1)
+        self.assertFalse(allowed)
+        self.assertTrue(0 < wait <= 1)
+        time.sleep(wait + 0.01)
+        self.assertTrue(take_token('throttle:bucket:test', 1, 1)[0])
+
+
+class RentalConflictTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testConflictUser1')
+        self.other = User.objects.create(username='testConflictUser2')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE)
+        self.redis = get_redis_connection('default')
+        keys = [f'throttle:bucket:rental_user:{self.user.id}', 'throttle:bucket:rental_ip:127.0.0.1']
+        self.redis.delete(*keys)
+        self.addCleanup(self.redis.delete, *keys)
+        self.addCleanup(clear_local_tariff)
+
+    def _with_tariff(self):
+        Tariff.objects.create(name='test', per_minute=10.00)
+        invalidate_tariff()
+
+    def assertConflict(self, response, detail):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(detail, response.data['detail'])
+
+    def test_start_reserved_by_another_user(self):
+        self._with_tariff()
+        reserve_scooter(1, self.other)
+        self.assertConflict(self.client.post('/api/scooters/1/start/'), 'reserved by another user')
+
+    def test_start_unavailable(self):
+        self._with_tariff()
+        Scooter.objects.filter(num=1).update(status=Scooter.Status.RENTED)
+        self.assertConflict(self.client.post('/api/scooters/1/start/'), 'not available')
+
+    def test_start_without_tariff(self):
+        invalidate_tariff()
+        self.assertConflict(self.client.post('/api/scooters/1/start/'), 'No tariff configured')
+        self.assertEqual(Scooter.objects.get(num=1).status, Scooter.Status.AVAILABLE)
+
+    def test_reserve_taken(self):
+        reserve_scooter(1, self.other)
+        self.assertConflict(self.client.post('/api/scooters/1/reserve/'), 'not available')
+
+    def test_end_without_active_rental(self):
+        self.assertConflict(self.client.post('/api/rentals/1/end/'), 'No active rental')
+
+
+class IdempotencyTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='testIdempotencyUser1')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Scooter.objects.create(num=1, status=Scooter.Status.AVAILABLE)
+        Tariff.objects.create(name='test', per_minute=10.00)
+        self.redis = get_redis_connection('default')
+        keys = [
+            idempotency_cache_key(self.user.id, key) for key in ('start-1', 'end-1', 'reserve-1')
+        ] + [f'throttle:bucket:rental_user:{self.user.id}', 'throttle:bucket:rental_ip:127.0.0.1']
+        self.redis.delete(*keys)
+        self.addCleanup(self.redis.delete, *keys)
+
+    def test_start_replayed(self):
+        first = self.client.post('/api/scooters/1/start/', HTTP_IDEMPOTENCY_KEY='start-1')
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(0):
+            retry = self.client.post('/api/scooters/1/start/', HTTP_IDEMPOTENCY_KEY='start-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Rental.objects.count(), 1)
+
+        # Bound to the action it was first used for
+        response = self.client.post('/api/rentals/1/end/', HTTP_IDEMPOTENCY_KEY='start-1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_end_replayed(self):
+        self.client.post('/api/scooters/1/start/')
+        for _ in range(2):
+            response = self.client.post('/api/rentals/1/end/', HTTP_IDEMPOTENCY_KEY='end-1')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(PaymentOutbox.objects.filter(action=PaymentOutbox.Action.CHARGE_FINAL).count(), 1)
+
+    def test_in_flight_duplicate(self):
+        self.redis.set(idempotency_cache_key(self.user.id, 'start-1'), json.dumps({'path': '/api/scooters/1/start/'}))
+        response = self.client.post('/api/scooters/1/start/', HTTP_IDEMPOTENCY_KEY='start-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Rental.objects.exists())
+
+    def test_error_not_stored(self):
+        response = self.client.post('/api/scooters/999/reserve/', HTTP_IDEMPOTENCY_KEY='reserve-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(self.redis.get(idempotency_cache_key(self.user.id, 'reserve-1')))
+        response = self.client.post('/api/scooters/1/reserve/', HTTP_IDEMPOTENCY_KEY='x' * 256)
+        self.assertEqual(response.status_code, 400)
@@ -1,12 +1,13 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
 
-from rental.views import ScooterViewSet, ReservationViewSet, RentalViewSet, TariffViewSet
+from rental.views import ScooterViewSet, ReservationViewSet, RentalViewSet, TariffViewSet, TelemetryViewSet
 
 router = DefaultRouter()
 router.register(r'scooters', ScooterViewSet, basename='scooter')
 router.register(r'reservations', ReservationViewSet, basename='reservation')
 router.register(r'rentals', RentalViewSet, basename='rental')
 router.register(r'tariffs', TariffViewSet, basename='tariff')
+router.register(r'telemetry', TelemetryViewSet, basename='telemetry')
 
 urlpatterns = router.urls
\ No newline at end of file
@@ -1,12 +1,25 @@
 from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.parsers import JSONParser
+from django.conf import settings
+from django.db import transaction
 
 from rental.models import Scooter, Reservation, Rental, Tariff
-from rental.serializers import ScooterSerializer, ReservationSerializer, RentalSerializer, TariffSerializer
+from rental.serializers import ScooterSerializer, ScooterServiceStatusSerializer, ScooterAvailabilityFilterSerializer, ScooterNearbyFilterSerializer, ReservationSerializer, RentalSerializer, TariffSerializer
+from rental.pagination import ScooterCursorPagination
+from rental.services.availability import available_scooters, invalidate_availability
+from rental.services.nearby import nearest_available
+from rental.services.telemetry import parse_frames, apply_frames, serialize_frames
+from rental.parsers import NDJSONParser
+from rental.tasks import ingest_telemetry
 from rental.services.reserve import reserve_scooter
 from rental.services.start_rental import start_rental, end_rental
+from rental.services.service_status import set_service_status
+from rental.services.status_events import status_changed_on_commit
+from scooters.idempotency import idempotent
+from scooters.throttling import RENTAL_THROTTLES
 
 
 class ScooterViewSet(viewsets.ModelViewSet):
@@ -14,7 +27,49 @@ class ScooterViewSet(viewsets.ModelViewSet):
     serializer_class = ScooterSerializer
     permission_classes = [IsAuthenticated]
 
-    @action(detail=True, methods=['post'])
+    def perform_create(self, serializer):
+        scooter = serializer.save(status=Scooter.Status.AVAILABLE)
+        # The last scooter number the listing walks to is cached per fleet version
+        transaction.on_commit(invalidate_availability, robust=True)
+        status_changed_on_commit([scooter.num], scooter.status)
+
+    @action(detail=True, methods=['post'], permission_classes=[IsAdminUser], url_path='status')
+    def service_status(self, request, pk=None):
+        data = ScooterServiceStatusSerializer(data=request.data)
+        data.is_valid(raise_exception=True)
+        try:
+            set_service_status(pk, data.validated_data['status'])
+        except ValueError as e:
+            return Response ({'detail': str(e)}, status = status.HTTP_400_BAD_REQUEST)
+        return Response(ScooterSerializer(Scooter.objects.get(num=pk)).data, status = status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def available(self, request):
+        filters = ScooterAvailabilityFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        scooter_status = filters.validated_data['status']
+        min_battery = filters.validated_data['min_battery']
+        paginator = ScooterCursorPagination()
+
+        def fetch(position, limit, reverse):
+            return available_scooters(scooter_status, min_battery, position, limit, reverse)
+
+        page = paginator.paginate_rows(fetch, request)
+        return paginator.get_paginated_response(page)
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        filters = ScooterNearbyFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+        found = nearest_available(params['lat'], params['lon'], params['k'], params['min_battery'], params['radius_km'])
+        return Response([
+            {'num': num, 'distance_km': distance_km, 'battery_level': battery_level}
+            for num, distance_km, battery_level in found
+        ])
+
+    @action(detail=True, methods=['post'], throttle_classes=RENTAL_THROTTLES)
+    @idempotent
     def reserve(self, request, pk=None):
         try:
             reservation = reserve_scooter(pk, request.user)
@@ -22,7 +77,8 @@ class ScooterViewSet(viewsets.ModelViewSet):
         except ValueError as e:
             return Response ({'detail': str(e)}, status = status.HTTP_400_BAD_REQUEST)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], throttle_classes=RENTAL_THROTTLES)
+    @idempotent
     def start(self, request, pk=None):
         try:
             rental = start_rental(pk, request.user)
@@ -36,7 +92,7 @@ class ReservationViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Reservation.objects.filter(user=self.request.user).exclude(is_active=False)
+        return Reservation.objects.filter(user=self.request.user, is_active=True)
 
 class RentalViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = RentalSerializer
@@ -45,7 +101,8 @@ class RentalViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     def get_queryset(self):
         return Rental.objects.filter(user=self.request.user).order_by('-start_time')
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], throttle_classes=RENTAL_THROTTLES)
+    @idempotent
     def end(self, request, pk=None):
         try:
             rental = end_rental(pk, request.user)
@@ -60,6 +117,26 @@ class TariffViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, viewsets.Gen
     def get_queryset(self):
         return Tariff.objects.all()
 
-    
-
 
+class TelemetryViewSet(viewsets.ViewSet):
+    """Bulk battery/status readings from the fleet, as a JSON array or NDJSON."""
+    permission_classes = [IsAdminUser]
+    parser_classes = [JSONParser, NDJSONParser]
+    # Gateways report every few seconds, backpressure comes from the Celery queue instead
+    throttle_classes = []
+
+    def create(self, request):
+        frames = request.data
+        if not isinstance(frames, list):
+            return Response({'detail': 'Expected a list of frames'}, status = status.HTTP_400_BAD_REQUEST)
+        valid, rejected = parse_frames(frames)
+
+        if settings.TELEMETRY_INGEST_ASYNC:
+            chunk_size = settings.TELEMETRY_CHUNK_SIZE
+            for i in range(0, len(valid), chunk_size):
+                ingest_telemetry.delay(serialize_frames(valid[i:i + chunk_size]))
+            return Response({'accepted': len(valid), 'rejected': rejected}, status = status.HTTP_202_ACCEPTED)
+
+        counts = apply_frames(valid)
+        counts['rejected'] = rejected
+        return Response(counts, status = status.HTTP_200_OK)
@@ -0,0 +1,134 @@
+"""
+JWT authentication with a cached user lookup.
+
+The user of a token is kept in process memory for AUTH_USER_LOCAL_TTL
+seconds and in Redis for AUTH_USER_CACHE_TTL seconds, both under a per-user
+version read from Redis on every request, so most requests make no query to
+load it and one small GET to check it. Saves and deletes of a user bump the
+version (see rental.signals): a deactivation or password change is seen by
+every process on its next request. Bulk QuerySet.update() calls bypass the
+signals and wait for the TTLs.
+"""
+import copy
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from rental.services.versioning import aget_version, bump_version, get_version
+from scooters.redis_async import get_async_redis
+
+# Loaded eagerly; the password hash stays out of the cache and is only read
+# when CHECK_REVOKE_TOKEN compares it with the token
+CACHED_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser')
+LOCAL_MAX_USERS = 10000
+
+_local = {}
+_local_mutex = threading.Lock()
+
+
+def user_version_key(user_id) -> str:
+    return f'auth:user:{user_id}:version'
+
+
+def user_cache_key(user_id, version) -> str:
+    return f'auth:user:{user_id}:v{version}'
+
+
+def invalidate_cached_user(user_id):
+    bump_version(user_version_key(user_id))
+    with _local_mutex:
+        _local.pop(str(user_id), None)
+
+
+def invalidate_cached_user_on_commit(user_id):
+    # Again after commit, in case a concurrent request re-cached the old row
+    transaction.on_commit(lambda: invalidate_cached_user(user_id), robust=True)
+
+
+def clear_local_users():
+    with _local_mutex:
+        _local.clear()
+
+
+def _local_user(user_id, version):
+    with _local_mutex:
+        cached = _local.get(str(user_id))
+    if cached is not None and cached[0] > time.monotonic() and cached[1] == version:
+        return cached[2]
+    return None
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def _load_user(self, user_id, version):
+        user = _local_user(user_id, version)
+        if user is not None:
+            return user
+
+        key = user_cache_key(user_id, version)
+        user = cache.get(key)
+        if user is None:
+            user = (
+                self.user_model.objects.only(*CACHED_FIELDS)
+                .filter(**{api_settings.USER_ID_FIELD: user_id})
+                .first()
+            )
+            if user is None:
+                return None
+            cache.set(key, user, timeout=settings.AUTH_USER_CACHE_TTL)
+
+        with _local_mutex:
+            if len(_local) >= LOCAL_MAX_USERS:
+                _local.clear()
+            _local[str(user_id)] = (time.monotonic() + settings.AUTH_USER_LOCAL_TTL, version, user)
+        return user
+
+    def _user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_('Token contained no recognizable user identification')) from e
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        user = self._load_user(user_id, get_version(user_version_key(user_id)))
+        return self._check_user(user, validated_token)
+
+    def _check_user(self, user, validated_token):
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        # Requests must not share one instance across threads
+        user = copy.copy(user)
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views; only a local cache miss leaves the event loop."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        user_id = self._user_id(validated_token)
+        version = await aget_version(user_version_key(user_id), get_async_redis())
+        user = _local_user(user_id, version)
+        if user is None:
+            user = await sync_to_async(self._load_user)(user_id, version)
+        return self._check_user(user, validated_token), validated_token
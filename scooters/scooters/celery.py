@@ -1,9 +1,21 @@
 import os
 from celery import Celery
+from celery.signals import task_prerun, task_postrun
 
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'scooters.settings')
 
 app = Celery('scooters')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+# Per-task query count and DB/Redis/Stripe time, see scooters.metrics
+@task_prerun.connect
+def task_metrics_started(**kwargs):
+    from scooters.metrics import task_started
+    task_started(**kwargs)
+
+@task_postrun.connect
+def task_metrics_finished(**kwargs):
+    from scooters.metrics import task_finished
+    task_finished(**kwargs)
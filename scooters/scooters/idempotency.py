@@ -0,0 +1,75 @@
+"""
+Idempotency-Key support for POST actions.
+
+A client retrying a request sends the same Idempotency-Key header. The first
+request marks the key as in flight in Redis; once it succeeds its response
+is stored under the key for IDEMPOTENCY_TTL seconds and replayed, with an
+Idempotent-Replayed header, to any retry. A duplicate arriving while the
+first is still running gets a 409. Error responses are not stored, so a
+failed request can be retried with the same key. Keys are scoped per user
+and bound to the path they were first used with.
+"""
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django_redis import get_redis_connection
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def idempotency_cache_key(user_id, key: str) -> str:
+    return f'idempotency:{user_id}:{key}'
+
+
+def _replay(stored, path):
+    if stored['path'] != path:
+        return Response(
+            {'detail': f'{HEADER} was already used for another request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if 'status' not in stored:
+        return Response(
+            {'detail': f'A request with this {HEADER} is in progress'},
+            status=status.HTTP_409_CONFLICT,
+            headers={'Retry-After': '1'},
+        )
+    return Response(stored['data'], status=stored['status'], headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(handler):
+    """Wraps a viewset action so requests carrying an Idempotency-Key run once."""
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return handler(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'detail': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        client = get_redis_connection('default')
+        cache_key = idempotency_cache_key(request.user.pk, key)
+        if not client.set(cache_key, json.dumps({'path': request.path}), nx=True, ex=settings.IDEMPOTENCY_LOCK_TTL):
+            stored = client.get(cache_key)
+            # Expired in between: answered as in flight, the client's next retry takes the key
+            return _replay(json.loads(stored) if stored is not None else {'path': request.path}, request.path)
+
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except BaseException:
+            client.delete(cache_key)
+            raise
+        if response.status_code >= 400:
+            client.delete(cache_key)
+        else:
+            stored = {'path': request.path, 'status': response.status_code, 'data': response.data}
+            client.set(cache_key, json.dumps(stored, cls=DjangoJSONEncoder), ex=settings.IDEMPOTENCY_TTL)
+        return response
+    return wrapper
@@ -0,0 +1,287 @@
+"""
+Per-view and per-task instrumentation, exposed in Prometheus text format on /metrics.
+
+A sampled request or Celery task records its DB query count and DB time
+(through a connection execute wrapper), its Redis time (through the
+instrumented connection pool configured on the cache) and its Stripe time
+(around the calls in billing.services.stripe_service). Unsampled work only
+pays for one random() call. Series are accumulated in Redis (one pipeline
+per sampled request or task), so /metrics on any web process reports every
+WSGI/ASGI worker and every Celery worker together.
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+import redis
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django_redis import get_redis_connection
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_current = contextvars.ContextVar('metrics_sample', default=None)
+
+
+class Sample:
+    """Costs of one request or task. Called by Django as a DB execute wrapper."""
+    __slots__ = ('db_queries', 'db_seconds', 'redis_seconds', 'stripe_seconds', 'started', 'token')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.redis_seconds = 0.0
+        self.stripe_seconds = 0.0
+        self.started = time.perf_counter()
+        self.token = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+def sampled() -> bool:
+    return settings.METRICS_ENABLED and random.random() < settings.METRICS_SAMPLE_RATE
+
+
+def _add(attribute, seconds):
+    sample = _current.get()
+    if sample is not None:
+        setattr(sample, attribute, getattr(sample, attribute) + seconds)
+
+
+@contextmanager
+def timed_stripe():
+    """Count the enclosed Stripe call towards the current sample."""
+    if _current.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add('stripe_seconds', time.perf_counter() - started)
+
+
+class InstrumentedConnection(redis.Connection):
+    def send_packed_command(self, *args, **kwargs):
+        if _current.get() is None:
+            return super().send_packed_command(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().send_packed_command(*args, **kwargs)
+        finally:
+            _add('redis_seconds', time.perf_counter() - started)
+
+    def read_response(self, *args, **kwargs):
+        if _current.get() is None:
+            return super().read_response(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return super().read_response(*args, **kwargs)
+        finally:
+            _add('redis_seconds', time.perf_counter() - started)
+
+
+class InstrumentedConnectionPool(redis.ConnectionPool):
+    """Set as CONNECTION_POOL_CLASS of the cache, covers get_redis_connection() as well."""
+    def __init__(self, connection_class=redis.Connection, **kwargs):
+        if connection_class is redis.Connection:
+            connection_class = InstrumentedConnection
+        super().__init__(connection_class=connection_class, **kwargs)
+
+
+class Series:
+    __slots__ = ('count', 'duration', 'buckets', 'db_queries', 'db_seconds', 'redis_seconds', 'stripe_seconds')
+
+    def __init__(self, fields=None):
+        fields = fields or {}
+        self.count = int(fields.get(b'count', 0))
+        self.duration = float(fields.get(b'duration', 0))
+        self.buckets = [int(fields.get(f'le{i}'.encode(), 0)) for i in range(len(DURATION_BUCKETS))]
+        self.db_queries = int(fields.get(b'db_queries', 0))
+        self.db_seconds = float(fields.get(b'db_seconds', 0))
+        self.redis_seconds = float(fields.get(b'redis_seconds', 0))
+        self.stripe_seconds = float(fields.get(b'stripe_seconds', 0))
+
+
+class MetricsRegistry:
+    """
+    Series per (kind, name), kind being 'view' or 'task', kept in Redis hashes.
+
+    Every web worker and Celery worker adds to the same series, so any process
+    serving /metrics reports the whole deployment. A Redis outage only loses
+    observations, it never fails the request or task.
+    """
+    SERIES_KEY = 'metrics:series'
+    counters = (
+        ('db_queries', 'DB queries'),
+        ('db_seconds', 'Seconds spent in DB queries'),
+        ('redis_seconds', 'Seconds spent in Redis commands'),
+        ('stripe_seconds', 'Seconds spent in Stripe calls'),
+    )
+
+    def _client(self):
+        return get_redis_connection('default')
+
+    def _key(self, kind, name):
+        return f'metrics:{kind}:{name}'
+
+    def reset(self):
+        client = self._client()
+        members = client.smembers(self.SERIES_KEY)
+        client.delete(self.SERIES_KEY, *[self._key(*member.decode().split('|', 1)) for member in members])
+
+    def observe(self, kind, name, sample: Sample):
+        duration = time.perf_counter() - sample.started
+        key = self._key(kind, name)
+        try:
+            pipe = self._client().pipeline(transaction=False)
+            pipe.sadd(self.SERIES_KEY, f'{kind}|{name}')
+            pipe.hincrby(key, 'count', 1)
+            pipe.hincrbyfloat(key, 'duration', duration)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    pipe.hincrby(key, f'le{i}', 1)
+            pipe.hincrby(key, 'db_queries', sample.db_queries)
+            for attribute in ('db_seconds', 'redis_seconds', 'stripe_seconds'):
+                value = getattr(sample, attribute)
+                if value:
+                    pipe.hincrbyfloat(key, attribute, value)
+            pipe.execute()
+        except redis.RedisError:
+            pass
+
+    def get(self, kind, name):
+        fields = self._client().hgetall(self._key(kind, name))
+        return Series(fields) if fields else None
+
+    def _all(self):
+        client = self._client()
+        members = sorted(tuple(member.decode().split('|', 1)) for member in client.smembers(self.SERIES_KEY))
+        pipe = client.pipeline(transaction=False)
+        for kind, name in members:
+            pipe.hgetall(self._key(kind, name))
+        return [((kind, name), Series(fields)) for (kind, name), fields in zip(members, pipe.execute()) if fields]
+
+    def render(self) -> str:
+        items = self._all()
+        lines = [f'scooters_metrics_sample_rate {settings.METRICS_SAMPLE_RATE}']
+        for kind in ('view', 'task'):
+            series = [(name, s) for (k, name), s in items if k == kind]
+            if not series:
+                continue
+            metric = f'scooters_{kind}_duration_seconds'
+            lines.append(f'# HELP {metric} Duration of sampled {kind}s')
+            lines.append(f'# TYPE {metric} histogram')
+            for name, s in series:
+                for bound, count in zip(DURATION_BUCKETS, s.buckets):
+                    lines.append(f'{metric}_bucket{{{kind}="{name}",le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{{kind}="{name}",le="+Inf"}} {s.count}')
+                lines.append(f'{metric}_sum{{{kind}="{name}"}} {s.duration:.6f}')
+                lines.append(f'{metric}_count{{{kind}="{name}"}} {s.count}')
+            for attribute, help_text in self.counters:
+                metric = f'scooters_{kind}_{attribute}_total'
+                lines.append(f'# HELP {metric} {help_text} by sampled {kind}s')
+                lines.append(f'# TYPE {metric} counter')
+                for name, s in series:
+                    lines.append(f'{metric}{{{kind}="{name}"}} {getattr(s, attribute)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _start(sample):
+    sample.token = _current.set(sample)
+
+
+def _stop(sample):
+    _current.reset(sample.token)
+
+
+class RequestMetricsMiddleware:
+    """Records sampled requests per resolved view name, under WSGI or ASGI."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _observe(self, request, sample):
+        match = request.resolver_match
+        registry.observe('view', match.view_name if match else 'unresolved', sample)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path == '/metrics' or not sampled():
+            return self.get_response(request)
+        sample = Sample()
+        _start(sample)
+        try:
+            with connection.execute_wrapper(sample):
+                response = self.get_response(request)
+        finally:
+            _stop(sample)
+        self._observe(request, sample)
+        return response
+
+    async def __acall__(self, request):
+        if request.path == '/metrics' or not sampled():
+            return await self.get_response(request)
+        sample = Sample()
+        _start(sample)
+        # The async ORM runs queries on the request's sync thread, so the wrapper goes on its connection
+        await sync_to_async(connection.execute_wrappers.append)(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(connection.execute_wrappers.remove)(sample)
+            _stop(sample)
+        await sync_to_async(self._observe)(request, sample)
+        return response
+
+
+# Celery task_id -> sample of the running task
+_task_samples = {}
+
+
+def task_started(task_id=None, **kwargs):
+    if not sampled():
+        return
+    sample = Sample()
+    _start(sample)
+    connection.execute_wrappers.append(sample)
+    _task_samples[task_id] = sample
+
+
+def task_finished(task_id=None, task=None, **kwargs):
+    sample = _task_samples.pop(task_id, None)
+    if sample is None:
+        return
+    if sample in connection.execute_wrappers:
+        connection.execute_wrappers.remove(sample)
+    _stop(sample)
+    registry.observe('task', task.name, sample)
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        # Without a token the series are only served to a local DEBUG run
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,22 @@
+"""
+Async Redis client for the ASGI read path.
+
+redis.asyncio connections belong to the event loop that opened them, so one
+client is kept per loop. It talks to the cache database; keys shared with
+the Django cache are built with cache.make_key().
+"""
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+from django.conf import settings
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis() -> aioredis.Redis:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = aioredis.Redis.from_url(settings.CACHES['default']['LOCATION'])
+    return client
@@ -47,6 +47,41 @@ RENTAL_CURRENCY = 'uah'
 # Hold amount in major currency units (e.g., 50.00 = 50 UAH = 5000 kopiykas)
 RENTAL_HOLD_AMOUNT = 50.00
 
+# Webhook events are recorded by the view and applied by billing.tasks.process_stripe_events
+STRIPE_EVENT_BATCH_SIZE = 200
+# Seconds events are collected before a processing run, so bursts are applied as one batch
+STRIPE_EVENT_BATCH_DELAY = 1
+# Seconds an event whose intent id no payment has stored yet is retried, and the delay between tries
+STRIPE_EVENT_UNMATCHED_TTL = 600
+STRIPE_EVENT_RETRY_DELAY = 30
+
+# User -> Stripe customer id mapping is cached in Redis in front of billing.StripeCustomer
+STRIPE_CUSTOMER_CACHE_TTL = 60 * 60 * 24
+# Saved payment method lookups (billing.SavedPaymentMethod) are cached the same way
+STRIPE_PAYMENT_METHOD_CACHE_TTL = 60 * 60 * 24
+
+# Stripe calls are performed by billing.tasks after the rental transaction commits
+PAYMENT_OUTBOX_MAX_RETRIES = 8
+# Queue holds to Celery as soon as the rental commits; when off, the dispatch_payment_outbox sweep picks them up
+PAYMENT_OUTBOX_DISPATCH_ON_COMMIT = True
+# Base delay in seconds, doubled on every retry
+PAYMENT_OUTBOX_RETRY_BACKOFF = 5
+# Entries left in processing longer than this are considered abandoned by a dead worker
+PAYMENT_OUTBOX_STALE_SECONDS = 300
+# An entry waiting for an earlier action or for the hold webhook is looked at again after this many
+# seconds, without using up a retry, until it is PAYMENT_OUTBOX_MAX_WAIT seconds old
+PAYMENT_OUTBOX_WAIT_DELAY = 30
+PAYMENT_OUTBOX_MAX_WAIT = 60 * 60 * 24
+
+# End-of-ride Stripe calls are made in batches by the settlement_worker command
+SETTLEMENT_BATCH_SIZE = 200
+# Payments settled in parallel threads, each holding a DB connection
+SETTLEMENT_CONCURRENCY = int(os.environ.get('SETTLEMENT_CONCURRENCY', 8))
+# Outbox entries processed per second across all threads, kept below Stripe's API rate limit
+SETTLEMENT_RATE_LIMIT = float(os.environ.get('SETTLEMENT_RATE_LIMIT', 50))
+# Seconds the worker sleeps when no full batch was due
+SETTLEMENT_POLL_INTERVAL = 1
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -63,6 +98,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'scooters.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -92,14 +128,17 @@ TEMPLATES = [
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "scooters.authentication.CachedJWTAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
     "DEFAULT_THROTTLE_CLASSES": [
         "rest_framework.throttling.UserRateThrottle",
     ],
     "DEFAULT_THROTTLE_RATES": {
-        "user": "30/min",
+        "user": os.environ.get('USER_THROTTLE_RATE', '30/min'),
+        # Token buckets on reserve/start/end (scooters.throttling): burst of N, refilled at N per period
+        "rental_user": os.environ.get('RENTAL_USER_THROTTLE_RATE', '10/min'),
+        "rental_ip": os.environ.get('RENTAL_IP_THROTTLE_RATE', '60/min'),
     },
 }
 
@@ -109,12 +148,41 @@ WSGI_APPLICATION = 'scooters.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgres enables PostgreSQL, otherwise a local SQLite file is used.
+# With DB_POOL_MAX_SIZE set, every process (web or Celery worker) keeps a psycopg
+# connection pool of that size; without it, connections persist for CONN_MAX_AGE.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'scooters'),
+            'USER': os.environ.get('POSTGRES_USER', 'scooters'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'db'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Pooled connections are returned to the pool instead of being kept open per thread
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else int(os.environ.get('CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
-}
 
 
 # Password validation
@@ -142,7 +210,11 @@ CACHES = {
     'default': {
         'BACKEND': 'django_redis.cache.RedisCache',
         'LOCATION': os.environ.get('REDIS_CACHE_URL', 'redis://redis:6379/1'),
-        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            # Times Redis commands for scooters.metrics
+            'CONNECTION_POOL_CLASS': 'scooters.metrics.InstrumentedConnectionPool',
+        },
         'KEY_PREFIX': 'scooters',
     }
 }
@@ -151,11 +223,72 @@ CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_TASK_ALWAYS_EAGER = False
 
+# Peak/off-peak tariff windows are evaluated in this time zone
+PRICING_TIME_ZONE = os.environ.get('PRICING_TIME_ZONE', 'Europe/Kyiv')
+
+# Seconds the user of a JWT is served from Redis / from process memory (scooters.authentication)
+AUTH_USER_CACHE_TTL = 60
+AUTH_USER_LOCAL_TTL = 5
+
+# Seconds a process serves the active tariff from memory before re-checking its cache version
+TARIFF_LOCAL_TTL = 5
+
+# Per-view/per-task query counts and DB, Redis and Stripe time, served on /metrics
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Fraction of requests and tasks instrumented
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1))
+# /metrics requires 'Authorization: Bearer <token>'; without a token it is only served when DEBUG is on
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Redis lock serializing status changes of one scooter: expiry and max wait in seconds
+SCOOTER_LOCK_TTL = 5
+SCOOTER_LOCK_WAIT = 2
+
+# Seconds a cached /scooters/available/ shard lives if no change of its scooters invalidates it first
+SCOOTER_AVAILABILITY_CACHE_TTL = 30
+# Consecutive scooter numbers cached and invalidated together by rental.services.availability
+SCOOTER_AVAILABILITY_SHARD_SIZE = 100
+
+# Seconds a successful response is replayed for its Idempotency-Key (scooters.idempotency), and
+# seconds the key stays in flight; the latter must outlast SCOOTER_LOCK_WAIT plus the transaction
+IDEMPOTENCY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TTL = 30
+
+# Status stream (rental.services.status_stream): events buffered per client before it is
+# disconnected as too slow, and seconds between keepalive comments on an idle stream
+SCOOTER_STREAM_QUEUE_SIZE = 256
+SCOOTER_STREAM_HEARTBEAT = 15
+
+# Max reservations expired per UPDATE statement by rental.tasks.expire_reservations
+RESERVATION_EXPIRY_BATCH_SIZE = 1000
+# Upper bound in seconds on how long the expiry worker sleeps between Redis polls
+RESERVATION_EXPIRY_POLL_INTERVAL = 0.5
+
+# Telemetry frames applied per conditional UPDATE
+TELEMETRY_CHUNK_SIZE = 500
+# Seconds a telemetry timestamp may be ahead of the server clock before the frame is rejected
+TELEMETRY_MAX_CLOCK_SKEW = 300
+# Queue telemetry to the Celery 'telemetry' queue instead of applying it in the request
+TELEMETRY_INGEST_ASYNC = os.environ.get('TELEMETRY_INGEST_ASYNC', '1') == '1'
+
+CELERY_TASK_ROUTES = {
+    'rental.tasks.ingest_telemetry': {'queue': 'telemetry'},
+}
+
 CELERY_BEAT_SCHEDULE = {
-    'expire_reservations_every_minute': {
+    # Reservations are expired by the expire_reservations_worker command, this sweep is a safety net
+    'expire_reservations_safety_sweep': {
         'task': 'rental.tasks.expire_reservations',
+        'schedule': timedelta(minutes=10),
+    },
+    'process_stripe_events_every_minute': {
+        'task': 'billing.tasks.process_stripe_events',
         'schedule': timedelta(minutes=1),
-    }
+    },
+    'dispatch_payment_outbox_every_minute': {
+        'task': 'billing.tasks.dispatch_payment_outbox',
+        'schedule': timedelta(minutes=1),
+    },
 }
 
 # Internationalization
@@ -0,0 +1,102 @@
+"""
+Token-bucket throttles for the rental actions.
+
+A rate of "N/period" is a bucket of N tokens refilled at N per period, so a
+client may burst up to N requests and is then held to the average rate.
+Refill and take happen in one Lua script on Redis time, which keeps buckets
+exact across processes without any read-modify-write race. Rejected requests
+get a 429 with Retry-After set to when the next token is due. The async read
+views (rental.async_views) take their tokens through redis.asyncio.
+"""
+from django_redis import get_redis_connection
+from rest_framework.throttling import SimpleRateThrottle
+
+from scooters.redis_async import get_async_redis
+
+# KEYS[1] bucket hash, ARGV[1] capacity, ARGV[2] tokens per millisecond.
+# Returns {1, 0} when a token was taken, else {0, milliseconds until one is available}.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed, wait = 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, wait}
+"""
+
+
+def take_token(key: str, capacity: int, period_seconds: int):
+    """Take one token from the bucket. Returns (allowed, seconds until the next token)."""
+    client = get_redis_connection('default')
+    allowed, wait_ms = client.eval(TAKE_SCRIPT, 1, key, capacity, capacity / (period_seconds * 1000))
+    return bool(allowed), wait_ms / 1000
+
+
+async def atake_token(key: str, capacity: int, period_seconds: int):
+    """take_token() over the async Redis client of the running event loop."""
+    client = get_async_redis()
+    allowed, wait_ms = await client.eval(TAKE_SCRIPT, 1, key, capacity, capacity / (period_seconds * 1000))
+    return bool(allowed), wait_ms / 1000
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """SimpleRateThrottle scopes and rates, counted in a Redis token bucket instead of a request history."""
+    cache_format = 'throttle:bucket:%(scope)s:%(ident)s'
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self._wait = take_token(self.key, self.num_requests, self.duration)
+        return allowed
+
+    async def aallow_request(self, request, view=None):
+        """allow_request() for async views, without blocking the event loop."""
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        allowed, self._wait = await atake_token(self.key, self.num_requests, self.duration)
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """The 'user' rate of the DRF views, for the async read views that bypass the DRF stack."""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': request.user.pk}
+
+
+class RentalUserThrottle(UserTokenBucketThrottle):
+    scope = 'rental_user'
+
+
+class RentalIPThrottle(TokenBucketThrottle):
+    scope = 'rental_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+RENTAL_THROTTLES = [RentalUserThrottle, RentalIPThrottle]
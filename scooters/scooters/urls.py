@@ -23,6 +23,8 @@ from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rental.urls import router
 from billing import urls as billing_urls
+from rental import async_views
+from scooters.metrics import metrics_view
 
 def ping(request):
     return JsonResponse({'status': 'ok'})
@@ -35,9 +37,16 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     # API
     path('api/ping/', ping),
+    path('metrics', metrics_view, name='metrics'),
     path('api/', include(router.urls)),
+    # Async read path, see rental.async_views
+    path('api/async/scooters/available/', async_views.available_scooters, name='async-scooter-available'),
+    path('api/async/scooters/stream/', async_views.status_stream, name='async-scooter-stream'),
+    path('api/async/reservations/', async_views.my_reservations, name='async-reservation-list'),
+    path('api/async/rentals/', async_views.my_rentals, name='async-rental-list'),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
     
     path('api/stripe/', include(billing_urls)),
+    path('api/export/', include(billing_urls.export_urlpatterns)),
 ]